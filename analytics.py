@@ -0,0 +1,331 @@
+"""
+Analityka logu zdarzeń na kolumnach NumPy (przepustowość maszyn, TRANSFER_AUTO, błędy).
+
+- Wiersze z events (albo error_logs) dla zakresu dat są wczytywane partiami
+  (ANALYTICS_CHUNK_ROWS) do kolumn: czas jako int64 (sekundy UTC, liczone przez SQLite),
+  kolumny tekstowe (operacja, posiadacz, użytkownik, status) kodowane słownikiem do int32.
+- Agregacje bez pętli po wierszach: filtr = maska np.isin na kodach, grupowanie = jeden
+  klucz złożony (np.ravel_multi_index) + np.unique(return_counts), okna czasowe (godzina,
+  zmiana, dzień) w strefie ANALYTICS_TIMEZONE liczone wektorowo (przesunięcie strefy
+  wyznaczane raz na godzinę, nie na wiersz).
+- Wczytana ramka jest trzymana w pamięci workera ANALYTICS_CACHE_SECONDS - kolejne
+  grupowania tego samego zakresu nie czytają bazy.
+- Wskaźnik błędów: te same grupy dla source=errors (error_logs) i source=events.
+- NumPy jest opcjonalny (pip install numpy) - bez niego analityka zwraca 503. Importujemy
+  go przy pierwszej analizie (_numpy), nie przy starcie workera.
+
+Zakres from/to jak w floor_state.parse_at (ISO 8601, bez strefy = UTC), domyślnie
+ostatnie 30 dni; okna i ich etykiety w czasie lokalnym ANALYTICS_TIMEZONE.
+
+Konfiguracja (zmienne środowiskowe):
+- ANALYTICS_TIMEZONE        - strefa okien czasowych (domyślnie Europe/Warsaw)
+- ANALYTICS_SHIFT_STARTS    - godziny początku zmian, np. "6,14,22"
+- ANALYTICS_CHUNK_ROWS      - wierszy na partię odczytu
+- ANALYTICS_MAX_DAYS        - maks. długość zakresu
+- ANALYTICS_CACHE_SECONDS   - jak długo trzymać wczytaną ramkę (0 = bez cache)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import floor_state
+import records
+
+np = None                 # moduł numpy po pierwszym _numpy()
+_numpy_missing = False
+
+try:
+    from zoneinfo import ZoneInfo
+    ANALYTICS_TIMEZONE = ZoneInfo(os.environ.get('ANALYTICS_TIMEZONE', 'Europe/Warsaw'))
+except Exception:  # brak bazy stref (tzdata) - okna w UTC
+    ANALYTICS_TIMEZONE = timezone.utc
+
+ANALYTICS_SHIFT_STARTS = tuple(
+    int(hour) for hour in os.environ.get('ANALYTICS_SHIFT_STARTS', '6,14,22').split(',') if hour.strip()
+)
+ANALYTICS_CHUNK_ROWS = int(os.environ.get('ANALYTICS_CHUNK_ROWS', '50000'))
+ANALYTICS_MAX_DAYS = int(os.environ.get('ANALYTICS_MAX_DAYS', '366'))
+ANALYTICS_CACHE_SECONDS = float(os.environ.get('ANALYTICS_CACHE_SECONDS', '30'))
+ANALYTICS_CACHE_MAX_FRAMES = 4
+DEFAULT_RANGE_DAYS = 30
+MAX_ROWS_LIMIT = 100000
+
+# Źródła: tabela, kolumna czasu i pola (nazwa w API -> kolumna)
+SOURCES = {
+    "events": {
+        "table": "events",
+        "time": "timestamp",
+        "fields": {
+            "operation": "operation",
+            "holder": "to_holder",
+            "from_holder": "from_holder",
+            "status": "to_status",
+            "from_status": "from_status",
+            "user": "user_id",
+        },
+    },
+    "errors": {
+        "table": "error_logs",
+        "time": "created_at",
+        "fields": {
+            "error_code": "error_code",
+            "holder": "location_id",
+            "user": "user_id",
+        },
+    },
+}
+WINDOWS = ("none", "hour", "shift", "day")
+
+# (źródło, start, end) -> (wczytano o, ramka)
+_frames: "OrderedDict[tuple, tuple]" = OrderedDict()
+_frames_lock = threading.Lock()
+
+
+def _numpy():
+    """Moduł numpy, importowany przy pierwszym użyciu; None = brak NumPy (analityka wyłączona)."""
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:  # opcjonalne
+            _numpy_missing = True
+        else:
+            np = numpy
+    return np
+
+
+def _reset_after_fork():
+    global _frames_lock
+    _frames_lock = threading.Lock()
+    _frames.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class EventFrame:
+    """Kolumny jednego zakresu: czas (int64) i kody pól (int32) ze słownikami kod -> wartość."""
+
+    __slots__ = ("source", "start", "end", "ts", "codes", "labels", "load_ms")
+
+    def __init__(self, source: str, start: str, end: str, ts, codes: Dict[str, "np.ndarray"],
+                 labels: Dict[str, list], load_ms: float):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.ts = ts
+        self.codes = codes
+        self.labels = labels
+        self.load_ms = load_ms
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+def load_frame(database, source: str, start: str, end: str) -> EventFrame:
+    """Wiersze źródła z czasem w [start, end) -> EventFrame (odczyt partiami, kodowanie słownikiem)."""
+    _numpy()
+    spec = SOURCES[source]
+    fields = list(spec["fields"].items())
+    started = time.perf_counter()
+    sql = (
+        f"SELECT CAST(strftime('%s', {spec['time']}) AS INTEGER), "
+        f"{', '.join(column for _, column in fields)} FROM {spec['table']} "
+        f"WHERE {spec['time']} >= ? AND {spec['time']} < ?"
+    )
+    encoders: List[dict] = [{} for _ in fields]
+    ts_chunks = []
+    code_chunks: List[list] = [[] for _ in fields]
+    conn = database.get_connection()
+    try:
+        cursor = records.tuple_cursor(conn)
+        cursor.execute(sql, (start, end))
+        while True:
+            rows = cursor.fetchmany(ANALYTICS_CHUNK_ROWS)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            ts_chunks.append(np.array(columns[0], dtype=np.int64))
+            for index, encoder in enumerate(encoders):
+                column = columns[index + 1]
+                # Nowe wartości do słownika (set() w C), potem kody bez pętli Pythona (map w C)
+                for value in set(column).difference(encoder):
+                    encoder[value] = len(encoder)
+                code_chunks[index].append(np.fromiter(map(encoder.__getitem__, column), dtype=np.int32, count=len(rows)))
+    finally:
+        conn.close()
+
+    def concat(chunks, dtype):
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+    return EventFrame(
+        source, start, end,
+        concat(ts_chunks, np.int64),
+        {name: concat(code_chunks[index], np.int32) for index, (name, _) in enumerate(fields)},
+        {name: list(encoders[index]) for index, (name, _) in enumerate(fields)},
+        (time.perf_counter() - started) * 1000.0,
+    )
+
+
+def _cached_frame(database, source: str, start: str, end: str) -> tuple:
+    """Ramka z cache workera (świeża) albo wczytana z bazy -> (ramka, czy z cache)."""
+    key = (source, start, end)
+    now = time.monotonic()
+    if ANALYTICS_CACHE_SECONDS > 0:
+        with _frames_lock:
+            cached = _frames.get(key)
+            if cached is not None and now - cached[0] < ANALYTICS_CACHE_SECONDS:
+                _frames.move_to_end(key)
+                return cached[1], True
+    frame = load_frame(database, source, start, end)
+    if ANALYTICS_CACHE_SECONDS > 0:
+        with _frames_lock:
+            _frames[key] = (now, frame)
+            while len(_frames) > ANALYTICS_CACHE_MAX_FRAMES:
+                _frames.popitem(last=False)
+    return frame, False
+
+
+def _local_seconds(ts):
+    """Sekundy UTC -> sekundy czasu lokalnego (przesunięcie strefy raz na każdą godzinę UTC)."""
+    if ANALYTICS_TIMEZONE is timezone.utc or not len(ts):
+        return ts
+    hours, inverse = np.unique(ts // 3600, return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(int(hour) * 3600, ANALYTICS_TIMEZONE).utcoffset().total_seconds()
+        for hour in hours
+    ], dtype=np.int64)
+    return ts + offsets[inverse.reshape(-1)]
+
+
+def window_index(ts, window: str) -> tuple:
+    """Okno każdego wiersza -> (indeksy okien, etykiety okien 'YYYY-MM-DD HH:MM' czasu lokalnego)."""
+    local = _local_seconds(ts)
+    if window == "hour":
+        starts = local - local % 3600
+    elif window == "day":
+        starts = local - local % 86400
+    else:
+        # Zmiana = ostatni początek zmiany <= czas; przed pierwszym - ostatnia zmiana poprzedniego dnia
+        boundaries = np.array(sorted(hour * 3600 for hour in ANALYTICS_SHIFT_STARTS) or [0], dtype=np.int64)
+        day = local - local % 86400
+        slot = np.searchsorted(boundaries, local - day, side="right") - 1
+        starts = np.where(slot >= 0, day + boundaries[slot], day - 86400 + boundaries[-1])
+    unique_starts, inverse = np.unique(starts, return_inverse=True)
+    labels = [
+        datetime.fromtimestamp(int(start), timezone.utc).strftime("%Y-%m-%d %H:%M") for start in unique_starts
+    ]
+    return inverse.reshape(-1), labels
+
+
+def group_count(frame: EventFrame, group_by: List[str], window: str = "none",
+                filters: Optional[Dict[str, List[str]]] = None) -> tuple:
+    """
+    Liczba wierszy wg pól group_by (i okna czasowego) po filtrach {pole: [wartości]}.
+    Zwraca (liczba pasujących wierszy, lista grup [(etykieta okna lub None, wartości pól, liczba)]).
+    """
+    mask = np.ones(len(frame), dtype=bool)
+    for field, values in (filters or {}).items():
+        labels = frame.labels[field]
+        wanted = [code for code, label in enumerate(labels) if label in values]
+        mask &= np.isin(frame.codes[field], np.array(wanted, dtype=np.int32))
+    matched = int(mask.sum())
+
+    keys = [frame.codes[field][mask] for field in group_by]
+    sizes = [max(1, len(frame.labels[field])) for field in group_by]
+    window_labels = None
+    if window != "none":
+        window_ids, window_labels = window_index(frame.ts[mask], window)
+        keys.insert(0, window_ids)
+        sizes.insert(0, max(1, len(window_labels)))
+    if not keys:
+        return matched, [(None, (), matched)] if matched else []
+
+    composite = np.ravel_multi_index(keys, sizes)
+    unique, counts = np.unique(composite, return_counts=True)
+    parts = [part.tolist() for part in np.unravel_index(unique, sizes)]
+    if window_labels is not None:
+        windows = [window_labels[index] for index in parts.pop(0)]
+    else:
+        windows = [None] * len(unique)
+    values = [[frame.labels[field][code] for code in codes] for field, codes in zip(group_by, parts)]
+    return matched, [
+        (windows[row], tuple(column[row] for column in values), int(counts[row]))
+        for row in range(len(unique))
+    ]
+
+
+def _range(start: Optional[str], end: Optional[str]) -> tuple:
+    """from/to (ISO 8601) -> ('YYYY-MM-DD HH:MM:SS' UTC, ...); domyślnie ostatnie DEFAULT_RANGE_DAYS dni."""
+    end_ts = floor_state.parse_at(end) if end else None
+    if end and end_ts is None:
+        raise ValueError(end)
+    if end_ts is None:
+        # Pełna minuta - kolejne zapytania w tej samej minucie trafiają w cache ramki
+        now = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end_ts = now.strftime(floor_state.TIMESTAMP_FORMAT)
+    start_ts = floor_state.parse_at(start) if start else None
+    if start and start_ts is None:
+        raise ValueError(start)
+    if start_ts is None:
+        start_ts = (datetime.fromisoformat(end_ts) - timedelta(days=DEFAULT_RANGE_DAYS)).strftime(floor_state.TIMESTAMP_FORMAT)
+    return start_ts, end_ts
+
+
+def aggregate(database, source: str = "events", group_by: Optional[List[str]] = None, window: str = "none",
+              start: Optional[str] = None, end: Optional[str] = None,
+              filters: Optional[Dict[str, List[str]]] = None, limit: int = 10000) -> dict:
+    """Grupowanie dla endpointu: walidacja parametrów, ramka (z cache), wynik w formacie API."""
+    if _numpy() is None:
+        return {"success": False, "error": "Analityka wymaga NumPy (pip install numpy)", "status": 503}
+    spec = SOURCES.get(source)
+    if spec is None:
+        return {"success": False, "error": f"Nieznane zrodlo (dozwolone: {', '.join(SOURCES)})", "status": 400}
+    group_by = group_by or []
+    filters = filters or {}
+    unknown = [field for field in list(group_by) + list(filters) if field not in spec["fields"]]
+    if unknown or len(set(group_by)) != len(group_by):
+        return {"success": False, "error": f"Nieprawidlowe pola: {', '.join(unknown) or 'powtorzone'} "
+                                           f"(dozwolone: {', '.join(spec['fields'])})", "status": 400}
+    if window not in WINDOWS:
+        return {"success": False, "error": f"Nieprawidlowe okno (dozwolone: {', '.join(WINDOWS)})", "status": 400}
+    try:
+        start_ts, end_ts = _range(start, end)
+    except ValueError:
+        return {"success": False, "error": "Nieprawidlowy zakres dat (ISO 8601)", "status": 400}
+    if start_ts >= end_ts:
+        return {"success": False, "error": "Pusty zakres dat (from >= to)", "status": 400}
+    if datetime.fromisoformat(end_ts) - datetime.fromisoformat(start_ts) > timedelta(days=ANALYTICS_MAX_DAYS):
+        return {"success": False, "error": f"Zakres dluzszy niz {ANALYTICS_MAX_DAYS} dni", "status": 400}
+
+    frame, cached = _cached_frame(database, source, start_ts, end_ts)
+    started = time.perf_counter()
+    matched, groups = group_count(frame, group_by, window, filters)
+    limit = max(1, min(limit, MAX_ROWS_LIMIT))
+    rows = []
+    for window_label, values, count in groups[:limit]:
+        row = {"window": window_label} if window != "none" else {}
+        row.update(zip(group_by, values))
+        row["count"] = count
+        rows.append(row)
+    return {
+        "success": True,
+        "source": source,
+        "from": start_ts,
+        "to": end_ts,
+        "timezone": str(ANALYTICS_TIMEZONE),
+        "window": window,
+        "group_by": group_by,
+        "filters": filters,
+        "rows_scanned": len(frame),
+        "matched": matched,
+        "groups": len(groups),
+        "truncated": len(groups) > limit,
+        "rows": rows,
+        "cached": cached,
+        "load_ms": frame.load_ms,
+        "aggregate_ms": (time.perf_counter() - started) * 1000.0,
+    }
@@ -4,22 +4,50 @@ Serwer API dla Systemu Obiegu Kopert.
 
 Uruchomienie: python3 api_server.py
 Serwer dostępny na: http://localhost:5000
+Profil zimnego startu: STARTUP_PROFILE=1 (startup_profile.py)
 """
-from flask import Flask, jsonify, request, send_file, Response
+if __name__ == '__main__':
+    # `python api_server.py`: serwer startuje z modułu api_server (zwykły import), a plik
+    # jako __main__ kończy się na tym bloku. Procesy puli zdjęć (image_processing, start
+    # spawn/forkserver) importują plik __main__ ponownie jako __mp_main__ - bez __file__
+    # i __spec__ nie mają czego importować, więc proces puli kosztuje tylko import
+    # image_processing (bez bazy, assetów, metryk i Flask). gunicorn: __main__ to gunicorn.
+    import sys
+    import api_server
+    sys.modules['__main__'].__file__ = None
+    sys.modules['__main__'].__spec__ = None
+    api_server.main()
+    sys.exit(0)
+
+import startup_profile
+from flask import Flask, jsonify, request, send_file, Response, g
 from flask_cors import CORS
 from database import db
-from domain import EnvelopeStatus, HolderType, CreationReason, Envelope
+from domain import EnvelopeStatus, HolderType, CreationReason, Envelope, Operation
 import json
 from datetime import datetime
 import os
 import hashlib
 import hmac
-import io
+import threading
 import time
 import uuid
-from collections import defaultdict, deque
+from collections import OrderedDict
 from pathlib import Path
-from PIL import Image, UnidentifiedImageError
+import analytics
+import dwell_rollups
+import floor_state
+import image_processing
+import json_provider
+import note_images_gc
+import rate_limit
+import metrics
+import response_compression
+import sql_trace
+import static_assets
+from shared_epochs import SharedEpochs
+
+startup_profile.checkpoint("imports")
 
 # --- Kody błędów zgodne ze specyfikacją v2.0 ---
 ERROR_CODES = {
@@ -32,6 +60,7 @@ ERROR_CODES = {
 }
 
 app = Flask(__name__)
+json_provider.install(app)  # orjson (jeśli jest) + strumieniowanie dużych list w jsonify
 CORS(app)  # Pozwala na zapytania z przeglądarki (prototype.html)
 
 APP_ENV = os.environ.get('APP_ENV', 'development').lower()
@@ -46,10 +75,40 @@ NOTE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 SIGNED_URL_TTL_SECONDS = int(os.environ.get('SIGNED_URL_TTL_SECONDS', '600'))
 MAX_IMAGE_UPLOAD_BYTES = 10 * 1024 * 1024
 MAX_IMAGES_PER_NOTE = 3
+# Parametr ?size= dla /api/note-images/<id>/file
+IMAGE_SIZE_ALIASES = {"full": "full", "preview": "preview", "thumb": "thumb"}
+IMAGE_SIZE_ALIASES.update({str(px): name for name, px in image_processing.IMAGE_VARIANT_SIZES.items()})
+IMAGE_SIZE_ALIASES[str(image_processing.MAX_IMAGE_DIM)] = "full"
 app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_UPLOAD_BYTES + 1024 * 1024
+# Za nginx/Apache z X-Sendfile serwer proxy wysyła plik sam (send_file zwraca tylko nagłówek)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+# Pliki frontendu: odciski treści + warianty gzip/brotli (static_assets.py), budowane raz
+# przy starcie (z preload_app - w masterze gunicorna). W development przebudowa po zmianie pliku.
+STATIC_ASSETS = static_assets.AssetPipeline(reload=APP_ENV == 'development')
+with startup_profile.phase("static_assets"):
+    STATIC_ASSETS.build()
+
+PRODUCT_NOTES_CACHE_TTL_SECONDS = int(os.environ.get('PRODUCT_NOTES_CACHE_TTL_SECONDS', '300'))
+PRODUCT_NOTES_CACHE_MAX_ENTRIES = int(os.environ.get('PRODUCT_NOTES_CACHE_MAX_ENTRIES', '2048'))
+
+
+# Cache notatek produkt+maszyna: (product_code, machine_id) -> (expires_at, epoki, bundle z bazy).
+# Trzymamy surowe wiersze - signed URL-e zdjęć generujemy przy każdej odpowiedzi.
+# Cache jest per worker; unieważnienia rozchodzą się przez epoki w pamięci współdzielonej
+# (klucz epoki = product_code), tworzone tu, przed fork workerów.
+_product_notes_cache: "OrderedDict[tuple[str, str], tuple[float, tuple, dict]]" = OrderedDict()
+_product_notes_cache_lock = threading.Lock()
+_product_notes_epochs = SharedEpochs()
+
 
-_rate_limit_store: dict[str, deque[float]] = defaultdict(deque)
-_note_image_metrics: dict[str, int] = defaultdict(int)
+def _reset_product_notes_cache_after_fork() -> None:
+    global _product_notes_cache_lock
+    _product_notes_cache_lock = threading.Lock()
+    _product_notes_cache.clear()
+
+
+os.register_at_fork(after_in_child=_reset_product_notes_cache_after_fork)
 
 # ========================
 # POMOCNICZE FUNKCJE
@@ -128,18 +187,76 @@ def init_demo_envelopes():
 
 
 def _is_rate_limited(key: str, max_requests: int, window_seconds: int) -> bool:
-    now = time.time()
-    bucket = _rate_limit_store[key]
-    while bucket and now - bucket[0] > window_seconds:
-        bucket.popleft()
-    if len(bucket) >= max_requests:
-        return True
-    bucket.append(now)
-    return False
+    # Token bucket; backend (pamięć procesu / wspólny plik SQLite) wg RATE_LIMIT_BACKEND
+    return rate_limit.is_rate_limited(key, max_requests, window_seconds)
 
 
 def _increment_note_metric(metric_name: str) -> None:
-    _note_image_metrics[metric_name] += 1
+    metrics.inc("note_image_events_total", event=metric_name)
+
+
+def _record_envelope_result(operation: str, result: dict) -> None:
+    """Liczniki biznesowe: udane zmiany stanu wg operacji i odrzucenia wg kodu błędu."""
+    if result.get("success"):
+        count = result.get("moved", 1)  # operacje na wózku: liczba przeniesionych kopert
+        if result.get("operation") == "ALREADY_ON_MACHINE":
+            count = 0  # koperta już na tej maszynie - bez zdarzenia i zmiany stanu
+        if count:
+            metrics.inc("envelope_transitions_total", count, operation=result.get("operation") or operation)
+            floor_state.note_operations(count, db)
+            dwell_rollups.note_operations(count, db)
+    else:
+        error_code = result.get("error_code")
+        metrics.inc("envelope_errors_total", error_code=error_code if error_code in ERROR_CODES else "OTHER")
+
+
+def _get_product_notes_bundle(product_code: str, machine_id: str) -> dict:
+    """Zwraca notatki produkt+maszyna (ze zdjęciami) z cache lub z bazy."""
+    key = (product_code, machine_id)
+    now = time.monotonic()
+    # Epoki odczytane przed zapytaniem - zapis w trakcie odczytu unieważni ten wpis
+    epochs = _product_notes_epochs.snapshot(product_code)
+    with _product_notes_cache_lock:
+        cached = _product_notes_cache.get(key)
+        if cached and cached[0] > now and cached[1] == epochs:
+            _product_notes_cache.move_to_end(key)
+            return cached[2]
+
+    bundle = db.get_product_machine_notes_bundle(product_code, machine_id)
+
+    with _product_notes_cache_lock:
+        _product_notes_cache[key] = (now + PRODUCT_NOTES_CACHE_TTL_SECONDS, epochs, bundle)
+        _product_notes_cache.move_to_end(key)
+        while len(_product_notes_cache) > PRODUCT_NOTES_CACHE_MAX_ENTRIES:
+            _product_notes_cache.popitem(last=False)
+    return bundle
+
+
+def _invalidate_product_notes_cache(product_code: str = None, note_id: int = None) -> None:
+    """
+    Unieważnia wpisy dla produktu (wszystkie maszyny - notatka globalna jest wspólna)
+    lub wpisy zawierające notatkę o danym ID (zapisy zdjęć) - we wszystkich workerach.
+    Produkt notatki znamy tylko z lokalnego cache; gdy go tu nie ma, unieważniamy wszystko.
+    """
+    if note_id is not None and product_code is None:
+        with _product_notes_cache_lock:
+            for key, (_expires_at, _epochs, bundle) in _product_notes_cache.items():
+                notes = (bundle.get("specific_note"), bundle.get("global_note"))
+                if any(note and note["id"] == note_id for note in notes):
+                    product_code = key[0]
+                    break
+    _product_notes_epochs.bump(product_code)
+    with _product_notes_cache_lock:
+        if product_code is None:
+            _product_notes_cache.clear()
+            return
+        for key in [key for key in _product_notes_cache if key[0] == product_code]:
+            _product_notes_cache.pop(key, None)
+
+
+def _invalidate_note_images_cache(note_scope: str, note_id: int) -> None:
+    if note_scope == 'product_machine_note':
+        _invalidate_product_notes_cache(note_id=note_id)
 
 
 def _supported_image_magic(data: bytes) -> bool:
@@ -163,37 +280,7 @@ def _normalize_image_to_webp(file_storage):
     if not _supported_image_magic(raw):
         return None, "Nieprawidlowy format obrazu (magic bytes)", 400
 
-    try:
-        image = Image.open(io.BytesIO(raw))
-        image.load()
-    except UnidentifiedImageError:
-        return None, "Nie udalo sie odczytac obrazu", 400
-    except Exception as e:
-        return None, f"Uszkodzony obraz: {e}", 400
-
-    if image.mode not in ("RGB", "RGBA"):
-        image = image.convert("RGB")
-
-    max_dim = 1600
-    image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
-    if image.mode == "RGBA":
-        bg = Image.new("RGB", image.size, (255, 255, 255))
-        bg.paste(image, mask=image.split()[3])
-        image = bg
-
-    out = io.BytesIO()
-    image.save(out, format='WEBP', quality=82, method=6)
-    webp_bytes = out.getvalue()
-    sha256_hex = hashlib.sha256(webp_bytes).hexdigest()
-
-    return {
-        "bytes": webp_bytes,
-        "mime_type": "image/webp",
-        "width": image.width,
-        "height": image.height,
-        "size_bytes": len(webp_bytes),
-        "sha256": sha256_hex,
-    }, None, 200
+    return image_processing.normalize_image(raw)
 
 
 def _sign_image_token(image_id: int, exp: int) -> str:
@@ -201,9 +288,12 @@ def _sign_image_token(image_id: int, exp: int) -> str:
     return hmac.new(IMAGE_SIGNING_SECRET.encode("utf-8"), payload, hashlib.sha256).hexdigest()
 
 
-def _build_signed_image_url(image_id: int, exp: int) -> str:
+def _build_signed_image_url(image_id: int, exp: int, size: str = None) -> str:
     sig = _sign_image_token(image_id, exp)
-    return f"/api/note-images/{image_id}/file?exp={exp}&sig={sig}"
+    url = f"/api/note-images/{image_id}/file?exp={exp}&sig={sig}"
+    if size:
+        url += f"&size={size}"
+    return url
 
 
 def _verify_signed_image_url(image_id: int, exp_raw: str, sig: str) -> bool:
@@ -219,8 +309,74 @@ def _verify_signed_image_url(image_id: int, exp_raw: str, sig: str) -> bool:
     return hmac.compare_digest(expected, sig or "")
 
 
+def _image_files_for_upload(normalized: dict, rel_path: str, variants_meta: dict) -> list:
+    """Lista (ścieżka względna, bajty) plików do zapisania dla znormalizowanego obrazu."""
+    files = [(rel_path, normalized["bytes"])]
+    for variant_name, variant_meta in (variants_meta or {}).items():
+        variant = normalized.get("variants", {}).get(variant_name)
+        if variant and variant_meta.get("path"):
+            files.append((variant_meta["path"], variant["bytes"]))
+    return files
+
+
+def _ensure_image_files(files: list) -> list:
+    """
+    Zapisuje brakujące pliki (zapis do pliku tymczasowego + os.replace).
+    Istniejące pliki adresowane treścią pomijamy. Zwraca ścieżki względne zapisanych plików.
+    """
+    written = []
+    for rel_path, data in files:
+        abs_path = NOTE_IMAGES_DIR / rel_path
+        if abs_path.exists():
+            continue
+        abs_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = abs_path.with_name(f".{abs_path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, abs_path)
+        written.append(rel_path)
+    return written
+
+
+def _remove_image_files(rel_paths: list) -> None:
+    for rel_path in rel_paths:
+        abs_path = NOTE_IMAGES_DIR / rel_path
+        try:
+            if abs_path.exists():
+                abs_path.unlink()
+        except Exception:
+            pass
+
+
+def _resolve_image_variant(image_row: dict, size: str):
+    """
+    Zwraca (ścieżka względna, etag) dla wariantu 'thumb' / 'preview' / 'full'
+    (akceptuje też rozmiar w px). Brak wariantu (stare zdjęcia) -> pełny obraz.
+    """
+    name = IMAGE_SIZE_ALIASES.get(size or "full", "full")
+    variant = (image_row.get("variants") or {}).get(name)
+    if name != "full" and variant and variant.get("path"):
+        return variant["path"], variant.get("sha256")
+    return image_row["storage_path"], image_row.get("sha256")
+
+
 def _serialize_image_meta(image_row: dict) -> dict:
     exp = int(time.time()) + SIGNED_URL_TTL_SECONDS
+    variants = {
+        "full": {
+            "width": image_row["width"],
+            "height": image_row["height"],
+            "size_bytes": image_row["size_bytes"],
+            "signed_url": _build_signed_image_url(image_row["id"], exp),
+        }
+    }
+    for name, variant in (image_row.get("variants") or {}).items():
+        variants[name] = {
+            "width": variant.get("width"),
+            "height": variant.get("height"),
+            "size_bytes": variant.get("size_bytes"),
+            "signed_url": _build_signed_image_url(image_row["id"], exp, name),
+        }
     return {
         "id": image_row["id"],
         "original_filename": image_row.get("original_filename"),
@@ -233,6 +389,7 @@ def _serialize_image_meta(image_row: dict) -> dict:
         "annotations_json": image_row.get("annotations_json") or {"objects": []},
         "etag": image_row.get("sha256"),
         "signed_url": _build_signed_image_url(image_row["id"], exp),
+        "variants": variants,
         "expires_at": exp,
     }
 
@@ -245,17 +402,100 @@ def _parse_note_cursor(cursor_raw: str):
         return None
     return cursor_raw
 
+# ========================
+# METRYKI HTTP
+# ========================
+
+@app.before_request
+def _metrics_before_request():
+    startup_profile.request_started()
+    g.metrics_started = time.perf_counter()
+    metrics.begin_request_sql()
+    if sql_trace.SQL_TRACE_ENABLED:
+        sql_trace.set_route(f"{request.method} {request.url_rule.rule}" if request.url_rule else None)
+
+
+@app.after_request
+def _metrics_after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    status = str(response.status_code)
+    metrics.inc("http_requests_total", method=request.method, route=route, status=status)
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                    method=request.method, route=route, status=status)
+    if response.content_length is not None:
+        metrics.observe("http_response_size_bytes", response.content_length,
+                        method=request.method, route=route, status=status)
+    sql_seconds, sql_queries = metrics.request_sql_stats()
+    metrics.observe("http_request_sql_seconds", sql_seconds, route=route)
+    if sql_queries:
+        metrics.inc("http_request_sql_queries_total", sql_queries, route=route)
+    metrics.maybe_flush()
+    startup_profile.request_finished()
+    return response
+
+
+@app.after_request
+def _compress_response(response):
+    # Zarejestrowany po hooku metryk, więc wykonywany przed nim (Flask: odwrotna kolejność) -
+    # http_response_size_bytes widzi rozmiar po kompresji
+    return response_compression.compress_response(response, request)
+
+
+@app.route('/api/admin/sql-stats', methods=['GET', 'DELETE'])
+def sql_stats():
+    """
+    Top-N instrukcji SQL wg czasu (ten proces). Wymaga SQL_TRACE=1.
+    Parametry: ?limit=20&sort=total_ms|max_ms|avg_ms|count; DELETE zeruje statystyki.
+    """
+    if not sql_trace.SQL_TRACE_ENABLED:
+        return jsonify({"success": False, "error": "Sledzenie SQL wylaczone (SQL_TRACE=1)"}), 404
+    if request.method == 'DELETE':
+        sql_trace.reset_stats()
+        return jsonify({"success": True})
+    limit = max(1, min(request.args.get('limit', 20, type=int), 500))
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "slow_ms": sql_trace.SQL_SLOW_MS,
+        "statements": sql_trace.top_statements(limit, request.args.get('sort', 'total_ms')),
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metryki wszystkich workerów w formacie tekstowym Prometheus."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # ========================
 # ENDPOINTY API
 # ========================
 
 @app.route('/')
 def serve_frontend():
-    return send_file('prototype.html')
+    """Strona główna (HTML z adresami zasobów z odciskiem) - ETag, ponowna wizyta = 304."""
+    asset = STATIC_ASSETS.get('prototype.html')
+    if asset is None:
+        return send_file('prototype.html')
+    return static_assets.make_response(app, request, asset, immutable=False)
+
+@app.route('/assets/<path:filename>')
+def serve_fingerprinted_asset(filename):
+    """Zasób z odciskiem treści - Cache-Control: immutable."""
+    asset, current = STATIC_ASSETS.get_fingerprinted(filename)
+    if asset is None:
+        return jsonify({"error": "File not found"}), 404
+    # Nieaktualny odcisk (HTML sprzed wdrożenia) - bieżąca treść, ale bez immutable
+    return static_assets.make_response(app, request, asset, immutable=current)
 
 @app.route('/<path:filename>')
 def serve_static(filename):
     """Serve static files (.js, .css, .html etc.)"""
+    asset = STATIC_ASSETS.get(filename)
+    if asset is not None:
+        return static_assets.make_response(app, request, asset, immutable=False)
     if filename.endswith(('.js', '.css', '.html')):
         return send_file(filename)
     return jsonify({"error": "File not found"}), 404
@@ -318,15 +558,7 @@ def search_envelopes():
 @app.route('/api/envelopes/<path:envelope_id>/status', methods=['GET'])
 def get_envelope_status(envelope_id):
     """Pobiera aktualny status konkretnej koperty."""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT unique_key, status, current_holder_id, current_holder_type, warehouse_section
-        FROM envelopes WHERE unique_key = ?
-    """, (envelope_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
+    row = db.get_envelope_status(envelope_id)
     if not row:
         return jsonify({"error": "Koperta nie znaleziona"}), 404
     
@@ -355,6 +587,7 @@ def issue_envelope_from_warehouse(envelope_id):
     user_id = data.get('user_id', 'UNKNOWN')
     
     result = db.issue_envelope(envelope_id, cart_id, user_id)
+    _record_envelope_result("ISSUE", result)
     
     if result.get("success"):
         return jsonify({
@@ -382,6 +615,7 @@ def load_envelope_to_machine(envelope_id):
     operator_id = data.get('operator_id') or machine
     
     result = db.bind_envelope_to_machine(envelope_id, machine, operator_id)
+    _record_envelope_result("LOAD", result)
     
     if result.get("success"):
         op = result.get("operation")
@@ -436,6 +670,7 @@ def release_envelope(envelope_id):
     data = request.get_json() or {}
     
     result = db.release_envelope(envelope_id)
+    _record_envelope_result("RELEASE", result)
     
     if result.get("success"):
         return jsonify({
@@ -460,6 +695,7 @@ def return_envelope_to_warehouse(envelope_id):
     location = data.get('location', 'Sekcja A')
     
     result = db.return_to_warehouse(envelope_id, location)
+    _record_envelope_result("RETURN", result)
     
     if result.get("success"):
         return jsonify({
@@ -558,67 +794,37 @@ def handle_product_machine_note(product_code, machine_id):
     Dla POST: tworzy lub aktualizuje notatkę.
     Dla DELETE: usuwa (soft-delete).
     """
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # --- GET ---
+    # --- GET --- (z cache, bez własnego połączenia)
     if request.method == 'GET':
-        # Pobierz notatkę specyficzną dla tej maszyny
-        cursor.execute("""
-            SELECT id, product_code, machine_id, note_content, note_type,
-                   created_at, modified_at, created_by, modified_by
-            FROM product_machine_notes 
-            WHERE product_code = ? AND machine_id = ? AND is_active = 1
-            ORDER BY note_type ASC
-        """, (product_code, machine_id))
-        specific = cursor.fetchone()
-        
-        # Pobierz notatkę globalną (jeśli istnieje)
-        cursor.execute("""
-            SELECT id, product_code, machine_id, note_content, note_type,
-                   created_at, modified_at, created_by, modified_by
-            FROM product_machine_notes 
-            WHERE product_code = ? AND note_type = 'global' AND is_active = 1
-            LIMIT 1
-        """, (product_code,))
-        global_note = cursor.fetchone()
-        conn.close()
-        
+        bundle = _get_product_notes_bundle(product_code, machine_id)
+
         result = {
             "product_code": product_code,
             "machine_id": machine_id,
             "specific_note": None,
             "global_note": None
         }
-        
-        if specific:
-            specific_images = db.get_note_images('product_machine_note', specific['id'])
-            result["specific_note"] = {
-                "id": specific['id'],
-                "content": specific['note_content'],
-                "created_at": specific['created_at'],
-                "modified_at": specific['modified_at'],
-                "created_by": specific['created_by'],
-                "modified_by": specific['modified_by'],
-                "images": [_serialize_image_meta(img) for img in specific_images]
-            }
-        
-        if global_note:
-            global_images = db.get_note_images('product_machine_note', global_note['id'])
-            result["global_note"] = {
-                "id": global_note['id'],
-                "content": global_note['note_content'],
-                "created_at": global_note['created_at'],
-                "modified_at": global_note['modified_at'],
-                "created_by": global_note['created_by'],
-                "modified_by": global_note['modified_by'],
-                "images": [_serialize_image_meta(img) for img in global_images]
-            }
-        
+
+        for result_key in ("specific_note", "global_note"):
+            note = bundle.get(result_key)
+            if note:
+                result[result_key] = {
+                    "id": note['id'],
+                    "content": note['content'],
+                    "created_at": note['created_at'],
+                    "modified_at": note['modified_at'],
+                    "created_by": note['created_by'],
+                    "modified_by": note['modified_by'],
+                    "images": [_serialize_image_meta(img) for img in note['images']]
+                }
+
         return jsonify(result)
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
     
     # --- POST ---
-    elif request.method == 'POST':
+    if request.method == 'POST':
         data = request.get_json()
         content = data.get('content', '')
         user = data.get('user', 'Nieznany')
@@ -674,6 +880,7 @@ def handle_product_machine_note(product_code, machine_id):
         
         conn.commit()
         conn.close()
+        _invalidate_product_notes_cache(product_code=product_code)
         
         return jsonify({
             "success": True,
@@ -704,8 +911,10 @@ def handle_product_machine_note(product_code, machine_id):
         
         # Soft delete
         cursor.execute("""
-            UPDATE product_machine_notes SET is_active = 0 WHERE id = ?
-        """, (note_id,))
+            UPDATE product_machine_notes
+            SET is_active = 0, modified_at = CURRENT_TIMESTAMP, modified_by = ?
+            WHERE id = ?
+        """, (user, note_id))
         
         # Zapisz historię usunięcia
         cursor.execute("""
@@ -716,6 +925,7 @@ def handle_product_machine_note(product_code, machine_id):
         
         conn.commit()
         conn.close()
+        _invalidate_product_notes_cache(product_code=product_code)
         
         return jsonify({
             "success": True,
@@ -869,18 +1079,34 @@ def upload_note_image():
         _increment_note_metric("upload_fail")
         if status_code == 413:
             _increment_note_metric("upload_413")
+        if status_code == 503:
+            _increment_note_metric("upload_503")
+            return jsonify({"success": False, "error": err}), 503, {"Retry-After": "5"}
         return jsonify({"success": False, "error": err}), status_code
 
-    now = datetime.utcnow()
-    rel_dir = Path(str(now.year), f"{now.month:02d}")
-    abs_dir = NOTE_IMAGES_DIR / rel_dir
-    abs_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{uuid.uuid4().hex}.webp"
-    rel_path = str((rel_dir / filename).as_posix())
-    abs_path = abs_dir / filename
+    # Pliki adresowane treścią: <rok>/<miesiąc pierwszego uploadu>/<sha256>[_wariant].webp.
+    # Jeśli ten sam obraz już jest na dysku, używamy istniejących plików (bez zapisu).
+    sha256_hex = normalized["sha256"]
+    blob = db.get_note_image_blob(sha256_hex)
+    if blob:
+        rel_path = blob["storage_path"]
+        variants_meta = blob["variants"]
+    else:
+        now = datetime.utcnow()
+        rel_dir = Path(str(now.year), f"{now.month:02d}")
+        rel_path = str((rel_dir / f"{sha256_hex}.webp").as_posix())
+        variants_meta = {}
+        for variant_name, variant in normalized.get("variants", {}).items():
+            variants_meta[variant_name] = {
+                "path": str((rel_dir / f"{sha256_hex}_{variant_name}.webp").as_posix()),
+                "width": variant["width"],
+                "height": variant["height"],
+                "size_bytes": variant["size_bytes"],
+                "sha256": variant["sha256"],
+            }
 
-    with open(abs_path, 'wb') as f:
-        f.write(normalized["bytes"])
+    image_files = _image_files_for_upload(normalized, rel_path, variants_meta)
+    written_paths = _ensure_image_files(image_files)
 
     result = db.create_note_image(
         note_scope=note_scope,
@@ -891,21 +1117,26 @@ def upload_note_image():
         width=normalized["width"],
         height=normalized["height"],
         size_bytes=normalized["size_bytes"],
-        sha256_hex=normalized["sha256"],
+        sha256_hex=sha256_hex,
         annotations_json=annotations_json,
         order_index=order_index_int,
         created_by=uploaded_by,
+        variants=variants_meta,
     )
 
     if not result.get("success"):
         _increment_note_metric("upload_fail")
-        try:
-            if abs_path.exists():
-                abs_path.unlink()
-        except Exception:
-            pass
+        # Sprzątamy tylko pliki zapisane przez ten upload i nieużywane przez nikogo innego.
+        if written_paths and not db.get_note_image_blob(sha256_hex):
+            _remove_image_files(written_paths)
         return jsonify(result), result.get("status", 500)
 
+    # Równoległe usunięcie ostatniej referencji mogło skasować pliki przed naszym commitem.
+    _ensure_image_files(_image_files_for_upload(normalized, result["storage_path"], result["variants"]))
+
+    if not written_paths:
+        _increment_note_metric("upload_dedup")
+    _invalidate_note_images_cache(note_scope, note_id)
     image_row = db.get_note_image_by_id(result["image_id"])
     _increment_note_metric("upload_success")
     return jsonify({"success": True, "image": _serialize_image_meta(image_row)})
@@ -933,6 +1164,7 @@ def update_note_image_annotations(image_id):
         return jsonify(result), result.get("status", 500)
 
     image_row = db.get_note_image_by_id(image_id)
+    _invalidate_note_images_cache(image_row["note_scope"], image_row["note_id"])
     return jsonify({"success": True, "image": _serialize_image_meta(image_row)})
 
 
@@ -945,13 +1177,10 @@ def delete_note_image(image_id):
     result = db.soft_delete_note_image(image_id)
     if not result.get("success"):
         return jsonify(result), result.get("status", 500)
+    _invalidate_note_images_cache(image_row["note_scope"], image_row["note_id"])
 
-    abs_path = NOTE_IMAGES_DIR / image_row["storage_path"]
-    try:
-        if abs_path.exists():
-            abs_path.unlink()
-    except Exception:
-        pass
+    # Pliki usuwamy dopiero, gdy zniknęła ostatnia aktywna referencja.
+    _remove_image_files(result.get("released_paths", []))
 
     return jsonify({"success": True})
 
@@ -984,45 +1213,103 @@ def serve_note_image_file(image_id):
     if not image_row or not image_row.get("is_active"):
         return jsonify({"success": False, "error": "Obraz nie istnieje"}), 404
 
-    abs_path = NOTE_IMAGES_DIR / image_row["storage_path"]
+    rel_path, etag = _resolve_image_variant(image_row, request.args.get('size'))
+    abs_path = NOTE_IMAGES_DIR / rel_path
     if not abs_path.exists():
         return jsonify({"success": False, "error": "Plik nie istnieje"}), 404
 
-    etag = image_row.get("sha256") or ""
-    if_none_match = (request.headers.get("If-None-Match") or "").strip('"')
-    if etag and if_none_match == etag:
-        return Response(status=304, headers={"ETag": f'"{etag}"'})
-
-    with open(abs_path, 'rb') as f:
-        file_bytes = f.read()
-
-    headers = {
-        "ETag": f'"{etag}"' if etag else "",
-        "Cache-Control": f"private, max-age={SIGNED_URL_TTL_SECONDS}",
-        "X-Content-Type-Options": "nosniff",
-        "Content-Security-Policy": "default-src 'none'",
-    }
-    if not headers["ETag"]:
-        headers.pop("ETag")
-
-    return Response(file_bytes, mimetype=image_row.get("mime_type") or "image/webp", headers=headers)
+    # send_file: plik przekazywany do serwera (wsgi.file_wrapper / sendfile, opcjonalnie X-Sendfile),
+    # obsługa If-None-Match, If-Modified-Since i Range (conditional=True), Last-Modified z mtime pliku.
+    response = send_file(
+        abs_path.resolve(),
+        mimetype=image_row.get("mime_type") or "image/webp",
+        conditional=True,
+        etag=etag or False,
+        max_age=SIGNED_URL_TTL_SECONDS,
+    )
+    response.headers["Cache-Control"] = f"private, max-age={SIGNED_URL_TTL_SECONDS}"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Content-Security-Policy"] = "default-src 'none'"
+    return response
 
 
 @app.route('/api/note-images/metrics', methods=['GET'])
 def get_note_image_metrics():
+    # Suma ze wszystkich workerów (ten sam rejestr co /metrics)
+    events = {key[0]: int(value) for key, value in metrics.aggregated_series("note_image_events_total").items()}
     return jsonify(
         {
             "success": True,
             "metrics": {
-                "upload_success": _note_image_metrics.get("upload_success", 0),
-                "upload_fail": _note_image_metrics.get("upload_fail", 0),
-                "upload_429": _note_image_metrics.get("upload_429", 0),
-                "upload_413": _note_image_metrics.get("upload_413", 0),
-                "annotations_conflict_409": _note_image_metrics.get("annotations_conflict_409", 0),
+                name: events.get(name, 0)
+                for name in (
+                    "upload_success", "upload_fail", "upload_429", "upload_413",
+                    "upload_503", "upload_dedup", "annotations_conflict_409",
+                )
             },
+            "processing": image_processing.get_stats(),
         }
     )
 
+@app.route('/api/admin/note-images/gc', methods=['POST'])
+def run_note_images_gc():
+    """
+    Jeden przebieg GC zdjęć: zdjęcia usuniętych notatek + osierocone pliki (partiami).
+    Body (opcjonalnie): {"dry_run": true, "batch_size": 500}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        batch_size = int(data.get('batch_size') or note_images_gc.NOTE_IMAGES_GC_BATCH)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Nieprawidlowy batch_size"}), 400
+
+    result = note_images_gc.run_gc(
+        db,
+        NOTE_IMAGES_DIR,
+        batch_size=max(1, min(batch_size, 10000)),
+        dry_run=bool(data.get('dry_run')),
+    )
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    for note in result["notes"]["notes"]:
+        _invalidate_note_images_cache(note["note_scope"], note["note_id"])
+    return jsonify(result)
+
+
+@app.route('/api/admin/floor-state/snapshot', methods=['POST'])
+def run_floor_snapshots():
+    """
+    Dopisuje migawki stanu hali od ostatniej migawki (floor_state.py).
+    Body (opcjonalnie): {"force": true} - także migawka "teraz"; {"rebuild": true} - od zera.
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('rebuild'):
+        result = floor_state.rebuild(db)
+    else:
+        result = floor_state.build_snapshots(db, force=bool(data.get('force')))
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
+
+@app.route('/api/admin/dwell-rollups/catch-up', methods=['POST'])
+def run_dwell_rollups():
+    """
+    Dolicza agregaty czasów przebywania od watermarku (dwell_rollups.py).
+    Body (opcjonalnie): {"rebuild": true} - od pierwszego zdarzenia.
+    """
+    data = request.get_json(silent=True) or {}
+    result = dwell_rollups.rebuild(db) if data.get('rebuild') else dwell_rollups.catch_up(db)
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
+
+@app.route('/api/admin/note-images/storage-usage', methods=['GET'])
+def get_note_images_storage_usage():
+    """Zajętość dysku przez zdjęcia per katalog YYYY/MM i per zakres notatek."""
+    return jsonify({"success": True, "usage": db.get_storage_usage()})
+
 # ========================
 # ENDPOINTY PRODUKTÓW
 # ========================
@@ -1504,6 +1791,127 @@ def get_cart_return_list():
     finally:
         conn.close()
 
+def _cart_response(result: dict):
+    if result.get("success"):
+        return jsonify(result)
+    status_code = result.pop('status', 400)
+    if 'error' not in result and 'error_code' in result:
+        result['error'] = ERROR_CODES.get(result['error_code'], 'Niedozwolony status kopert na wózku')
+    return jsonify(result), status_code
+
+@app.route('/api/carts/<cart_id>', methods=['GET'])
+def get_cart(cart_id):
+    """Zawartość wózka: liczniki wg statusu, ile kopert przyjmie magazyn, lista (?limit=1000)."""
+    return _cart_response(db.get_cart_contents(cart_id, limit=request.args.get('limit', 1000, type=int)))
+
+@app.route('/api/carts/<cart_id>/return-all', methods=['POST'])
+def return_cart_to_warehouse(cart_id):
+    """
+    Przyjmuje całą zawartość wózka na magazyn w jednej transakcji (np. opróżnienie CART-RET-05).
+    Body: { "location": "Sekcja A", "user_id": "magazynier1", "partial": false }
+    partial=true - koperty w niedozwolonym stanie zostają na wózku (domyślnie 409 dla całości).
+    """
+    data = request.get_json(silent=True) or {}
+    result = db.transition_cart(
+        cart_id, Operation.RETURN, user_id=data.get('user_id'),
+        location=data.get('location', 'Sekcja A'), partial=bool(data.get('partial')),
+    )
+    _record_envelope_result("RETURN", result)
+    return _cart_response(result)
+
+@app.route('/api/carts/<cart_id>/move', methods=['POST'])
+def move_cart_contents(cart_id):
+    """
+    Przekłada wydane koperty (SHOP_FLOOR) z wózka na inny wózek wydawczy w jednej transakcji.
+    Body: { "to": "CART-OUT-2", "user_id": "magazynier1", "partial": false }
+    """
+    data = request.get_json(silent=True) or {}
+    result = db.transition_cart(
+        cart_id, Operation.MOVE, user_id=data.get('user_id'),
+        to_holder=data.get('to'), partial=bool(data.get('partial')),
+    )
+    _record_envelope_result("MOVE", result)
+    return _cart_response(result)
+
+@app.route('/api/floor-state', methods=['GET'])
+def get_floor_state():
+    """
+    Stan hali w chwili ?at= (ISO 8601, bez strefy = UTC; brak = teraz): liczniki kopert
+    wg statusu i posiadacza z najbliższej migawki + ogona zdarzeń (floor_state.py).
+    ?details=1 - lista kopert (opcjonalnie &status=...&holder=...&limit=1000).
+    """
+    result = floor_state.floor_state(
+        db,
+        at=request.args.get('at'),
+        details=request.args.get('details', '0') == '1',
+        status=request.args.get('status') or None,
+        holder=request.args.get('holder') or None,
+        limit=request.args.get('limit', 1000, type=int),
+    )
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
+@app.route('/api/reports/dwell', methods=['GET'])
+def get_dwell_report():
+    """
+    Czasy przebywania kopert z agregatów (dwell_rollups.py): liczba okresów, średnia,
+    max, p50/p90/p95/p99 i trwające okresy.
+    Parametry: ?dimension=status|holder&from=...&to=... (ISO 8601, bez = cała historia)&key=BOOBST 1
+    """
+    result = dwell_rollups.dwell_report(
+        db,
+        dimension=request.args.get('dimension', 'status'),
+        start=request.args.get('from'),
+        end=request.args.get('to'),
+        dim_key=request.args.get('key') or None,
+    )
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
+@app.route('/api/reports/dwell/hourly', methods=['GET'])
+def get_dwell_hourly_report():
+    """Seria godzinowa czasów przebywania. Parametry jak /api/reports/dwell."""
+    result = dwell_rollups.dwell_hourly_report(
+        db,
+        dimension=request.args.get('dimension', 'status'),
+        start=request.args.get('from'),
+        end=request.args.get('to'),
+        dim_key=request.args.get('key') or None,
+    )
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
+@app.route('/api/analytics/events', methods=['GET'])
+def get_events_analytics():
+    """
+    Grupowanie logu zdarzeń na kolumnach NumPy (analytics.py).
+    Parametry: ?source=events|errors&group_by=holder,operation&window=none|hour|shift|day
+               &from=...&to=... (ISO 8601, domyślnie 30 dni)&limit=10000
+               + filtry po polach źródła, np. &operation=TRANSFER_AUTO&holder=BOOBST 1,BOOBST 2
+    """
+    source = request.args.get('source', 'events')
+    fields = analytics.SOURCES.get(source, {}).get('fields', {})
+    filters = {
+        field: [value for value in request.args[field].split(',') if value]
+        for field in fields if request.args.get(field)
+    }
+    result = analytics.aggregate(
+        db,
+        source=source,
+        group_by=[field for field in request.args.get('group_by', '').split(',') if field],
+        window=request.args.get('window', 'none'),
+        start=request.args.get('from'),
+        end=request.args.get('to'),
+        filters=filters,
+        limit=request.args.get('limit', 10000, type=int),
+    )
+    if not result.get("success"):
+        return jsonify(result), result.get("status", 500)
+    return jsonify(result)
+
 @app.route('/api/machines/<path:machine_id>/status', methods=['GET'])
 def get_machine_status(machine_id):
     """Sprawdza status maszyny (czy ma przypisaną kopertę)."""
@@ -1754,11 +2162,18 @@ def generate_all_histories():
         return jsonify({"error": str(e)}), 500
 
 
-if __name__ == '__main__':
-    init_demo_envelopes()
+startup_profile.checkpoint("app")
+
+
+def main() -> None:
+    """Serwer deweloperski (python api_server.py)."""
+    with startup_profile.phase("demo_data"):
+        init_demo_envelopes()
     port = int(os.environ.get('PORT', 5000))
     is_production = APP_ENV == 'production'
     print(f"\n🚀 Serwer API uruchomiony na http://localhost:{port}")
     print("📄 Otwórz prototype.html w przeglądarce")
     print("   (upewnij się, że serwer działa w tle)\n")
+    if is_production:
+        print("⚠️ Serwer deweloperski (jeden proces) - w produkcji: gunicorn -c gunicorn.conf.py wsgi:app\n")
     app.run(host='0.0.0.0', debug=not is_production, use_reloader=False, port=port)
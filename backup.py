@@ -0,0 +1,397 @@
+"""
+Kopie zapasowe bazy SQLite i zdjęć notatek.
+
+- Baza: sqlite3.Connection.backup() - kopia online, kopiowana porcjami stron
+  (DB_BACKUP_PAGES stron, potem DB_BACKUP_SLEEP_SECONDS przerwy), więc API działa dalej.
+  Snapshot: <DB_BACKUP_DIR>/koperty_system_<YYYYmmdd_HHMMSS>.db + plik .sha256.
+- Zdjęcia: przyrostowe snapshoty na twardych dowiązaniach. Każdy snapshot to pełne
+  drzewo katalogów, ale plik niezmieniony od poprzedniego snapshotu (ten sam rozmiar
+  i mtime) jest tylko dowiązaniem (os.link) - nie zajmuje miejsca ani czasu kopiowania.
+  Snapshot powstaje jako <TIMESTAMP>.partial, MANIFEST.json zapisujemy na końcu,
+  a katalog przemianowujemy dopiero po zapisaniu manifestu.
+- Retencja jak w dotychczasowym skrypcie (find -mtime +N): usuwamy snapshoty starsze
+  niż NOTE_IMAGES_BACKUP_RETENTION_DAYS pełnych dni. Dowiązania sprawiają, że usunięcie
+  starego snapshotu nie narusza nowszych.
+- Weryfikacja: integrity_check + suma SHA-256 kopii bazy, suma SHA-256 każdego pliku
+  snapshotu zdjęć względem manifestu oraz sprawdzenie, czy wszystkie pliki, na które
+  wskazuje kopia bazy, są w snapshocie zdjęć.
+
+Konfiguracja (zmienne środowiskowe):
+- DB_BACKUP_SOURCE                    - plik bazy (domyślnie DB_PATH lub koperty_system.db)
+- DB_BACKUP_DIR                       - katalog kopii bazy
+- DB_BACKUP_PAGES / DB_BACKUP_SLEEP_SECONDS - porcja stron i przerwa przy kopiowaniu bazy
+- NOTE_IMAGES_DIR                     - katalog zdjęć
+- NOTE_IMAGES_BACKUP_DIR              - katalog snapshotów zdjęć
+- NOTE_IMAGES_BACKUP_RETENTION_DAYS   - retencja (dni), wspólna dla bazy i zdjęć
+
+Uruchomienie:
+    python backup.py [db|images|all|verify] [--snapshot NAZWA]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+DB_BACKUP_SOURCE = os.environ.get('DB_BACKUP_SOURCE', os.environ.get('DB_PATH', 'koperty_system.db'))
+DB_BACKUP_DIR = Path(os.environ.get('DB_BACKUP_DIR', './data/backups/db'))
+DB_BACKUP_PAGES = int(os.environ.get('DB_BACKUP_PAGES', '1024'))
+DB_BACKUP_SLEEP_SECONDS = float(os.environ.get('DB_BACKUP_SLEEP_SECONDS', '0.05'))
+NOTE_IMAGES_DIR = Path(os.environ.get('NOTE_IMAGES_DIR', './data/note_images'))
+NOTE_IMAGES_BACKUP_DIR = Path(os.environ.get('NOTE_IMAGES_BACKUP_DIR', './data/backups/note_images'))
+RETENTION_DAYS = int(os.environ.get('NOTE_IMAGES_BACKUP_RETENTION_DAYS', '14'))
+
+MANIFEST_NAME = "MANIFEST.json"
+PARTIAL_SUFFIX = ".partial"
+_HASH_CHUNK = 1024 * 1024
+
+
+def _timestamp() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_with_hash(src: Path, dest: Path) -> str:
+    """Kopiuje plik (z mtime) liczac jednocześnie SHA-256 - jeden odczyt źródła."""
+    digest = hashlib.sha256()
+    tmp = dest.with_name(dest.name + ".tmp")
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        for chunk in iter(lambda: fin.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dest)
+    return digest.hexdigest()
+
+
+# ========================
+# BAZA DANYCH
+# ========================
+
+def backup_database(source: str = None, dest_dir: Path = None, pages: int = None, sleep: float = None) -> dict:
+    """Snapshot bazy przez sqlite3 backup API (online, porcjami stron)."""
+    source = source or DB_BACKUP_SOURCE
+    dest_dir = Path(dest_dir or DB_BACKUP_DIR)
+    pages = DB_BACKUP_PAGES if pages is None else pages
+    sleep = DB_BACKUP_SLEEP_SECONDS if sleep is None else sleep
+    if not os.path.exists(source):
+        return {"success": False, "error": f"Baza nie istnieje: {source}"}
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(source).stem
+    dest = dest_dir / f"{stem}_{_timestamp()}.db"
+    tmp = dest.with_name(dest.name + PARTIAL_SUFFIX)
+    started = time.perf_counter()
+    steps = {"count": 0}
+
+    def _progress(status, remaining, total):
+        steps["count"] += 1
+
+    src_conn = sqlite3.connect(source, timeout=30)
+    dst_conn = sqlite3.connect(tmp)
+    try:
+        src_conn.execute("PRAGMA busy_timeout = 5000")
+        src_conn.backup(dst_conn, pages=pages, progress=_progress, sleep=sleep)
+        # Kopia jako pojedynczy plik (bez -wal), gotowa do podmiany przy odtwarzaniu
+        dst_conn.execute("PRAGMA journal_mode = DELETE")
+    except Exception as e:
+        dst_conn.close()
+        src_conn.close()
+        tmp.unlink(missing_ok=True)
+        return {"success": False, "error": str(e)}
+    dst_conn.close()
+    src_conn.close()
+
+    os.replace(tmp, dest)
+    sha256_hex = _sha256_file(dest)
+    dest.with_name(dest.name + ".sha256").write_text(f"{sha256_hex}  {dest.name}\n")
+    return {
+        "success": True,
+        "path": str(dest),
+        "size_bytes": dest.stat().st_size,
+        "sha256": sha256_hex,
+        "steps": steps["count"],
+        "duration_ms": (time.perf_counter() - started) * 1000.0,
+    }
+
+
+def verify_database_snapshot(path: Path) -> dict:
+    """Sprawdza sumę SHA-256 i PRAGMA integrity_check kopii bazy (tylko odczyt)."""
+    path = Path(path)
+    errors = []
+    sha_file = path.with_name(path.name + ".sha256")
+    if sha_file.exists():
+        expected = sha_file.read_text().split()[0]
+        if _sha256_file(path) != expected:
+            errors.append("Niezgodna suma SHA-256")
+    else:
+        errors.append("Brak pliku .sha256")
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            errors.append(f"integrity_check: {result}")
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    finally:
+        conn.close()
+    return {"success": not errors, "path": str(path), "tables": len(tables), "errors": errors}
+
+
+def _latest_database_snapshot(dest_dir: Path) -> Path:
+    snapshots = sorted(Path(dest_dir).glob("*.db"))
+    return snapshots[-1] if snapshots else None
+
+
+# ========================
+# ZDJĘCIA NOTATEK
+# ========================
+
+def _list_snapshots(backup_root: Path) -> list:
+    """Kompletne snapshoty (z manifestem), od najstarszego."""
+    if not backup_root.exists():
+        return []
+    return sorted(
+        p for p in backup_root.iterdir()
+        if p.is_dir() and not p.name.endswith(PARTIAL_SUFFIX) and (p / MANIFEST_NAME).exists()
+    )
+
+
+def _load_manifest(snapshot: Path) -> dict:
+    with open(snapshot / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def backup_images(src_dir: Path = None, backup_root: Path = None) -> dict:
+    """
+    Przyrostowy snapshot zdjęć: pliki niezmienione od ostatniego snapshotu są
+    twardymi dowiązaniami, nowe/zmienione - kopiowane.
+    """
+    src_dir = Path(src_dir or NOTE_IMAGES_DIR)
+    backup_root = Path(backup_root or NOTE_IMAGES_BACKUP_DIR)
+    if not src_dir.is_dir():
+        return {"success": False, "error": f"Katalog zdjec nie istnieje: {src_dir}"}
+
+    backup_root.mkdir(parents=True, exist_ok=True)
+    previous = _list_snapshots(backup_root)
+    base = previous[-1] if previous else None
+    base_files = _load_manifest(base)["files"] if base else {}
+
+    name = _timestamp()
+    dest = backup_root / name
+    partial = backup_root / (name + PARTIAL_SUFFIX)
+    if dest.exists():
+        return {"success": False, "error": f"Snapshot juz istnieje: {dest}"}
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir()
+
+    started = time.perf_counter()
+    files = {}
+    stats = {"linked": 0, "copied": 0, "copied_bytes": 0, "total_bytes": 0}
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        rel_dir = Path(dirpath).relative_to(src_dir)
+        for filename in sorted(filenames):
+            # Pliki tymczasowe uploadu (.<nazwa>.<uuid>.tmp) pomijamy
+            if filename.startswith('.') and filename.endswith('.tmp'):
+                continue
+            src_path = Path(dirpath) / filename
+            rel_path = (rel_dir / filename).as_posix()
+            try:
+                st = src_path.stat()
+            except FileNotFoundError:
+                continue  # usunięty w trakcie (GC / delete)
+            dest_path = partial / rel_path
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+            prev = base_files.get(rel_path)
+            if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+                try:
+                    os.link(base / rel_path, dest_path)
+                    files[rel_path] = prev
+                    stats["linked"] += 1
+                    stats["total_bytes"] += st.st_size
+                    continue
+                except OSError:
+                    pass  # np. inny system plików - kopiujemy
+
+            try:
+                sha256_hex = _copy_with_hash(src_path, dest_path)
+            except FileNotFoundError:
+                continue
+            files[rel_path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256_hex}
+            stats["copied"] += 1
+            stats["copied_bytes"] += st.st_size
+            stats["total_bytes"] += st.st_size
+
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "source": str(src_dir),
+        "base": base.name if base else None,
+        "files": files,
+    }
+    with open(partial / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(partial, dest)
+
+    stats.update({
+        "success": True,
+        "path": str(dest),
+        "base": manifest["base"],
+        "files": len(files),
+        "duration_ms": (time.perf_counter() - started) * 1000.0,
+    })
+    return stats
+
+
+def verify_images_snapshot(snapshot: Path) -> dict:
+    """Sprawdza każdy plik snapshotu (istnienie, rozmiar, SHA-256) względem manifestu."""
+    snapshot = Path(snapshot)
+    if not (snapshot / MANIFEST_NAME).exists():
+        return {"success": False, "path": str(snapshot), "errors": ["Brak manifestu"]}
+    files = _load_manifest(snapshot)["files"]
+    missing, corrupted = [], []
+    for rel_path, meta in files.items():
+        path = snapshot / rel_path
+        if not path.exists():
+            missing.append(rel_path)
+        elif path.stat().st_size != meta["size"] or _sha256_file(path) != meta["sha256"]:
+            corrupted.append(rel_path)
+    errors = []
+    if missing:
+        errors.append(f"Brakujace pliki: {len(missing)}")
+    if corrupted:
+        errors.append(f"Uszkodzone pliki: {len(corrupted)}")
+    return {
+        "success": not errors,
+        "path": str(snapshot),
+        "files": len(files),
+        "missing": missing[:100],
+        "corrupted": corrupted[:100],
+        "errors": errors,
+    }
+
+
+def verify_restore(db_snapshot: Path, images_snapshot: Path) -> dict:
+    """
+    Czy para (kopia bazy, snapshot zdjęć) da się odtworzyć razem: każdy plik, na który
+    wskazuje aktywne zdjęcie lub blob w kopii bazy, musi być w snapshocie zdjęć.
+    """
+    files = _load_manifest(Path(images_snapshot))["files"]
+    conn = sqlite3.connect(f"file:{db_snapshot}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    referenced = set()
+    try:
+        rows = conn.execute("SELECT storage_path, variants_json FROM note_images WHERE is_active = 1").fetchall()
+        try:
+            rows += conn.execute("SELECT storage_path, variants_json FROM note_image_blobs").fetchall()
+        except sqlite3.OperationalError:
+            pass  # kopia sprzed deduplikacji
+    except sqlite3.OperationalError:
+        rows = []  # kopia sprzed zdjęć notatek
+    finally:
+        conn.close()
+    for row in rows:
+        referenced.add(row["storage_path"])
+        try:
+            variants = json.loads(row["variants_json"]) if row["variants_json"] else {}
+        except Exception:
+            variants = {}
+        for variant in variants.values():
+            if variant.get("path"):
+                referenced.add(variant["path"])
+    missing = sorted(referenced - set(files))
+    return {
+        "success": not missing,
+        "referenced_files": len(referenced),
+        "missing": missing[:100],
+        "errors": [f"Pliki z bazy nieobecne w snapshocie: {len(missing)}"] if missing else [],
+    }
+
+
+# ========================
+# RETENCJA
+# ========================
+
+def apply_retention(root: Path, retention_days: int = None) -> list:
+    """
+    Usuwa snapshoty starsze niż retention_days pełnych dni (jak find -mtime +N).
+    Dotyczy katalogów snapshotów zdjęć i plików kopii bazy (z .sha256).
+    """
+    root = Path(root)
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    if not root.exists():
+        return []
+    now = time.time()
+    removed = []
+    for entry in root.iterdir():
+        try:
+            age_days = int((now - entry.stat().st_mtime) // 86400)
+        except FileNotFoundError:
+            continue
+        if age_days <= retention_days:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        removed.append(str(entry))
+    return removed
+
+
+# ========================
+# CLI
+# ========================
+
+def run(command: str, snapshot: str = None) -> dict:
+    result = {"success": True}
+    if command in ("db", "all"):
+        result["db"] = backup_database()
+        result["db"]["removed"] = apply_retention(DB_BACKUP_DIR)
+        result["success"] &= result["db"]["success"]
+    if command in ("images", "all"):
+        result["images"] = backup_images()
+        result["images"]["removed"] = apply_retention(NOTE_IMAGES_BACKUP_DIR)
+        result["success"] &= result["images"]["success"]
+    if command == "verify":
+        images_snapshot = (NOTE_IMAGES_BACKUP_DIR / snapshot) if snapshot else (_list_snapshots(NOTE_IMAGES_BACKUP_DIR) or [None])[-1]
+        db_snapshot = _latest_database_snapshot(DB_BACKUP_DIR)
+        if db_snapshot:
+            result["db"] = verify_database_snapshot(db_snapshot)
+            result["success"] &= result["db"]["success"]
+        if images_snapshot:
+            result["images"] = verify_images_snapshot(images_snapshot)
+            result["success"] &= result["images"]["success"]
+        if db_snapshot and images_snapshot and result["images"]["success"]:
+            result["restore"] = verify_restore(db_snapshot, images_snapshot)
+            result["success"] &= result["restore"]["success"]
+        if not db_snapshot and not images_snapshot:
+            result = {"success": False, "error": "Brak snapshotow do weryfikacji"}
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Kopie zapasowe bazy i zdjęć notatek")
+    parser.add_argument("command", nargs="?", default="all", choices=["db", "images", "all", "verify"])
+    parser.add_argument("--snapshot", help="nazwa snapshotu zdjęć do weryfikacji (domyślnie najnowszy)")
+    args = parser.parse_args(argv)
+
+    result = run(args.command, args.snapshot)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if result.get("success") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Mikrobenchmark analityki zdarzeń (analytics.py): grupowanie na kolumnach NumPy
+vs ta sama agregacja pętlą Pythona po wierszach (Counter).
+
+Dane: syntetyczny miesiąc zdarzeń (domyślnie 1 000 000 wierszy - duża hala, kilka
+zdarzeń na sekundę) zbudowany od razu jako EventFrame, albo zakres z istniejącej bazy
+(--db, --from, --to; wtedy mierzony jest też odczyt load_frame). Przypadki:
+- holder_operation_hour  - przepustowość maszyn: posiadacz x operacja x godzina
+- transfer_auto_by_day   - TRANSFER_AUTO wg posiadacza i dnia (filtr operacji)
+- user_shift             - operator x zmiana
+Każdy wynik NumPy jest porównywany z wynikiem pętli.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/analytics_benchmark.py --rows 1000000 --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+OPERATIONS = ["ISSUE", "LOAD", "TRANSFER_AUTO", "RELEASE", "RETURN", "MOVE"]
+HOLDERS = ["PRINTER MAIN", "PRINTER 2", "VISON", "ETERNA", "CUTER", "ST2", "VERSOR",
+           "BOOBST 1", "BOOBST 2", "PALLETIZING", "MAGAZYN", "CART-OUT-1", "CART-RET-05"]
+STATUSES = ["MAGAZYN", "SHOP_FLOOR", "W_PRODUKCJI", "CART-RET-05"]
+USERS = [f"magazynier{n}" for n in range(1, 9)] + HOLDERS[:10]
+
+CASES = {
+    "holder_operation_hour": (["holder", "operation"], "hour", {}),
+    "transfer_auto_by_day": (["holder"], "day", {"operation": ["TRANSFER_AUTO"]}),
+    "user_shift": (["user"], "shift", {}),
+}
+
+
+def _synthetic_frame(analytics, np, rows: int, seed: int):
+    """Miesiąc zdarzeń jako EventFrame (kody losowe, czasy rosnące)."""
+    rng = np.random.default_rng(seed)
+    start = int(datetime(2025, 11, 1, tzinfo=timezone.utc).timestamp())
+    ts = np.sort(rng.integers(start, start + 30 * 86400, rows, dtype=np.int64))
+    labels = {
+        "operation": OPERATIONS, "holder": HOLDERS, "from_holder": HOLDERS,
+        "status": STATUSES, "from_status": STATUSES, "user": USERS,
+    }
+    codes = {name: rng.integers(0, len(values), rows, dtype=np.int32) for name, values in labels.items()}
+    return analytics.EventFrame("events", "", "", ts, codes, {k: list(v) for k, v in labels.items()}, 0.0)
+
+
+def _python_group(analytics, frame, group_by, window, filters) -> dict:
+    """Ta sama agregacja pętlą po wierszach (jak bez NumPy)."""
+    tz = analytics.ANALYTICS_TIMEZONE
+    shift_starts = sorted(analytics.ANALYTICS_SHIFT_STARTS)
+    columns = {name: frame.codes[name].tolist() for name in set(group_by) | set(filters)}
+    labels = frame.labels
+    counts = Counter()
+    for row, stamp in enumerate(frame.ts.tolist()):
+        if any(labels[name][columns[name][row]] not in values for name, values in filters.items()):
+            continue
+        local = datetime.fromtimestamp(stamp, tz)
+        if window == "hour":
+            label = local.strftime("%Y-%m-%d %H:00")
+        elif window == "day":
+            label = local.strftime("%Y-%m-%d 00:00")
+        else:
+            hours = [hour for hour in shift_starts if local.hour >= hour]
+            if hours:
+                label = local.strftime("%Y-%m-%d ") + f"{hours[-1]:02d}:00"
+            else:
+                previous = local.date() - timedelta(days=1)
+                label = previous.strftime("%Y-%m-%d ") + f"{shift_starts[-1]:02d}:00"
+        counts[(label,) + tuple(labels[name][columns[name][row]] for name in group_by)] += 1
+    return dict(counts)
+
+
+def _timed(fn, repeat: int) -> tuple:
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return round(statistics.median(timings), 2), result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mikrobenchmark analityki zdarzeń (NumPy vs pętla)")
+    parser.add_argument("--rows", type=int, default=1000000, help="wierszy syntetycznego miesiąca")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="zamiast danych syntetycznych: zakres z istniejącej bazy")
+    parser.add_argument("--from", dest="start", default="2025-12-01")
+    parser.add_argument("--to", dest="end", default="2026-01-01")
+    parser.add_argument("--skip-python", action="store_true", help="bez wolnej pętli porównawczej")
+    parser.add_argument("--output", help="plik JSON z wynikiem (domyślnie stdout)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ['DB_PATH'] = str(Path(args.db).resolve())
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+    import analytics
+    np = analytics._numpy()
+    if np is None:
+        print("❌ Brak NumPy (pip install numpy)", file=sys.stderr)
+        return 1
+
+    report = {"results": {}}
+    if args.db:
+        import database
+        db = database.Database(os.environ['DB_PATH'])
+        start, end = analytics._range(args.start, args.end)
+        load_ms, frame = _timed(lambda: analytics.load_frame(db, "events", start, end), args.repeat)
+        report.update({"db": args.db, "from": start, "to": end, "load_ms": load_ms})
+    else:
+        frame = _synthetic_frame(analytics, np, args.rows, args.seed)
+    report["rows"] = len(frame)
+
+    for name, (group_by, window, filters) in CASES.items():
+        numpy_ms, (_, groups) = _timed(lambda: analytics.group_count(frame, group_by, window, filters), args.repeat)
+        result = {"numpy_ms": numpy_ms, "groups": len(groups)}
+        if not args.skip_python:
+            python_ms, expected = _timed(lambda: _python_group(analytics, frame, group_by, window, filters), 1)
+            got = {(label,) + values: count for label, values, count in groups}
+            if got != expected:
+                raise AssertionError(f"{name}: wynik NumPy różni się od pętli")
+            result.update({"python_ms": python_ms, "speedup": round(python_ms / numpy_ms, 1) if numpy_ms else None})
+        report["results"][name] = result
+        print(f"⏱️ {name}: {result}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,543 @@
+"""
+Generator dużego, spójnego zbioru danych (produkty, koperty, zdarzenia, notatki, zdjęcia).
+
+Dane są deterministyczne dla danego --seed i --end:
+- historia każdej koperty to spacer po ALLOWED_TRANSITIONS (domain.py), z wagami
+  przejść zbliżonymi do obiegu na hali; operacje i posiadacze jak w database.py
+  (ISSUE na wózek, LOAD / TRANSFER_AUTO na maszyny z DEFAULT_OPERATOR_MACHINES,
+  RELEASE z PALLETIZING na CART-RET-05, RETURN do magazynu)
+- stan koperty (status, posiadacz, updated_at) = ostatnie zdarzenie jej historii
+- notatki operatora, notatki produkt+maszyna, listy wyszukiwania z ostatnich dni
+- zdjęcia notatek wskazują na pulę blobów (deduplikacja jak przy uploadzie), ref_count
+  i liczniki zajętości dysku są spójne z note_images; --images-dir zapisuje pliki puli
+
+Ładowanie: schemat z Database(), potem indeksy pomocnicze są usuwane, dane wstawiane
+partiami przez executemany (journal_mode=OFF, synchronous=OFF), a indeksy budowane na końcu.
+
+Skale (--scale):
+- small   - 1k produktów, 5k kopert, ~100k zdarzeń, 5k zdjęć
+- medium  - 10k produktów, 50k kopert, ~1M zdarzeń, 100k zdjęć
+- large   - 100k produktów, 500k kopert, ~10M zdarzeń, 1M zdjęć
+Pojedyncze liczby można nadpisać (--products, --envelopes, ...).
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/dataset_generator.py --output /tmp/koperty_large.db --scale large --seed 7
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+SCALES = {
+    "small": {"products": 1000, "envelopes": 5000, "events_per_envelope": 20, "operator_notes": 2000,
+              "product_notes": 2000, "images": 5000, "blob_pool": 500, "search_items": 300},
+    "medium": {"products": 10000, "envelopes": 50000, "events_per_envelope": 20, "operator_notes": 20000,
+               "product_notes": 20000, "images": 100000, "blob_pool": 5000, "search_items": 2000},
+    "large": {"products": 100000, "envelopes": 500000, "events_per_envelope": 20, "operator_notes": 200000,
+              "product_notes": 100000, "images": 1000000, "blob_pool": 50000, "search_items": 10000},
+}
+
+BATCH_SIZE = 20000
+# Okres historii (dni przed --end)
+HISTORY_DAYS = 365
+SEARCH_LIST_DAYS = 7
+
+WAREHOUSE_USERS = ["magazynier1", "magazynier2", "magazynier3", "magazynier4"]
+CARTS_OUT = [f"CART-OUT-{i}" for i in range(1, 9)]
+COMPANIES = ["PROTEGA GLOBAL LTD", "NORDPACK", "EUROPRINT", "KARTON-POL", "PAPYRUS SA", "VITA FOODS", "MEDIPHARM"]
+NOTE_KINDS = ("standard", "standard", "standard", "pallet", "slot")
+SECTIONS = "ABCDE"
+
+# Względne wagi stanów docelowych - obieg magazyn -> hala -> maszyny -> zwrot dominuje
+TARGET_WEIGHTS = {
+    "SHOP_FLOOR": 6.0,
+    "W_PRODUKCJI": 10.0,
+    "CART-RET-05": 4.0,
+    "MAGAZYN": 4.0,
+    "W_TRANSPORCIE_OUT": 0.5,
+    "W_TRANSPORCIE_RET": 0.5,
+    "USZKODZONA": 0.05,
+    "WYCOFANA": 0.01,
+}
+# Waga przeniesienia między maszynami (W_PRODUKCJI -> W_PRODUKCJI, poza ALLOWED_TRANSITIONS)
+TRANSFER_WEIGHT = 3.0
+
+
+def _prepare_environment(output: Path) -> None:
+    """DB_PATH przed importem database - globalny db modułu nie może dotknąć koperty_system.db."""
+    os.environ['DB_PATH'] = str(output)
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+
+
+def _operation(from_status: str, to_status: str) -> str:
+    if from_status == to_status == "W_PRODUKCJI":
+        return "TRANSFER_AUTO"
+    if to_status == "W_PRODUKCJI":
+        return "LOAD"
+    if from_status == "W_PRODUKCJI":
+        return "DAMAGE" if to_status == "USZKODZONA" else "RELEASE"
+    if to_status == "MAGAZYN":
+        return "RETURN"
+    if from_status == "MAGAZYN":
+        return "WITHDRAW" if to_status == "WYCOFANA" else "ISSUE"
+    if to_status == "WYCOFANA":
+        return "WITHDRAW"
+    return "MOVE"
+
+
+def _holder(to_status: str, rng: random.Random, machines: list, current_holder: str):
+    """(posiadacz, typ posiadacza, sekcja magazynu) po wejściu w stan - jak w database.py."""
+    if to_status == "MAGAZYN":
+        return "MAGAZYN", "WAREHOUSE", f"Sekcja {rng.choice(SECTIONS)}"
+    if to_status in ("SHOP_FLOOR", "W_TRANSPORCIE_OUT"):
+        if current_holder == "MAGAZYN":
+            return rng.choice(CARTS_OUT), "CART_OUT", None
+        return "SHOP_FLOOR", "FLOOR", None
+    if to_status == "W_PRODUKCJI":
+        candidates = [m for m in machines if m != current_holder]
+        return rng.choice(candidates), "MACHINE", None
+    if to_status == "CART-RET-05":
+        return "CART-RET-05", "CART_IN", None
+    if to_status == "W_TRANSPORCIE_RET":
+        return "CART-RET", "CART_IN", None
+    return to_status, "WAREHOUSE", None
+
+
+class TransitionModel:
+    """ALLOWED_TRANSITIONS jako listy (stan docelowy, skumulowana waga) - szybkie losowanie."""
+
+    def __init__(self, allowed_transitions: dict):
+        self.targets = {}
+        for source, targets in allowed_transitions.items():
+            names = [target.value for target in targets]
+            weights = [TARGET_WEIGHTS.get(name, 1.0) for name in names]
+            if source.value == "W_PRODUKCJI":
+                names.append("W_PRODUKCJI")
+                weights.append(TRANSFER_WEIGHT)
+            self.targets[source.value] = (names, weights)
+
+    def next_status(self, status: str, rng: random.Random):
+        entry = self.targets.get(status)
+        if not entry:
+            return None  # stan końcowy (WYCOFANA)
+        names, weights = entry
+        return rng.choices(names, weights)[0]
+
+
+def _ts(epoch: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def generate_envelope(rng, model, machines, unique_key, start, end, target_events):
+    """
+    Historia jednej koperty. Zwraca (wiersze events, stan końcowy).
+    Zdarzenia są rozłożone od start do end; pierwsze wejście to stan MAGAZYN.
+    """
+    status, holder, holder_type, section = "MAGAZYN", "MAGAZYN", "WAREHOUSE", f"Sekcja {rng.choice(SECTIONS)}"
+    operator = None
+    events = []
+    mean_gap = (end - start) / (target_events + 1)
+    now = start
+    while len(events) < target_events:
+        to_status = model.next_status(status, rng)
+        if to_status is None:
+            break
+        # Na CART-RET-05 z maszyny trafia tylko koperta z paletyzacji - najpierw przeniesienie
+        if status == "W_PRODUKCJI" and to_status == "CART-RET-05" and holder != "PALLETIZING" and "PALLETIZING" in machines:
+            to_status = "W_PRODUKCJI"
+            new_holder, new_type, new_section = "PALLETIZING", "MACHINE", None
+        else:
+            new_holder, new_type, new_section = _holder(to_status, rng, machines, holder)
+        now += rng.expovariate(1.0 / mean_gap)
+        if now >= end:
+            break
+        operation = _operation(status, to_status)
+        if operation in ("LOAD", "TRANSFER_AUTO"):
+            user = new_holder
+        elif operation == "RELEASE":
+            user = operator or "SYSTEM"
+        else:
+            user = rng.choice(WAREHOUSE_USERS)
+        events.append((unique_key, user, status, to_status, holder, new_holder, operation, _ts(now)))
+        status, holder, holder_type, section = to_status, new_holder, new_type, new_section
+        operator = user
+    updated_at = events[-1][7] if events else _ts(start)
+    return events, (status, holder, holder_type, section, operator, updated_at)
+
+
+def _user_indexes(conn, tables) -> list:
+    placeholders = ",".join("?" for _ in tables)
+    return conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        tuple(tables),
+    ).fetchall()
+
+
+class DatasetGenerator:
+    LOADED_TABLES = ("products", "envelopes", "events", "operator_notes", "product_machine_notes",
+                     "note_images", "note_image_blobs", "search_lists")
+
+    def __init__(self, output: Path, params: dict, seed: int, end: datetime, images_dir: Path = None):
+        self.output = output
+        self.params = params
+        self.seed = seed
+        self.end = end.timestamp()
+        self.start = self.end - HISTORY_DAYS * 86400
+        self.images_dir = images_dir
+        self.timings = {}
+
+    def _rng(self, stream: str) -> random.Random:
+        # Osobny strumień per tabela - zmiana liczby notatek nie zmienia historii kopert
+        return random.Random(f"{self.seed}:{stream}")
+
+    def _timed(self, name, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.timings[name] = round(time.perf_counter() - started, 3)
+        print(f"   {name:<16} {self.timings[name]:8.2f} s")
+        return result
+
+    def run(self) -> dict:
+        from database import Database, DEFAULT_OPERATOR_MACHINES
+        from domain import ALLOWED_TRANSITIONS
+
+        self.machines = list(DEFAULT_OPERATOR_MACHINES)
+        self.model = TransitionModel(ALLOWED_TRANSITIONS)
+        database = Database(str(self.output))
+
+        conn = sqlite3.connect(str(self.output), isolation_level=None)
+        indexes = _user_indexes(conn, self.LOADED_TABLES)
+        for name, _sql in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        try:
+            print(f"📦 Generowanie danych -> {self.output}")
+            product_ids = self._timed("products", self._load_products, conn)
+            envelope_keys = self._timed("envelopes+events", self._load_envelopes, conn, product_ids)
+            self._timed("operator_notes", self._load_operator_notes, conn, envelope_keys)
+            self._timed("product_notes", self._load_product_notes, conn)
+            self._timed("images", self._load_images, conn)
+            self._timed("search_lists", self._load_search_lists, conn, envelope_keys)
+
+            def build_indexes():
+                for _name, sql in indexes:
+                    conn.execute(sql)
+                conn.execute("ANALYZE")
+            self._timed("indexes", build_indexes)
+        finally:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+
+        usage = database.rebuild_storage_usage()
+        if usage.get("success"):
+            database.set_maintenance_state("note_images_gc:usage_initialized", "1")
+        summary = {
+            "output": str(self.output),
+            "seed": self.seed,
+            "end": _ts(self.end),
+            "params": self.params,
+            "rows": self._counts(),
+            "timings_s": self.timings,
+        }
+        database.set_maintenance_state("dataset_generator:summary", json.dumps(summary))
+        return summary
+
+    def _counts(self) -> dict:
+        conn = sqlite3.connect(str(self.output))
+        try:
+            return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in self.LOADED_TABLES}
+        finally:
+            conn.close()
+
+    # --- tabele ---
+
+    def _load_products(self, conn) -> list:
+        rng = self._rng("products")
+        rows = []
+        for i in range(self.params["products"]):
+            rows.append((rng.choice(COMPANIES), f"T{rng.randint(10000, 99999)} {rng.choice(('OXED', 'MAT', 'GLOSS', 'KRAFT'))}",
+                         f"RCS{i:06d}/C", _ts(self.start - rng.uniform(0, 86400 * 30))))
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO products (company_name, product_name, rcs_id, created_at) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        return [(row_id, rcs_id) for row_id, rcs_id in conn.execute("SELECT id, rcs_id FROM products ORDER BY id")]
+
+    def _load_envelopes(self, conn, product_ids: list) -> list:
+        rng = self._rng("envelopes")
+        count = self.params["envelopes"]
+        mean_events = self.params["events_per_envelope"]
+        keys = []
+        envelope_rows, event_rows = [], []
+        per_product = Counter()
+
+        def flush():
+            conn.execute("BEGIN")
+            conn.executemany(
+                '''
+                INSERT INTO envelopes
+                (unique_key, rcs_id, product_version, additional_number, status, current_holder_id,
+                 current_holder_type, creation_reason, warehouse_section, is_green, last_operator_id,
+                 updated_at, product_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                envelope_rows,
+            )
+            conn.executemany(
+                '''
+                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                event_rows,
+            )
+            conn.execute("COMMIT")
+            envelope_rows.clear()
+            event_rows.clear()
+
+        for n in range(count):
+            product_id, rcs_id = product_ids[rng.randrange(len(product_ids))]
+            per_product[product_id] += 1
+            additional_number = per_product[product_id]
+            version = f"{rng.randint(1, 3)}.{rng.randint(0, 5)}"
+            unique_key = f"{rcs_id}#{version}#{additional_number:02d}"
+            keys.append(unique_key)
+            created = rng.uniform(self.start, self.end - 3600)
+            # Liczba zdarzeń ~ wykładnicza wokół średniej (część kopert prawie nie krąży)
+            target_events = max(0, int(rng.expovariate(1.0 / mean_events))) if mean_events else 0
+            events, state = generate_envelope(rng, self.model, self.machines, unique_key, created, self.end, target_events)
+            status, holder, holder_type, section, operator, updated_at = state
+            reason = "NEW" if additional_number == 1 else rng.choice(("NEW", "DUPLICATE", "VERSION_CHANGE"))
+            is_green = 0 if rng.random() < 0.03 else 1
+            envelope_rows.append((unique_key, rcs_id, version, additional_number, status, holder, holder_type,
+                                  reason, section, is_green, operator, updated_at, product_id))
+            event_rows.extend(events)
+            if len(event_rows) >= BATCH_SIZE * 5 or len(envelope_rows) >= BATCH_SIZE:
+                flush()
+        if envelope_rows:
+            flush()
+        return keys
+
+    def _load_operator_notes(self, conn, envelope_keys: list) -> None:
+        rng = self._rng("operator_notes")
+        rows = []
+        for _ in range(self.params["operator_notes"]):
+            key = envelope_keys[rng.randrange(len(envelope_keys))]
+            kind = rng.choice(NOTE_KINDS)
+            if kind == "pallet":
+                data = {"pallet": rng.randint(1, 60), "count": rng.randint(100, 5000)}
+            elif kind == "slot":
+                data = {"slot": rng.randint(1, 40)}
+            else:
+                data = {"text": rng.choice(("Kontrola jakości OK", "Zmiana noża", "Przestój 15 min", "Korekta koloru"))}
+            created = _ts(rng.uniform(self.start, self.end))
+            active = 0 if rng.random() < 0.05 else 1
+            rows.append((key, rng.choice(self.machines), kind, json.dumps(data, ensure_ascii=False),
+                         rng.choice(self.machines), created, created, active, key.split("#", 1)[0]))
+        conn.execute("BEGIN")
+        conn.executemany(
+            '''
+            INSERT INTO operator_notes (envelope_id, machine_id, note_kind, note_data_json, created_by,
+                                        created_at, modified_at, is_active, rcs_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            rows,
+        )
+        conn.execute("COMMIT")
+
+    def _load_product_notes(self, conn) -> None:
+        rng = self._rng("product_notes")
+        products = self.params["products"]
+        pairs = set()
+        target = min(self.params["product_notes"], products * (len(self.machines) + 1))
+        rows = []
+        while len(rows) < target:
+            rcs_id = f"RCS{rng.randrange(products):06d}/C"
+            if rng.random() < 0.1:
+                machine, note_type = "GLOBAL", "global"
+            else:
+                machine, note_type = rng.choice(self.machines), "specific"
+            if (rcs_id, machine, note_type) in pairs:
+                continue
+            pairs.add((rcs_id, machine, note_type))
+            created = _ts(rng.uniform(self.start, self.end))
+            rows.append((rcs_id, machine, f"Ustawienia {machine} dla {rcs_id}", note_type, created, created, "admin", "admin"))
+        conn.execute("BEGIN")
+        conn.executemany(
+            '''
+            INSERT INTO product_machine_notes (product_code, machine_id, note_content, note_type,
+                                               created_at, modified_at, created_by, modified_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            rows,
+        )
+        conn.execute("COMMIT")
+
+    def _blob_pool(self, rng: random.Random) -> list:
+        """Pula unikalnych obrazów: (sha256, storage_path, variants, size pełnego, size łączny, w, h)."""
+        pool = []
+        for i in range(self.params["blob_pool"]):
+            sha = hashlib.sha256(f"{self.seed}:blob:{i}".encode()).hexdigest()
+            uploaded = time.gmtime(rng.uniform(self.start, self.end))
+            rel_dir = f"{uploaded.tm_year}/{uploaded.tm_mon:02d}"
+            width, height = rng.choice(((1600, 1200), (1200, 1600), (1600, 900), (900, 1600)))
+            size = rng.randint(60_000, 400_000)
+            variants = {}
+            for name, max_dim in (("thumb", 160), ("preview", 640)):
+                scale = max_dim / max(width, height)
+                variants[name] = {
+                    "path": f"{rel_dir}/{sha}_{name}.webp",
+                    "width": round(width * scale),
+                    "height": round(height * scale),
+                    "size_bytes": max(1000, int(size * scale * scale * 1.5)),
+                    "sha256": hashlib.sha256(f"{sha}:{name}".encode()).hexdigest(),
+                }
+            total = size + sum(v["size_bytes"] for v in variants.values())
+            pool.append((sha, f"{rel_dir}/{sha}.webp", variants, size, total, width, height))
+        return pool
+
+    def _load_images(self, conn) -> None:
+        rng = self._rng("images")
+        if not self.params["images"] or not self.params["blob_pool"]:
+            return
+        pool = self._blob_pool(rng)
+        note_ids = {
+            "operator_note": [row[0] for row in conn.execute("SELECT id FROM operator_notes WHERE is_active = 1")],
+            "product_machine_note": [row[0] for row in conn.execute("SELECT id FROM product_machine_notes")],
+        }
+        scopes = [scope for scope, ids in note_ids.items() if ids]
+        if not scopes:
+            return
+        refs = Counter()
+        order = Counter()
+        rows = []
+
+        def flush():
+            conn.execute("BEGIN")
+            conn.executemany(
+                '''
+                INSERT INTO note_images (note_scope, note_id, storage_path, original_filename, mime_type, width, height,
+                                         size_bytes, sha256, order_index, created_by, modified_by,
+                                         created_at, modified_at, is_active, variants_json)
+                VALUES (?, ?, ?, ?, 'image/webp', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                rows,
+            )
+            conn.execute("COMMIT")
+            rows.clear()
+
+        for _ in range(self.params["images"]):
+            scope = rng.choice(scopes)
+            note_id = note_ids[scope][rng.randrange(len(note_ids[scope]))]
+            # Rozkład Zipfa po puli - kilka zdjęć (np. instrukcje) powtarza się bardzo często
+            blob = pool[min(len(pool) - 1, int(len(pool) * rng.random() ** 3))]
+            sha, path, variants, size, _total, width, height = blob
+            active = 0 if rng.random() < 0.05 else 1
+            if active:
+                refs[sha] += 1
+            order[(scope, note_id)] += 1
+            created = _ts(rng.uniform(self.start, self.end))
+            author = rng.choice(self.machines)
+            rows.append((scope, note_id, path, f"IMG_{rng.randint(1000, 9999)}.jpg", width, height, size, sha,
+                         order[(scope, note_id)] - 1, author, author, created, created, active,
+                         json.dumps(variants)))
+            if len(rows) >= BATCH_SIZE:
+                flush()
+        if rows:
+            flush()
+
+        conn.execute("BEGIN")
+        conn.executemany(
+            '''
+            INSERT INTO note_image_blobs (sha256, storage_path, variants_json, size_bytes, ref_count)
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            [(sha, path, json.dumps(variants), total, refs[sha])
+             for sha, path, variants, _size, total, _w, _h in pool if refs[sha]],
+        )
+        conn.execute("COMMIT")
+        if self.images_dir:
+            self._write_blob_files([blob for blob in pool if refs[blob[0]]])
+
+    def _write_blob_files(self, pool: list) -> None:
+        """Zapisuje pliki puli (pełny obraz + warianty) - małe WebP w jednolitym kolorze."""
+        from PIL import Image
+        for sha, path, variants, _size, _total, width, height in pool:
+            color = tuple(bytes.fromhex(sha[:6]))
+            for rel_path, w, h in [(path, width, height)] + [(v["path"], v["width"], v["height"]) for v in variants.values()]:
+                target = self.images_dir / rel_path
+                if target.exists():
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                Image.new("RGB", (max(1, w // 8), max(1, h // 8)), color).save(target, format="WEBP", quality=50)
+
+    def _load_search_lists(self, conn, envelope_keys: list) -> None:
+        rng = self._rng("search_lists")
+        rows = []
+        per_day = max(1, math.ceil(self.params["search_items"] / SEARCH_LIST_DAYS))
+        for day in range(SEARCH_LIST_DAYS):
+            day_start = self.end - (day + 1) * 86400
+            date = time.strftime("%Y-%m-%d", time.gmtime(day_start + 43200))
+            for _ in range(per_day):
+                created = day_start + rng.uniform(0, 86400)
+                # Starsze dni - większość znaleziona
+                found = 1 if day > 0 and rng.random() < 0.8 else 0
+                rows.append((rng.choice(WAREHOUSE_USERS + [None]), envelope_keys[rng.randrange(len(envelope_keys))],
+                             "high" if rng.random() < 0.1 else "normal", found,
+                             _ts(created + rng.uniform(60, 7200)) if found else None, _ts(created), date))
+        conn.execute("BEGIN")
+        conn.executemany(
+            '''
+            INSERT INTO search_lists (user_id, envelope_id, priority, found, found_at, created_at, date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            rows,
+        )
+        conn.execute("COMMIT")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generator dużego zbioru danych systemu kopert")
+    parser.add_argument("--output", required=True, help="nowy plik bazy")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--end", help="koniec historii YYYY-MM-DD (domyślnie dziś, UTC)")
+    parser.add_argument("--images-dir", help="zapisz pliki puli zdjęć (NOTE_IMAGES_DIR)")
+    for name in SCALES["small"]:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name, help=f"nadpisuje {name} ze skali")
+    args = parser.parse_args(argv)
+
+    params = dict(SCALES[args.scale])
+    for name in params:
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    if args.end:
+        end = datetime.strptime(args.end, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    else:
+        end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    output = Path(args.output).resolve()
+    if output.exists():
+        print(f"❌ Plik {output} już istnieje - generator tworzy nową bazę")
+        return 1
+    _prepare_environment(output)
+    generator = DatasetGenerator(output, params, args.seed, end, Path(args.images_dir) if args.images_dir else None)
+    summary = generator.run()
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+"""
+Mikrobenchmark serializacji JSON dużej strony listy kopert (domyślnie 10k elementów).
+
+Porównuje:
+- flask_default      - DefaultJSONProvider Flaska (json ze stdlib, jak przed json_provider.py)
+- provider_stdlib    - FastJSONProvider z JSON_ENCODER=stdlib
+- provider_orjson    - FastJSONProvider z orjson (pomijany, gdy orjson nie jest zainstalowany)
+- *_stream           - ta sama odpowiedź strumieniowana partiami (czas całości i pierwszej partii)
+
+Strona ma kształt odpowiedzi /api/envelopes ({"data": [...], "meta": {...}}), z polskimi
+znakami w nazwach firm. Każdy wynik jest sprawdzany (json.loads == dane wejściowe).
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/json_benchmark.py --items 10000 --repeat 30
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_provider  # noqa: E402
+
+COMPANIES = ["PROTEGA GLOBAL LTD", "NORDPACK", "Zakłady Papiernicze Świecie", "KARTON-POL", "Łódzka Poligrafia"]
+STATUSES = ["MAGAZYN", "SHOP_FLOOR", "W_PRODUKCJI", "CART-RET-05"]
+MACHINES = ["PRINTER MAIN", "BOOBST 1", "PALLETIZING", "CART-OUT-3", "MAGAZYN"]
+
+
+def build_page(items: int, seed: int) -> dict:
+    """Strona jak z get_envelopes_paginated (records.EnvelopeListRow)."""
+    rng = random.Random(seed)
+    data = []
+    for n in range(items):
+        rcs_id = f"RCS{100000 + n % 5000:06d}/C"
+        company = rng.choice(COMPANIES) if rng.random() < 0.9 else None
+        product = f"Karton {rng.randint(100, 999)} x {rng.randint(100, 999)}" if company else None
+        status = rng.choice(STATUSES)
+        data.append({
+            "id": f"{rcs_id}#1.{rng.randint(0, 3)}#{n:06d}",
+            "rcs_id": rcs_id,
+            "product": f"{company} | {product}" if company else f"KOPERTA {rcs_id}",
+            "company_name": company,
+            "product_name": product,
+            "status": status,
+            "machine": rng.choice(MACHINES),
+            "location": f"Sekcja {rng.choice('ABCDE')}" if status == "MAGAZYN" else None,
+        })
+    return {"data": data, "meta": {"total": items * 5, "page": 1, "limit": items, "total_pages": 5}}
+
+
+def _timed(fn, repeat: int) -> tuple:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings, result
+
+
+def _summary(timings: list, size: int, extra: dict = None) -> dict:
+    timings = sorted(timings)
+    summary = {
+        "p50_ms": round(statistics.median(timings), 3),
+        "min_ms": round(timings[0], 3),
+        "max_ms": round(timings[-1], 3),
+        "bytes": size,
+    }
+    summary.update(extra or {})
+    return summary
+
+
+def run(items: int, repeat: int, seed: int) -> dict:
+    page = build_page(items, seed)
+    app = Flask("json_benchmark")
+    providers = {"flask_default": DefaultJSONProvider(app)}
+    original_encoder = json_provider.JSON_ENCODER
+    try:
+        json_provider.JSON_ENCODER = "stdlib"
+        providers["provider_stdlib"] = json_provider.FastJSONProvider(app)
+        if json_provider.orjson is not None:
+            json_provider.JSON_ENCODER = "orjson"
+            providers["provider_orjson"] = json_provider.FastJSONProvider(app)
+    finally:
+        json_provider.JSON_ENCODER = original_encoder
+
+    results = {}
+    for name, provider in providers.items():
+        if isinstance(provider, json_provider.FastJSONProvider):
+            encode = lambda: provider.dumps(page)  # noqa: E731
+        else:
+            # jak DefaultJSONProvider.response() poza trybem debug (kompaktowe separatory)
+            encode = lambda: provider.dumps(page, indent=None, separators=(",", ":"))  # noqa: E731
+        timings, text = _timed(encode, repeat)
+        if json.loads(text) != page:
+            raise AssertionError(f"{name}: wynik różni się od danych wejściowych")
+        results[name] = _summary(timings, len(text.encode("utf-8")))
+
+        if isinstance(provider, json_provider.FastJSONProvider):
+            first_chunk = []
+
+            def stream():
+                chunks = provider._iter_document(page)
+                started = time.perf_counter()
+                parts = [next(chunks)]
+                first_chunk.append((time.perf_counter() - started) * 1000.0)
+                parts.extend(chunks)
+                return "".join(parts)
+
+            timings, text = _timed(stream, repeat)
+            if json.loads(text) != page:
+                raise AssertionError(f"{name}_stream: wynik różni się od danych wejściowych")
+            results[f"{name}_stream"] = _summary(timings, len(text.encode("utf-8")), {
+                "first_chunk_p50_ms": round(statistics.median(first_chunk), 3),
+                "chunk_items": json_provider.JSON_STREAM_CHUNK_ITEMS,
+            })
+
+    baseline = results["flask_default"]["p50_ms"]
+    for summary in results.values():
+        summary["speedup_vs_flask_default"] = round(baseline / summary["p50_ms"], 2) if summary["p50_ms"] else None
+    return {"items": items, "repeat": repeat, "orjson": json_provider.orjson is not None, "results": results}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mikrobenchmark serializacji JSON strony kopert")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="plik JSON z wynikiem (domyślnie stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args.items, args.repeat, args.seed)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,181 @@
+"""
+Mikrobenchmark gorących ścieżek odczytu Database (wiersz SQLite -> dict gotowy do JSON).
+
+Mierzy metody używane przez listy i szczegóły w UI:
+- get_envelopes_paginated  (duże strony listy kopert)
+- get_envelope_history
+- get_operator_notes_paginated
+- get_note_images / get_note_image_by_id
+
+Dla każdej: czas wywołania (p50/p95, ms), w tym część poza SQLite (python_p50_ms - czas
+wywołania minus execute/fetch zmierzone przez metrics.TimedCursor, czyli głównie budowa
+odpowiedzi), oraz pamięć wyników (tracemalloc, osobny przebieg - śledzenie spowalnia kod).
+Korzysta tylko z publicznego API Database, więc ten sam skrypt można uruchomić na starszym
+commicie i porównać wyniki.
+
+Baza: istniejąca (--db) albo świeża ze skali small z dataset_generator.py (--seed).
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/read_path_benchmark.py --iterations 200 --page-size 500 --output odczyty.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def _prepare_environment(db_path: Path) -> None:
+    """DB_PATH przed importem database."""
+    os.environ['DB_PATH'] = str(db_path)
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+
+
+def _generate(db_path: Path, seed: int) -> None:
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import dataset_generator
+    params = dict(dataset_generator.SCALES["small"])
+    end = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    dataset_generator.DatasetGenerator(db_path, params, seed, end, None).run()
+
+
+def _samples(db, seed: int, count: int) -> dict:
+    """Klucze do zapytań: koperty z historią, pary (koperta, maszyna) z notatkami, notatki ze zdjęciami."""
+    rng = random.Random(seed)
+    conn = db.get_connection()
+    try:
+        envelopes = [row[0] for row in conn.execute(
+            "SELECT envelope_key FROM events GROUP BY envelope_key ORDER BY COUNT(*) DESC LIMIT ?", (count,))]
+        note_pairs = [tuple(row) for row in conn.execute(
+            "SELECT envelope_id, machine_id FROM operator_notes WHERE is_active = 1 "
+            "GROUP BY envelope_id, machine_id ORDER BY COUNT(*) DESC LIMIT ?", (count,))]
+        image_notes = [tuple(row) for row in conn.execute(
+            "SELECT note_scope, note_id FROM note_images WHERE is_active = 1 "
+            "GROUP BY note_scope, note_id ORDER BY COUNT(*) DESC LIMIT ?", (count,))]
+        image_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM note_images WHERE is_active = 1 ORDER BY id LIMIT ?", (count,))]
+        total = conn.execute("SELECT COUNT(*) FROM envelopes").fetchone()[0]
+    finally:
+        conn.close()
+    for values in (envelopes, note_pairs, image_notes, image_ids):
+        rng.shuffle(values)
+    return {"envelopes": envelopes, "note_pairs": note_pairs, "image_notes": image_notes,
+            "image_ids": image_ids, "total_envelopes": total}
+
+
+def _cases(db, samples: dict, page_size: int) -> dict:
+    pages = max(1, samples["total_envelopes"] // page_size)
+
+    def cycle(values):
+        index = 0
+        while True:
+            yield values[index % len(values)]
+            index += 1
+
+    envelopes = cycle(samples["envelopes"] or [""])
+    note_pairs = cycle(samples["note_pairs"] or [("", "")])
+    image_notes = cycle(samples["image_notes"] or [("operator_note", 0)])
+    image_ids = cycle(samples["image_ids"] or [0])
+    page_numbers = cycle(list(range(1, pages + 1)))
+    return {
+        "envelopes_page": lambda: db.get_envelopes_paginated(next(page_numbers), page_size),
+        "envelope_history": lambda: db.get_envelope_history(next(envelopes), 50),
+        "operator_notes_page": lambda: db.get_operator_notes_paginated(*next(note_pairs), limit=100),
+        "note_images": lambda: db.get_note_images(*next(image_notes)),
+        "note_image_by_id": lambda: db.get_note_image_by_id(next(image_ids)),
+    }
+
+
+def _measure(call, iterations: int, warmup: int) -> dict:
+    import metrics
+    for _ in range(warmup):
+        call()
+    timings = []
+    python_timings = []
+    for _ in range(iterations):
+        metrics.begin_request_sql()
+        started = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - started
+        sql_seconds, _ = metrics.request_sql_stats()
+        timings.append(elapsed * 1000.0)
+        python_timings.append(max(0.0, elapsed - sql_seconds) * 1000.0)
+    timings.sort()
+
+    # Alokacje: osobny, krótszy przebieg pod tracemalloc
+    alloc_iterations = max(1, iterations // 10)
+    tracemalloc.start()
+    blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.reset_peak()
+    kept = [call() for _ in range(alloc_iterations)]   # wyniki żyją - liczymy obiekty odpowiedzi
+    blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "python_p50_ms": round(statistics.median(python_timings), 3),
+        "retained_blocks_per_call": round((blocks_after - blocks_before) / alloc_iterations, 1),
+        "peak_kib": round(peak / 1024.0, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mikrobenchmark odczytów Database (wiersz -> dict)")
+    parser.add_argument("--db", help="istniejąca baza (domyślnie: nowa baza small z dataset_generator)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--only", help="nazwy przypadków po przecinku")
+    parser.add_argument("--output", help="plik JSON z wynikiem (domyślnie stdout)")
+    args = parser.parse_args(argv)
+
+    workdir = None
+    if args.db:
+        db_path = Path(args.db).resolve()
+    else:
+        workdir = tempfile.TemporaryDirectory(prefix="koperty_reads_")
+        db_path = Path(workdir.name) / "reads.db"
+    _prepare_environment(db_path)
+    if not args.db:
+        print(f"📦 Generowanie bazy {db_path} ...", file=sys.stderr)
+        _generate(db_path, args.seed)
+
+    import database
+    db = database.Database(str(db_path))
+    cases = _cases(db, _samples(db, args.seed, 200), args.page_size)
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(",")}
+        cases = {name: call for name, call in cases.items() if name in wanted}
+
+    report = {"db": str(db_path), "page_size": args.page_size, "results": {}}
+    for name, call in cases.items():
+        report["results"][name] = _measure(call, args.iterations, args.warmup)
+        print(f"⏱️ {name}: {report['results'][name]}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if workdir:
+        workdir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,422 @@
+"""
+Benchmark obciążeniowy: symulacja zmiany produkcyjnej (skany kopert, notatki, wyszukiwanie).
+
+Tworzy tymczasową bazę (DB_PATH) w zadanej skali, a potem wiele wątków wykonuje
+mieszankę operacji - część przez API Database, część przez klienta testowego Flask
+(pełna ścieżka HTTP: routing, hooki, JSON). Koperty krążą w obiegu:
+
+    MAGAZYN -issue-> SHOP_FLOOR -load-> W_PRODUKCJI -transfer-> W_PRODUKCJI
+    W_PRODUKCJI -release-> SHOP_FLOOR / CART-RET-05 (PALLETIZING) -return-> MAGAZYN
+
+Każda koperta jest w danej chwili w rękach jednego wątku (pule wg stanu), więc błędy
+w wynikach oznaczają problem aplikacji / blokady, a nie konflikt benchmarku.
+
+Wynik (JSON): przepustowość, p50/p95/p99 opóźnień i czas oczekiwania na blokadę
+zapisu (BEGIN IMMEDIATE, metrics.request_lock_wait_seconds) per operacja i kanał.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/shift_benchmark.py --envelopes 5000 --threads 16 --duration 30 --output wynik.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from urllib.parse import quote
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Udział operacji w ruchu zmiany (wagi względne)
+SHIFT_MIX = {
+    "issue": 10,
+    "load": 14,
+    "transfer": 6,
+    "release": 12,
+    "return": 8,
+    "status": 20,
+    "note": 6,
+    "product_note": 8,
+    "search": 10,
+    "history": 6,
+}
+
+MACHINES = [
+    'PRINTER MAIN', 'PRINTER 2', 'VISON', 'ETERNA', 'CUTER', 'ST2',
+    'VERSOR', 'BOOBST 1', 'BOOBST 2', 'PALLETIZING',
+]
+
+
+def _prepare_environment(workdir: Path) -> None:
+    """Zmienne środowiskowe aplikacji - muszą być ustawione przed importem api_server."""
+    os.environ['DB_PATH'] = str(workdir / "bench.db")
+    os.environ['NOTE_IMAGES_DIR'] = str(workdir / "note_images")
+    os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+    os.environ['METRICS_DIR'] = ''
+    os.environ.setdefault('IMAGE_SIGNING_SECRET', 'benchmark')
+    os.environ['APP_ENV'] = 'benchmark'
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+
+
+def seed_database(db, envelopes: int, products: int, seed: int) -> dict:
+    """Produkty, koperty (wszystkie w MAGAZYN) i notatki produkt+maszyna - jedną transakcją."""
+    rng = random.Random(seed)
+    rcs_ids = [f"RCS{100000 + i:06d}/C" for i in range(products)]
+    envelope_rows = []
+    for n in range(envelopes):
+        rcs_id = rcs_ids[n % products]
+        version = f"1.{rng.randint(0, 3)}"
+        envelope_rows.append((
+            f"{rcs_id}#{version}#{n:06d}", rcs_id, version, n + 1,
+            "MAGAZYN", "MAGAZYN", "WAREHOUSE", f"Sekcja {rng.choice('ABCDE')}",
+        ))
+
+    conn = db.get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO products (company_name, product_name, rcs_id) VALUES (?, ?, ?)",
+            [(f"FIRMA {i % 97}", f"PRODUKT {i}", rcs_id) for i, rcs_id in enumerate(rcs_ids)],
+        )
+        conn.executemany(
+            '''
+            INSERT INTO envelopes
+            (unique_key, rcs_id, product_version, additional_number, status, current_holder_id,
+             current_holder_type, warehouse_section, creation_reason, is_green)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'NEW', 1)
+            ''',
+            envelope_rows,
+        )
+        conn.executemany(
+            '''
+            INSERT INTO product_machine_notes (product_code, machine_id, note_type, note_content, created_by)
+            VALUES (?, ?, 'specific', ?, 'benchmark')
+            ''',
+            [(rcs_id, rng.choice(MACHINES), f"Ustawienia dla {rcs_id}") for rcs_id in rcs_ids[: max(1, products // 4)]],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return {"products": rcs_ids, "envelopes": [row[0] for row in envelope_rows]}
+
+
+class EnvelopePools:
+    """Koperty pogrupowane wg stanu; wątek pobiera kopertę na czas jednej operacji."""
+
+    def __init__(self, warehouse_keys):
+        self._lock = threading.Lock()
+        self._pools = {state: deque() for state in ("MAGAZYN", "SHOP_FLOOR", "W_PRODUKCJI", "CART-RET-05")}
+        self._pools["MAGAZYN"].extend(warehouse_keys)
+        self.machine_of = {}
+
+    def take(self, state: str, rng: random.Random):
+        with self._lock:
+            pool = self._pools[state]
+            if not pool:
+                return None
+            # Losowa koperta z początku kolejki - obieg zbliżony do FIFO, ale nie ściśle
+            pool.rotate(-rng.randrange(min(len(pool), 8)))
+            return pool.popleft()
+
+    def put(self, state: str, key: str) -> None:
+        with self._lock:
+            self._pools[state].append(key)
+
+    def any_key(self, rng: random.Random):
+        with self._lock:
+            pools = [pool for pool in self._pools.values() if pool]
+            if not pools:
+                return None
+            pool = rng.choice(pools)
+            return pool[rng.randrange(len(pool))]
+
+
+class Recorder:
+    """Opóźnienia i oczekiwanie na blokadę per (operacja, kanał) - listy per wątek, scalane na końcu."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.lock_waits = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def merge(self, other: "Recorder") -> None:
+        for key, values in other.latencies.items():
+            self.latencies[key].extend(values)
+        for key, values in other.lock_waits.items():
+            self.lock_waits[key].extend(values)
+        for key, count in other.errors.items():
+            self.errors[key] += count
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class ShiftWorker(threading.Thread):
+    """Jeden "operator": losuje operację wg SHIFT_MIX i kanał (API Database / HTTP)."""
+
+    def __init__(self, index: int, args, api_server, pools: EnvelopePools, products: list, stop_at: float, record_from: float):
+        super().__init__(name=f"shift-worker-{index}", daemon=True)
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.args = args
+        self.api_server = api_server
+        self.db = api_server.db
+        self.client = api_server.app.test_client()
+        self.pools = pools
+        self.products = products
+        self.stop_at = stop_at
+        self.record_from = record_from
+        self.recorder = Recorder()
+        self.user = f"operator{index}"
+        self._ops = list(SHIFT_MIX)
+        self._weights = [SHIFT_MIX[op] for op in self._ops]
+
+    def run(self) -> None:
+        import metrics
+        while True:
+            now = time.perf_counter()
+            if now >= self.stop_at:
+                break
+            op = self.rng.choices(self._ops, self._weights)[0]
+            channel = "http" if self.rng.random() < self.args.http_share else "api"
+            metrics.begin_request_sql()
+            started = time.perf_counter()
+            try:
+                ok = getattr(self, f"_op_{op}")(channel)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if ok is None:
+                continue  # brak koperty w potrzebnym stanie - operacja pominięta
+            if started < self.record_from:
+                continue  # rozgrzewka
+            key = (op, channel)
+            self.recorder.latencies[key].append(elapsed)
+            self.recorder.lock_waits[key].append(metrics.request_lock_wait_seconds())
+            if not ok:
+                self.recorder.errors[key] += 1
+
+    # --- obieg kopert ---
+
+    def _transition(self, from_state: str, channel: str, call_api, call_http, next_state) -> bool:
+        key = self.pools.take(from_state, self.rng)
+        if key is None:
+            return None
+        if channel == "http":
+            response = call_http(key)
+            ok = response.status_code == 200
+            result = response.get_json() or {}
+        else:
+            result = call_api(key)
+            ok = bool(result.get("success"))
+        self.pools.put(next_state(key, result) if ok else from_state, key)
+        return ok
+
+    def _op_issue(self, channel):
+        return self._transition(
+            "MAGAZYN", channel,
+            lambda key: self.db.issue_envelope(key, "CART-OUT-1", self.user),
+            lambda key: self.client.post(f"/api/envelopes/{quote(key, safe='')}/issue", json={"cart_id": "CART-OUT-1", "user_id": self.user}),
+            lambda key, result: "SHOP_FLOOR",
+        )
+
+    def _load(self, from_state, channel):
+        machine = self.rng.choice(MACHINES)
+
+        def next_state(key, result):
+            self.pools.machine_of[key] = machine
+            return "W_PRODUKCJI"
+
+        return self._transition(
+            from_state, channel,
+            lambda key: self.db.bind_envelope_to_machine(key, machine, machine),
+            lambda key: self.client.post(f"/api/envelopes/{quote(key, safe='')}/load", json={"machine": machine, "operator_id": machine}),
+            next_state,
+        )
+
+    def _op_load(self, channel):
+        return self._load("SHOP_FLOOR", channel)
+
+    def _op_transfer(self, channel):
+        return self._load("W_PRODUKCJI", channel)
+
+    def _op_release(self, channel):
+        def next_state(key, result):
+            return "CART-RET-05" if self.pools.machine_of.get(key) == "PALLETIZING" else "SHOP_FLOOR"
+
+        return self._transition(
+            "W_PRODUKCJI", channel,
+            lambda key: self.db.release_envelope(key),
+            lambda key: self.client.post(f"/api/envelopes/{quote(key, safe='')}/release", json={}),
+            next_state,
+        )
+
+    def _op_return(self, channel):
+        state = "CART-RET-05" if self.rng.random() < 0.8 else "SHOP_FLOOR"
+        location = f"Sekcja {self.rng.choice('ABCDE')}"
+        return self._transition(
+            state, channel,
+            lambda key: self.db.return_to_warehouse(key, location),
+            lambda key: self.client.post(f"/api/envelopes/{quote(key, safe='')}/return", json={"location": location}),
+            lambda key, result: "MAGAZYN",
+        )
+
+    # --- odczyty i notatki ---
+
+    def _op_status(self, channel):
+        key = self.pools.any_key(self.rng)
+        if key is None:
+            return None
+        if channel == "http":
+            return self.client.get(f"/api/envelopes/{quote(key, safe='')}/status").status_code == 200
+        # To samo zapytanie co endpoint /status
+        return self.db.get_envelope_status(key) is not None
+
+    def _op_history(self, channel):
+        key = self.pools.any_key(self.rng)
+        if key is None:
+            return None
+        if channel == "http":
+            return self.client.get(f"/api/envelopes/{quote(key, safe='')}/history").status_code == 200
+        return isinstance(self.db.get_envelope_history(key), list)
+
+    def _op_note(self, channel):
+        key = self.pools.any_key(self.rng)
+        if key is None:
+            return None
+        machine = self.rng.choice(MACHINES)
+        note_data = {"text": "Kontrola jakości OK", "slot": self.rng.randint(1, 40)}
+        if channel == "http":
+            response = self.client.post("/api/operator-notes", json={
+                "envelope_id": key, "machine_id": machine, "note_kind": "standard",
+                "note_data_json": note_data, "author": self.user,
+            })
+            return response.status_code == 200
+        return bool(self.db.create_operator_note(key, machine, "standard", note_data, self.user).get("success"))
+
+    def _op_product_note(self, channel):
+        product_code = self.rng.choice(self.products)
+        machine = self.rng.choice(MACHINES)
+        if channel == "http":
+            return self.client.get(f"/api/product-notes/{quote(product_code)}/{quote(machine)}").status_code == 200
+        return isinstance(self.db.get_product_machine_notes_bundle(product_code, machine), dict)
+
+    def _op_search(self, channel):
+        fragment = self.rng.choice(self.products)[3:8]
+        if channel == "http":
+            return self.client.get("/api/envelopes/search", query_string={"q": fragment}).status_code == 200
+        return isinstance(self.db.search_products(fragment), list)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def build_report(recorder: Recorder, duration: float, config: dict) -> dict:
+    operations = {}
+    total = 0
+    for (op, channel), values in sorted(recorder.latencies.items()):
+        values.sort()
+        waits = sorted(recorder.lock_waits[(op, channel)])
+        count = len(values)
+        total += count
+        operations.setdefault(op, {})[channel] = {
+            "count": count,
+            "errors": recorder.errors.get((op, channel), 0),
+            "ops_per_s": round(count / duration, 2),
+            "p50_ms": round(_percentile(values, 0.50) * 1000.0, 3),
+            "p95_ms": round(_percentile(values, 0.95) * 1000.0, 3),
+            "p99_ms": round(_percentile(values, 0.99) * 1000.0, 3),
+            "max_ms": round(values[-1] * 1000.0, 3),
+            "lock_wait_ms_total": round(sum(waits) * 1000.0, 3),
+            "lock_wait_p95_ms": round(_percentile(waits, 0.95) * 1000.0, 3),
+        }
+    return {
+        "benchmark": "shift",
+        "commit": _git_commit(),
+        "config": config,
+        "duration_s": round(duration, 3),
+        "total_ops": total,
+        "throughput_ops_per_s": round(total / duration, 2) if duration else 0.0,
+        "errors": sum(recorder.errors.values()),
+        "operations": operations,
+    }
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="koperty_bench_") as tmp:
+        workdir = Path(args.workdir or tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+        _prepare_environment(workdir)
+        import api_server
+
+        seeded = seed_database(api_server.db, args.envelopes, args.products, args.seed)
+        pools = EnvelopePools(seeded["envelopes"])
+
+        started = time.perf_counter()
+        record_from = started + args.warmup
+        stop_at = record_from + args.duration
+        workers = [
+            ShiftWorker(i, args, api_server, pools, seeded["products"], stop_at, record_from)
+            for i in range(args.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        recorder = Recorder()
+        for worker in workers:
+            recorder.merge(worker.recorder)
+        config = {
+            "envelopes": args.envelopes,
+            "products": args.products,
+            "threads": args.threads,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "http_share": args.http_share,
+            "seed": args.seed,
+            "mix": SHIFT_MIX,
+        }
+        return build_report(recorder, args.duration, config)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark zmiany produkcyjnej (tymczasowa baza)")
+    parser.add_argument("--envelopes", type=int, default=2000, help="liczba kopert w bazie")
+    parser.add_argument("--products", type=int, default=200, help="liczba produktów (RCS)")
+    parser.add_argument("--threads", type=int, default=8, help="liczba równoległych operatorów")
+    parser.add_argument("--duration", type=float, default=10.0, help="czas pomiaru (s)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="rozgrzewka bez pomiaru (s)")
+    parser.add_argument("--http-share", type=float, default=0.5, help="udział operacji przez klienta Flask (0-1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="katalog bazy (domyślnie tymczasowy, usuwany po teście)")
+    parser.add_argument("--output", help="plik wyniku JSON (domyślnie stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(f"✅ {report['total_ops']} operacji, {report['throughput_ops_per_s']} op/s -> {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
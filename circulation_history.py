@@ -7,7 +7,7 @@ import sqlite3
 from datetime import datetime
 import os
 
-DB_NAME = "koperty_system.db"
+DB_NAME = os.environ.get('DB_PATH', 'koperty_system.db')
 HISTORY_DIR = "circulation_history"
 
 def ensure_history_dir():
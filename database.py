@@ -1,10 +1,22 @@
 import hashlib
 import json
+import os
+import posixpath
 import secrets
 import sqlite3
 from typing import List, Dict, Optional, Any
 
-DB_NAME = "koperty_system.db"
+import domain
+import metrics
+import records
+import sql_trace
+import startup_profile
+
+# DB_PATH - inny plik bazy (np. tymczasowa baza benchmarków)
+DB_NAME = os.environ.get('DB_PATH', 'koperty_system.db')
+# Wersja schematu zapisywana w PRAGMA user_version. Podbij przy każdej zmianie
+# _create_tables (nowa tabela, kolumna, indeks, seed) - inaczej istniejące bazy jej nie dostaną.
+SCHEMA_VERSION = 3
 DEFAULT_OPERATOR_MACHINES = [
     'PRINTER MAIN',
     'PRINTER 2',
@@ -18,13 +30,63 @@ DEFAULT_OPERATOR_MACHINES = [
     'PALLETIZING'
 ]
 
+def _parse_variants_json(raw: Optional[str]) -> Dict[str, Any]:
+    """Warianty rozdzielczości zdjęcia; stare wiersze (bez wariantów) -> {}."""
+    if not raw:
+        return {}
+    try:
+        variants = json.loads(raw)
+    except Exception:
+        return {}
+    return variants if isinstance(variants, dict) else {}
+
+
+def _storage_paths(storage_path: str, variants: Dict[str, Any]) -> List[str]:
+    """Ścieżki względne wszystkich plików zdjęcia (pełny obraz + warianty)."""
+    paths = [storage_path]
+    for variant in (variants or {}).values():
+        if variant.get("path"):
+            paths.append(variant["path"])
+    return paths
+
+
+def _stored_size(size_bytes: Optional[int], variants: Dict[str, Any]) -> int:
+    """Rozmiar na dysku: pełny obraz + warianty."""
+    return int(size_bytes or 0) + sum(int(v.get("size_bytes") or 0) for v in (variants or {}).values())
+
+
+def _bump_storage_usage(cursor, dimension: str, key: str, files: int, size_bytes: int) -> None:
+    """
+    Aktualizuje licznik zajętości w transakcji wywołującego.
+    dimension: 'dir' (katalog YYYY/MM, pliki fizyczne) lub 'scope' (aktywne zdjęcia notatek).
+    """
+    cursor.execute(
+        '''
+        INSERT INTO note_storage_usage (dimension, usage_key, files, size_bytes, modified_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(dimension, usage_key) DO UPDATE SET
+            files = files + excluded.files,
+            size_bytes = size_bytes + excluded.size_bytes,
+            modified_at = CURRENT_TIMESTAMP
+        ''',
+        (dimension, key, files, size_bytes),
+    )
+
+
+# Kolumny listy kopert z records.EnvelopeListRow (kolejność = rozpakowanie w mapperze JSON)
+_ENVELOPE_LIST_SELECT = records.EnvelopeListRow.select_list("e", {"company_name": "p", "product_name": "p"})
+
+
 class Database:
     def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
-        self._create_tables()
+        self._ensure_schema()
 
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
+        # TimedConnection: czas zapytań i liczba połączeń w /metrics
+        conn = sqlite3.connect(self.db_name, factory=metrics.TimedConnection)
+        if sql_trace.SQL_TRACE_ENABLED:
+            sql_trace.instrument(conn, self.db_name)
         # OPTYMALIZACJA: WAL, FK, Timeout
         conn.execute('PRAGMA journal_mode=WAL')
         conn.execute('PRAGMA foreign_keys=ON')
@@ -34,19 +96,41 @@ class Database:
         conn.row_factory = sqlite3.Row 
         return conn
 
+    def _ensure_schema(self):
+        """
+        Schemat, migracje i seed tylko dla bazy ze starszą wersją (PRAGMA user_version).
+        Aktualna baza = jedno zapytanie przy starcie zamiast pełnego przebiegu.
+        """
+        conn = self.get_connection()
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+        if version >= SCHEMA_VERSION:
+            return
+
+        with startup_profile.phase("schema"):
+            self._create_tables()
+
+        conn = self.get_connection()
+        try:
+            with startup_profile.phase("seed"):
+                # Seed domyślnych użytkowników
+                self._seed_default_users(conn)
+                # Migracja: operatorzy nie są już logowani przez users
+                self._remove_operator_users(conn)
+                # Seed domyślnych maszyn operatora (PIN 1001+)
+                self._seed_default_machines(conn)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        finally:
+            conn.close()
+
     def _create_tables(self):
         """Tworzy strukturę tabel, jeśli nie istnieją."""
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        # OPTYMALIZACJA: Indeksy dla wydajności (tworzone przed tabelami lub po - tutaj sprawdzamy if not exists)
-        # Indeks statusu (dla filtrowania)
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_status ON envelopes(status)')
-        # Indeks maszyny (dla sprawdzania zajętości)
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_holder ON envelopes(current_holder_id)')
-        # Indeks RCS (dla szybkiego wyszukiwania) - choć unique_key jest Primary Key, to warto mieć też na rcs_id jeśli szukamy po nim
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_rcs ON envelopes(rcs_id)')
-
         # 1. Tabela KOPERT (rozszerzona wg specyfikacji v2.0)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS envelopes (
@@ -75,6 +159,14 @@ class Database:
         except:
             pass  # Kolumna już istnieje
 
+        # OPTYMALIZACJA: Indeksy dla wydajności (po utworzeniu tabeli - nowa baza nie ma jeszcze envelopes)
+        # Indeks statusu (dla filtrowania)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_status ON envelopes(status)')
+        # Indeks maszyny (dla sprawdzania zajętości)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_holder ON envelopes(current_holder_id)')
+        # Indeks RCS (dla szybkiego wyszukiwania) - choć unique_key jest Primary Key, to warto mieć też na rcs_id jeśli szukamy po nim
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_envelopes_rcs ON envelopes(rcs_id)')
+
         # 2. Tabela ZDARZEŃ (Historia/Logi)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS events (
@@ -191,11 +283,112 @@ class Database:
             cursor.execute('ALTER TABLE note_images ADD COLUMN modified_by TEXT')
         except:
             pass
+        # Warianty rozdzielczości (JSON: {"thumb": {"path", "width", "height", "size_bytes", "sha256"}, ...})
+        try:
+            cursor.execute('ALTER TABLE note_images ADD COLUMN variants_json TEXT')
+        except:
+            pass
+
+        # 5.3 Pliki zdjęć adresowane treścią (SHA-256 znormalizowanego WebP) z licznikiem referencji.
+        # Ten sam plik może być podpięty pod wiele notatek - usuwamy go dopiero przy ostatniej referencji.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS note_image_blobs (
+                sha256 TEXT PRIMARY KEY,
+                storage_path TEXT NOT NULL,
+                variants_json TEXT,
+                size_bytes INTEGER,               -- pełny obraz + warianty
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                modified_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # 5.4 Bieżąca zajętość dysku przez zdjęcia (bez "du" po milionach plików).
+        # dimension='dir': katalog YYYY/MM, pliki fizyczne; dimension='scope': aktywne zdjęcia notatek.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS note_storage_usage (
+                dimension TEXT NOT NULL,
+                usage_key TEXT NOT NULL,
+                files INTEGER NOT NULL DEFAULT 0,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                modified_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (dimension, usage_key)
+            )
+        ''')
+
+        # 5.5 Stan zadań porządkowych (watermarki GC zdjęć)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_state (
+                state_key TEXT PRIMARY KEY,
+                state_value TEXT,
+                modified_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # 5.6 Migawki stanu hali (floor_state.py): stan wszystkich kopert po zdarzeniu
+        # (as_of, last_event_id) w kolejności (timestamp, id); payload = zlib(JSON).
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS floor_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                last_event_id INTEGER NOT NULL UNIQUE,
+                as_of DATETIME NOT NULL,
+                envelope_count INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_floor_snapshots_as_of ON floor_snapshots(as_of, last_event_id)')
+        # Ogon zdarzeń po migawce: zakres (timestamp, id) zamiast przeglądu całej tabeli
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp, id)')
+
+        # 5.7 Czasy przebywania kopert (dwell_rollups.py): zakończone okresy wg statusu / posiadacza,
+        # per godzina zakończenia i łącznie, w przedziałach histogramu (bin) - percentyle bez surowego logu.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dwell_hourly (
+                dimension TEXT NOT NULL,           -- 'status' / 'holder'
+                bucket TEXT NOT NULL,              -- godzina zakończenia okresu 'YYYY-MM-DD HH:00:00' (UTC)
+                dim_key TEXT NOT NULL,
+                bin INTEGER NOT NULL,              -- przedział dwell_rollups.DWELL_BINS
+                dwells INTEGER NOT NULL DEFAULT 0,
+                total_seconds REAL NOT NULL DEFAULT 0,
+                min_seconds REAL NOT NULL DEFAULT 0,
+                max_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, bucket, dim_key, bin)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dwell_totals (
+                dimension TEXT NOT NULL,
+                dim_key TEXT NOT NULL,
+                bin INTEGER NOT NULL,
+                dwells INTEGER NOT NULL DEFAULT 0,
+                total_seconds REAL NOT NULL DEFAULT 0,
+                min_seconds REAL NOT NULL DEFAULT 0,
+                max_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, dim_key, bin)
+            )
+        ''')
+        # Trwające okresy każdej koperty (status i posiadacz osobno) - początek następnego zamkniętego
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dwell_open (
+                envelope_key TEXT PRIMARY KEY,
+                status TEXT,
+                status_since DATETIME,
+                holder TEXT,
+                holder_since DATETIME,
+                event_id INTEGER
+            )
+        ''')
 
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_operator_notes_cursor ON operator_notes(envelope_id, machine_id, created_at, id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_operator_notes_created ON operator_notes(created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_images_scope_note ON note_images(note_scope, note_id, is_active, order_index)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_images_created ON note_images(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_images_sha256 ON note_images(sha256)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_images_storage_path ON note_images(storage_path)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_image_blobs_storage_path ON note_image_blobs(storage_path)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operator_notes_inactive ON operator_notes(is_active, modified_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_machine_notes_inactive ON product_machine_notes(is_active, modified_at, id)')
 
         # Migracja: dodaj kolumnę rcs_id do operator_notes jeśli nie istnieje
         try:
@@ -293,35 +486,24 @@ class Database:
         ''')
 
         conn.commit()
-        
-        # Seed domyślnych użytkowników
-        self._seed_default_users(conn)
-        # Migracja: operatorzy nie są już logowani przez users
-        self._remove_operator_users(conn)
-        # Seed domyślnych maszyn operatora (PIN 1001+)
-        self._seed_default_machines(conn)
-        
         conn.close()
 
 
     def get_envelope_history(self, envelope_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Pobiera historię zdarzeń dla danej koperty."""
         conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = records.tuple_cursor(conn)
         
-        cursor.execute('''
-            SELECT id, user_id, from_status, to_status, from_holder, to_holder, timestamp, comment
+        cursor.execute(f'''
+            SELECT {records.EventRow.select_list()}
             FROM events
             WHERE envelope_key = ?
             ORDER BY timestamp DESC
             LIMIT ?
         ''', (envelope_id, limit))
         
-        rows = cursor.fetchall()
-        
-        history = []
-        for row in rows:
-            history.append(dict(row))
+        to_json = records.EventRow.to_json_row
+        history = [to_json(row) for row in cursor.fetchall()]
             
         conn.close()
         return history
@@ -330,44 +512,24 @@ class Database:
         """Pobiera koperty z paginacją."""
         offset = (page - 1) * limit
         conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = records.tuple_cursor(conn)
         
         # Pobierz całkowitą liczbę
         cursor.execute("SELECT COUNT(*) FROM envelopes")
         total_count = cursor.fetchone()[0]
         
-        # Pobierz dane
-        cursor.execute("""
-            SELECT e.unique_key, e.rcs_id, e.status, 
-                   e.current_holder_id, e.current_holder_type, e.warehouse_section,
-                   e.is_green, e.last_operator_id, e.product_id,
-                   p.company_name, p.product_name
+        # Pobierz dane (krotki -> skompilowany mapper JSON, kolumny wg records.EnvelopeListRow)
+        cursor.execute(f"""
+            SELECT {_ENVELOPE_LIST_SELECT}
             FROM envelopes e
             LEFT JOIN products p ON e.product_id = p.id
             ORDER BY e.updated_at DESC
             LIMIT ? OFFSET ?
         """, (limit, offset))
         
-        rows = cursor.fetchall()
+        to_json = records.EnvelopeListRow.to_json_row
+        results = [to_json(row) for row in cursor.fetchall()]
         conn.close()
-        
-        results = []
-        for row in rows:
-            if row['product_id'] and row['company_name']:
-                product_display = f"{row['company_name']} | {row['product_name']}"
-            else:
-                product_display = f"KOPERTA {row['rcs_id']}"
-            
-            results.append({
-                "id": row['unique_key'],
-                "rcs_id": row['rcs_id'],
-                "product": product_display,
-                "company_name": row['company_name'],
-                "product_name": row['product_name'],
-                "status": row['status'],
-                "machine": row['current_holder_id'] if row['current_holder_id'] else None,
-                "location": row['warehouse_section'] if row['status'] == 'MAGAZYN' else None
-            })
             
         return {
             "data": results,
@@ -379,6 +541,18 @@ class Database:
             }
         }
 
+    def get_envelope_status(self, envelope_id: str) -> Optional[Dict[str, Any]]:
+        """Aktualny status koperty (GET /api/envelopes/<id>/status); None = brak koperty."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("""
+                SELECT unique_key, status, current_holder_id, current_holder_type, warehouse_section
+                FROM envelopes WHERE unique_key = ?
+            """, (envelope_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
     def get_machine_status(self, machine_id: str) -> Dict[str, Any]:
         """Sprawdza status maszyny (czy ma przypisaną kopertę)."""
         conn = self.get_connection()
@@ -686,21 +860,38 @@ class Database:
     # LOGIKA BIZNESOWA (TRANSAKCJE)
     # ========================
 
-    def log_error(self, barcode, error_code, user_id=None, location_id=None, conflict_details=None):
-        """Loguje błąd do tabeli error_logs (audyt)."""
-        import json
-        conn = self.get_connection()
+    def log_error(self, barcode, error_code, user_id=None, location_id=None, conflict_details=None, conn=None):
+        """
+        Loguje błąd do tabeli error_logs (audyt).
+        conn - połączenie wywołującego: wpis idzie do jego transakcji (commit po stronie
+        wywołującego), bez drugiego połączenia czekającego na blokadę zapisu, którą
+        wywołujący już trzyma.
+        """
+        own_conn = conn is None
+        conn = conn or self.get_connection()
         try:
             conn.execute("""
                 INSERT INTO error_logs (barcode, error_code, user_id, location_id, conflict_details)
                 VALUES (?, ?, ?, ?, ?)
             """, (barcode, error_code, user_id, location_id, 
                   json.dumps(conflict_details) if conflict_details else None))
-            conn.commit()
-        except:
-            pass # Nie chcemy żeby błąd logowania wywalił aplikację
+            if own_conn:
+                conn.commit()
+        except sqlite3.Error as e:
+            # Nie chcemy żeby błąd logowania wywalił aplikację
+            print(f"⚠️ Nie udało się zapisać error_logs ({error_code}): {e}")
         finally:
-            conn.close()
+            if own_conn:
+                conn.close()
+
+    @staticmethod
+    def _insert_transition_event(cursor, envelope_id: str, user_id: str, transition: "domain.Transition") -> None:
+        """Zdarzenie w historii dla przejścia wyliczonego przez domain.resolve_transition."""
+        cursor.execute("""
+            INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (envelope_id, user_id, transition.from_status, transition.to_status,
+              transition.event_from_holder, transition.event_to_holder, transition.operation.name))
 
     def issue_envelope(self, envelope_id: str, cart_id: str, user_id: str) -> Dict[str, Any]:
         """
@@ -721,20 +912,22 @@ class Database:
             row = cursor.fetchone()
             
             if not row:
-                conn.rollback()
-                self.log_error(envelope_id, 'ERR_NOT_FOUND', user_id, 'MAGAZYN')
+                # Odrzucenie = tylko wpis audytu w tej samej transakcji (jedno połączenie, jeden commit)
+                self.log_error(envelope_id, 'ERR_NOT_FOUND', user_id, 'MAGAZYN', conn=conn)
+                conn.commit()
                 return {"success": False, "error_code": "ERR_NOT_FOUND", "status": 404}
                 
             current_status = row['status']
             is_green = row['is_green']
             
-            # 2. Walidacja Statusu
-            if current_status != 'MAGAZYN':
-                conn.rollback()
-                error_code = 'ERR_DUPLICATE_ACTIVE' if current_status == 'W_PRODUKCJI' else 'ERR_INVALID_STATUS'
+            # 2. Walidacja Statusu (skompilowana maszyna stanów)
+            transition = domain.resolve_transition(domain.Operation.ISSUE, current_status, row['current_holder_id'], cart_id)
+            if not transition.ok:
+                error_code = transition.error_code
                 self.log_error(envelope_id, error_code, user_id, 'MAGAZYN', {
                     "current_status": current_status, "holder": row['current_holder_id']
-                })
+                }, conn=conn)
+                conn.commit()
                 return {
                     "success": False, 
                     "error_code": error_code, 
@@ -745,30 +938,27 @@ class Database:
 
             # 3. Walidacja Koloru
             if not is_green:
-                conn.rollback()
-                self.log_error(envelope_id, 'ERR_WRONG_COLOR', user_id, 'MAGAZYN')
+                self.log_error(envelope_id, 'ERR_WRONG_COLOR', user_id, 'MAGAZYN', conn=conn)
+                conn.commit()
                 return {"success": False, "error_code": "ERR_WRONG_COLOR", "status": 409}
             
             # 4. Update
             cursor.execute("""
                 UPDATE envelopes 
-                SET status = 'SHOP_FLOOR', 
+                SET status = ?, 
                     current_holder_id = ?, 
-                    current_holder_type = 'CART_OUT',
+                    current_holder_type = ?,
                     warehouse_section = NULL,
                     last_operator_id = ?,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE unique_key = ?
-            """, (cart_id, user_id, envelope_id))
+            """, (transition.to_status, transition.to_holder, transition.holder_type, user_id, envelope_id))
             
             # 5. Log Event
-            cursor.execute("""
-                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
-                VALUES (?, ?, 'MAGAZYN', 'SHOP_FLOOR', 'MAGAZYN', ?, 'ISSUE')
-            """, (envelope_id, user_id, cart_id))
+            self._insert_transition_event(cursor, envelope_id, user_id, transition)
             
             conn.commit()
-            return {"success": True, "status": "SHOP_FLOOR"}
+            return {"success": True, "status": transition.to_status}
             
         except Exception as e:
             conn.rollback()
@@ -793,20 +983,15 @@ class Database:
             row = cursor.fetchone()
             
             if not row:
-                conn.rollback()
-                self.log_error(envelope_id, 'ERR_NOT_FOUND', user_id, machine_id)
+                self.log_error(envelope_id, 'ERR_NOT_FOUND', user_id, machine_id, conn=conn)
+                conn.commit()
                 return {"success": False, "error_code": "ERR_NOT_FOUND", "status": 404}
             
             current_status = row['status']
             current_holder = row['current_holder_id']
             
-            # Walidacje
-            if current_status == 'MAGAZYN':
-                conn.rollback()
-                self.log_error(envelope_id, 'ERR_NOT_ISSUED', user_id, machine_id)
-                return {"success": False, "error_code": "ERR_NOT_ISSUED", "status": 409}
-                
-            if current_status == 'W_PRODUKCJI':
+            # Walidacje: na maszynie -> transfer, w pozostałych stanach -> załadunek
+            if current_status == domain.EnvelopeStatus.W_PRODUKCJI.value:
                 if str(current_holder) == str(machine_id):
                     # Idempotentny przypadek - koperta już na tej maszynie.
                     conn.commit()
@@ -819,56 +1004,36 @@ class Database:
                     }
 
                 # Automatyczny transfer między maszynami.
-                cursor.execute("""
-                    UPDATE envelopes 
-                    SET status = 'W_PRODUKCJI', 
-                        current_holder_id = ?, 
-                        current_holder_type = 'MACHINE',
-                        last_operator_id = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE unique_key = ?
-                """, (machine_id, user_id, envelope_id))
-
-                cursor.execute("""
-                    INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
-                    VALUES (?, ?, 'W_PRODUKCJI', 'W_PRODUKCJI', ?, ?, 'TRANSFER_AUTO')
-                """, (envelope_id, user_id, current_holder, machine_id))
+                operation = domain.Operation.TRANSFER_AUTO
+            else:
+                operation = domain.Operation.LOAD
 
+            transition = domain.resolve_transition(operation, current_status, current_holder, machine_id)
+            if not transition.ok:
+                if transition.error_code == 'ERR_NOT_ISSUED':
+                    self.log_error(envelope_id, transition.error_code, user_id, machine_id, conn=conn)
                 conn.commit()
-                return {
-                    "success": True,
-                    "status": "W_PRODUKCJI",
-                    "operation": "TRANSFER_AUTO",
-                    "from_machine": current_holder,
-                    "to_machine": machine_id
-                }
-                
-            if current_status != 'SHOP_FLOOR':
-                conn.rollback()
-                return {"success": False, "error_code": "ERR_INVALID_STATUS", "status": 409}
+                return {"success": False, "error_code": transition.error_code, "status": 409}
             
             # Update
             cursor.execute("""
                 UPDATE envelopes 
-                SET status = 'W_PRODUKCJI', 
+                SET status = ?, 
                     current_holder_id = ?, 
-                    current_holder_type = 'MACHINE',
+                    current_holder_type = ?,
                     last_operator_id = ?,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE unique_key = ?
-            """, (machine_id, user_id, envelope_id))
+            """, (transition.to_status, transition.to_holder, transition.holder_type, user_id, envelope_id))
             
             # Log Event - dodane logowanie historii
-            cursor.execute("""
-                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
-                VALUES (?, ?, ?, 'W_PRODUKCJI', ?, ?, 'LOAD')
-            """, (envelope_id, user_id, current_status, current_holder, machine_id))
+            self._insert_transition_event(cursor, envelope_id, user_id, transition)
             
             conn.commit()
             return {
                 "success": True,
-                "status": "W_PRODUKCJI",
-                "operation": "LOAD",
+                "status": transition.to_status,
+                "operation": operation.name,
                 "from_machine": current_holder,
                 "to_machine": machine_id
             }
@@ -898,7 +1063,7 @@ class Database:
                 cursor.execute("DELETE FROM envelopes WHERE unique_key = ?", (envelope_id,))
                 
                 # Loguj usunięcie
-                self.log_error(envelope_id, 'INFO_DELETED', 'ADMIN', 'WAREHOUSE', {'action': 'manual_delete'})
+                self.log_error(envelope_id, 'INFO_DELETED', 'ADMIN', 'WAREHOUSE', {'action': 'manual_delete'}, conn=conn)
                 
             return {"success": True, "message": f"Koperta {envelope_id} została usunięta"}
             
@@ -925,36 +1090,28 @@ class Database:
                 return {"success": False, "error": "Not found", "status": 404}
                 
             current_status = row['status']
-            current_holder = str(row['current_holder_id']).upper()
             operator = row['last_operator_id'] or 'SYSTEM'
             
-            # Logika Paletyzacja vs Reszta
-            if 'PALLET' in current_holder:
-                new_status = 'CART-RET-05'
-                new_holder = 'CART-RET-05'
-                new_type = 'CART_IN'
-            else:
-                new_status = 'SHOP_FLOOR'
-                new_holder = 'SHOP_FLOOR'
-                new_type = 'FLOOR'
+            # Paletyzacja -> wózek zwrotny, reszta -> hala (trasa w OPERATIONS[RELEASE])
+            transition = domain.resolve_transition(domain.Operation.RELEASE, current_status, row['current_holder_id'])
+            if not transition.ok:
+                conn.rollback()
+                return {"success": False, "error_code": transition.error_code, "status": 409, "current_status": current_status}
             
             cursor.execute("""
                 UPDATE envelopes 
                 SET status = ?, current_holder_id = ?, current_holder_type = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE unique_key = ?
-            """, (new_status, new_holder, new_type, envelope_id))
+            """, (transition.to_status, transition.to_holder, transition.holder_type, envelope_id))
             
             # Log Event - dodane logowanie historii
-            cursor.execute("""
-                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
-                VALUES (?, ?, ?, ?, ?, ?, 'RELEASE')
-            """, (envelope_id, operator, current_status, new_status, current_holder, new_holder))
+            self._insert_transition_event(cursor, envelope_id, operator, transition)
             
             conn.commit()
             return {
                 "success": True, 
-                "new_status": new_status, 
-                "new_holder": new_holder
+                "new_status": transition.to_status, 
+                "new_holder": transition.to_holder
             }
         except Exception as e:
             conn.rollback()
@@ -983,28 +1140,151 @@ class Database:
             current_holder = row['current_holder_id']
             operator = row['last_operator_id'] or 'WAREHOUSE'
             
-            if current_status == 'W_PRODUKCJI' and not str(current_holder).startswith('CART'):
+            transition = domain.resolve_transition(domain.Operation.RETURN, current_status, current_holder)
+            if not transition.ok:
                 conn.rollback()
-                return {"success": False, "error": "Koperta na maszynie", "status": 409}
+                error = "Koperta na maszynie" if current_status == domain.EnvelopeStatus.W_PRODUKCJI.value else "Niedozwolony status koperty"
+                return {"success": False, "error": error, "error_code": transition.error_code, "status": 409}
             
             cursor.execute("""
                 UPDATE envelopes 
-                SET status = 'MAGAZYN', 
-                    current_holder_id = 'MAGAZYN',
-                    current_holder_type = 'WAREHOUSE',
+                SET status = ?, 
+                    current_holder_id = ?,
+                    current_holder_type = ?,
                     warehouse_section = ?,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE unique_key = ?
-            """, (location, envelope_id))
+            """, (transition.to_status, transition.to_holder, transition.holder_type, location, envelope_id))
             
             # Log Event - dodane logowanie historii
-            cursor.execute("""
-                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
-                VALUES (?, ?, ?, 'MAGAZYN', ?, 'WAREHOUSE', 'RETURN')
-            """, (envelope_id, operator, current_status, current_holder))
+            self._insert_transition_event(cursor, envelope_id, operator, transition)
             
             conn.commit()
-            return {"success": True, "status": "MAGAZYN"}
+            return {"success": True, "status": transition.to_status}
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e), "status": 500}
+        finally:
+            conn.close()
+
+    # ========================
+    # WÓZKI (OPERACJE NA CAŁEJ ZAWARTOŚCI)
+    # ========================
+
+    def get_cart_contents(self, cart_id: str, limit: int = 1000) -> Dict[str, Any]:
+        """
+        Zawartość wózka (koperty z current_holder_id = cart_id): liczniki wg statusu,
+        ile z nich przyjmie magazyn (RETURN wg maszyny stanów) i lista kopert (do limit).
+        """
+        if not domain.is_cart(cart_id):
+            return {"success": False, "error": f"{cart_id} nie jest wózkiem", "status": 400}
+        limit = max(1, min(int(limit), 10000))
+        conn = self.get_connection()
+        try:
+            by_status = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM envelopes WHERE current_holder_id = ? GROUP BY status", (cart_id,)
+            ).fetchall())
+            rows = conn.execute("""
+                SELECT unique_key, rcs_id, status, last_operator_id, updated_at
+                FROM envelopes WHERE current_holder_id = ?
+                ORDER BY updated_at DESC, unique_key
+                LIMIT ?
+            """, (cart_id, limit)).fetchall()
+        finally:
+            conn.close()
+        errors = domain.validate_batch(domain.Operation.RETURN, list(by_status))
+        count = sum(by_status.values())
+        return {
+            "success": True,
+            "cart_id": cart_id,
+            "count": count,
+            "by_status": by_status,
+            "returnable": sum(n for n, error in zip(by_status.values(), errors) if error is None),
+            "envelopes": [dict(row) for row in rows],
+            "truncated": count > len(rows),
+        }
+
+    def transition_cart(
+        self, cart_id: str, operation: "domain.Operation", user_id: Optional[str] = None,
+        to_holder: Optional[str] = None, location: Optional[str] = None, partial: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Operacja na całej zawartości wózka w jednej transakcji: jeden INSERT ... SELECT do
+        events i jeden UPDATE envelopes, oba z WHERE status IN (stany wejściowe operacji
+        z domain.OPERATIONS). Koperty w niedozwolonym stanie: odrzucenie całości (409,
+        liczniki w "blocked"), a przy partial=True zostają na wózku ("skipped").
+        RETURN: location -> warehouse_section. MOVE: to_holder = wózek docelowy.
+        Bez user_id zdarzenia dostają ostatniego operatora koperty (jak pojedynczy zwrot).
+        """
+        spec = domain.OPERATIONS[operation]
+        to_holder = spec.holder or to_holder
+        if not domain.is_cart(cart_id):
+            return {"success": False, "error": f"{cart_id} nie jest wózkiem", "status": 400}
+        if spec.pallet_route or not to_holder:
+            return {"success": False, "error": f"Operacja {operation.name} wymaga posiadacza docelowego", "status": 400}
+        if operation == domain.Operation.MOVE and (
+            not domain.is_cart(to_holder) or to_holder in (cart_id, domain.RETURN_CART)
+        ):
+            return {"success": False, "error": f"Nieprawidłowy wózek docelowy: {to_holder}", "status": 400}
+
+        sources = spec.source_statuses
+        placeholders = ",".join("?" * len(sources))
+        fallback_user = 'WAREHOUSE' if operation == domain.Operation.RETURN else 'SYSTEM'
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            by_status = dict(cursor.execute(
+                "SELECT status, COUNT(*) FROM envelopes WHERE current_holder_id = ? GROUP BY status", (cart_id,)
+            ).fetchall())
+            blocked = {
+                status: {"count": by_status[status], "error_code": error_code}
+                for status, error_code in zip(by_status, domain.validate_batch(operation, list(by_status)))
+                if error_code
+            }
+            if blocked and not partial:
+                conn.rollback()
+                return {
+                    "success": False,
+                    "error_code": next(iter(blocked.values()))["error_code"],
+                    "status": 409,
+                    "cart_id": cart_id,
+                    "blocked": blocked,
+                }
+
+            cursor.execute(f"""
+                INSERT INTO events (envelope_key, user_id, from_status, to_status, from_holder, to_holder, operation)
+                SELECT unique_key, COALESCE(?, last_operator_id, ?), status, ?, COALESCE(?, current_holder_id), ?, ?
+                FROM envelopes
+                WHERE current_holder_id = ? AND status IN ({placeholders})
+            """, (user_id, fallback_user, spec.to_status, spec.event_from_holder,
+                  spec.event_to_holder or to_holder, operation.name, cart_id, *sources))
+            moved = cursor.rowcount
+            cursor.execute(f"""
+                UPDATE envelopes
+                SET status = ?,
+                    current_holder_id = ?,
+                    current_holder_type = ?,
+                    warehouse_section = ?,
+                    last_operator_id = COALESCE(?, last_operator_id),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE current_holder_id = ? AND status IN ({placeholders})
+            """, (spec.to_status, to_holder, spec.holder_type, location, user_id, cart_id, *sources))
+            if cursor.rowcount != moved:
+                conn.rollback()
+                return {"success": False, "error": "Zawartość wózka zmieniła się w trakcie operacji", "status": 500}
+
+            conn.commit()
+            return {
+                "success": True,
+                "cart_id": cart_id,
+                "operation": operation.name,
+                "status_after": spec.to_status,
+                "to_holder": to_holder,
+                "moved": moved,
+                "by_status": {status: n for status, n in by_status.items() if status not in blocked},
+                "skipped": blocked,
+            }
         except Exception as e:
             conn.rollback()
             return {"success": False, "error": str(e), "status": 500}
@@ -1685,7 +1965,7 @@ class Database:
 
     def get_operator_notes_paginated(self, envelope_id: str, machine_id: str, limit: int = 20, cursor_token: Optional[str] = None) -> Dict[str, Any]:
         conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = records.tuple_cursor(conn)
         limit = max(1, min(limit, 100))
 
         where_sql = "WHERE envelope_id = ? AND machine_id = ? AND is_active = 1"
@@ -1704,7 +1984,7 @@ class Database:
         params.append(limit + 1)
         cursor.execute(
             f'''
-            SELECT id, envelope_id, machine_id, note_kind, note_data_json, created_by, created_at, modified_at, rcs_id
+            SELECT {records.OperatorNoteRow.select_list()}
             FROM operator_notes
             {where_sql}
             ORDER BY created_at DESC, id DESC
@@ -1718,29 +1998,12 @@ class Database:
 
         has_next = len(rows) > limit
         rows = rows[:limit]
-        notes: list[Dict[str, Any]] = []
-        for row in rows:
-            try:
-                note_data = json.loads(row["note_data_json"]) if row["note_data_json"] else {}
-            except Exception:
-                note_data = {}
-            notes.append(
-                {
-                    "id": row["id"],
-                    "envelope_id": row["envelope_id"],
-                    "machine_id": row["machine_id"],
-                    "note_kind": row["note_kind"],
-                    "note_data": note_data,
-                    "created_by": row["created_by"],
-                    "created_at": row["created_at"],
-                    "modified_at": row["modified_at"],
-                    "rcs_id": row["rcs_id"],
-                }
-            )
+        to_json = records.OperatorNoteRow.to_json_row
+        notes: list[Dict[str, Any]] = [to_json(row) for row in rows]
 
         next_cursor = None
-        if has_next and rows:
-            last = rows[-1]
+        if has_next and notes:
+            last = notes[-1]
             next_cursor = f'{last["created_at"]},{last["id"]}'
 
         return {"success": True, "notes": notes, "next_cursor": next_cursor}
@@ -1756,43 +2019,100 @@ class Database:
             return {"success": False, "error": "Notatka nie istnieje", "status": 404}
         return {"success": True}
 
-    def note_exists(self, note_scope: str, note_id: int) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _note_exists_in(self, cursor, note_scope: str, note_id: int) -> bool:
         if note_scope == "operator_note":
             cursor.execute("SELECT id FROM operator_notes WHERE id = ? AND is_active = 1", (note_id,))
         else:
             cursor.execute("SELECT id FROM product_machine_notes WHERE id = ? AND is_active = 1", (note_id,))
-        row = cursor.fetchone()
+        return bool(cursor.fetchone())
+
+    def note_exists(self, note_scope: str, note_id: int) -> bool:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        exists = self._note_exists_in(cursor, note_scope, note_id)
         conn.close()
-        return bool(row)
+        return exists
 
     def get_note_images(self, note_scope: str, note_id: int) -> List[Dict[str, Any]]:
         conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = records.tuple_cursor(conn)
         cursor.execute(
-            '''
-            SELECT id, note_scope, note_id, storage_path, original_filename, mime_type, width, height, size_bytes,
-                   sha256, annotations_json, order_index, revision, created_by, modified_by, created_at, modified_at
+            f'''
+            SELECT {", ".join(records.NOTE_IMAGE_LIST_COLUMNS)}
             FROM note_images
             WHERE note_scope = ? AND note_id = ? AND is_active = 1
             ORDER BY order_index ASC, id ASC
             ''',
             (note_scope, note_id)
         )
+        to_json = records.note_image_list_to_json
+        images: list[Dict[str, Any]] = [to_json(row) for row in cursor.fetchall()]
+        conn.close()
+        return images
+
+    def get_product_machine_notes_bundle(self, product_code: str, machine_id: str) -> Dict[str, Any]:
+        """
+        Pobiera jednym zapytaniem notatkę specyficzną (produkt + maszyna), notatkę globalną
+        produktu oraz aktywne zdjęcia obu notatek.
+        Zwraca {"specific_note": dict|None, "global_note": dict|None}; każda notatka ma listę "images".
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT n.id, n.machine_id, n.note_content, n.note_type,
+                   n.created_at, n.modified_at, n.created_by, n.modified_by,
+                   i.id AS image_id, i.note_scope, i.storage_path, i.original_filename, i.mime_type,
+                   i.width, i.height, i.size_bytes, i.sha256, i.annotations_json, i.order_index,
+                   i.revision, i.created_by AS image_created_by, i.modified_by AS image_modified_by,
+                   i.created_at AS image_created_at, i.modified_at AS image_modified_at, i.variants_json
+            FROM product_machine_notes n
+            LEFT JOIN note_images i
+                   ON i.note_scope = 'product_machine_note' AND i.note_id = n.id AND i.is_active = 1
+            WHERE n.product_code = ? AND n.is_active = 1
+              AND (n.machine_id = ? OR n.note_type = 'global')
+            ORDER BY n.note_type ASC, n.id ASC, i.order_index ASC, i.id ASC
+            ''',
+            (product_code, machine_id)
+        )
         rows = cursor.fetchall()
         conn.close()
-        images: list[Dict[str, Any]] = []
+
+        notes: Dict[int, Dict[str, Any]] = {}
+        specific_id = None
+        global_id = None
         for row in rows:
+            note_id = row["id"]
+            note = notes.get(note_id)
+            if note is None:
+                note = {
+                    "id": note_id,
+                    "content": row["note_content"],
+                    "created_at": row["created_at"],
+                    "modified_at": row["modified_at"],
+                    "created_by": row["created_by"],
+                    "modified_by": row["modified_by"],
+                    "images": [],
+                }
+                notes[note_id] = note
+                # Ta sama kolejność co w starych zapytaniach: note_type ASC dla maszyny,
+                # pierwsza aktywna notatka 'global' dla produktu.
+                if specific_id is None and row["machine_id"] == machine_id:
+                    specific_id = note_id
+                if global_id is None and row["note_type"] == 'global':
+                    global_id = note_id
+
+            if row["image_id"] is None:
+                continue
             try:
                 annotations = json.loads(row["annotations_json"]) if row["annotations_json"] else {"objects": []}
             except Exception:
                 annotations = {"objects": []}
-            images.append(
+            note["images"].append(
                 {
-                    "id": row["id"],
+                    "id": row["image_id"],
                     "note_scope": row["note_scope"],
-                    "note_id": row["note_id"],
+                    "note_id": note_id,
                     "storage_path": row["storage_path"],
                     "original_filename": row["original_filename"],
                     "mime_type": row["mime_type"],
@@ -1803,21 +2123,25 @@ class Database:
                     "annotations_json": annotations,
                     "order_index": row["order_index"],
                     "revision": row["revision"],
-                    "created_by": row["created_by"],
-                    "modified_by": row["modified_by"],
-                    "created_at": row["created_at"],
-                    "modified_at": row["modified_at"],
+                    "created_by": row["image_created_by"],
+                    "modified_by": row["image_modified_by"],
+                    "created_at": row["image_created_at"],
+                    "modified_at": row["image_modified_at"],
+                    "variants": _parse_variants_json(row["variants_json"]),
                 }
             )
-        return images
+
+        return {
+            "specific_note": notes.get(specific_id) if specific_id is not None else None,
+            "global_note": notes.get(global_id) if global_id is not None else None,
+        }
 
     def get_note_image_by_id(self, image_id: int) -> Optional[Dict[str, Any]]:
         conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = records.tuple_cursor(conn)
         cursor.execute(
-            '''
-            SELECT id, note_scope, note_id, storage_path, original_filename, mime_type, width, height, size_bytes,
-                   sha256, annotations_json, order_index, revision, created_by, modified_by, created_at, modified_at, is_active
+            f'''
+            SELECT {records.NoteImageRow.select_list()}
             FROM note_images
             WHERE id = ?
             ''',
@@ -1827,30 +2151,7 @@ class Database:
         conn.close()
         if not row:
             return None
-        try:
-            annotations = json.loads(row["annotations_json"]) if row["annotations_json"] else {"objects": []}
-        except Exception:
-            annotations = {"objects": []}
-        return {
-            "id": row["id"],
-            "note_scope": row["note_scope"],
-            "note_id": row["note_id"],
-            "storage_path": row["storage_path"],
-            "original_filename": row["original_filename"],
-            "mime_type": row["mime_type"],
-            "width": row["width"],
-            "height": row["height"],
-            "size_bytes": row["size_bytes"],
-            "sha256": row["sha256"],
-            "annotations_json": annotations,
-            "order_index": row["order_index"],
-            "revision": row["revision"],
-            "created_by": row["created_by"],
-            "modified_by": row["modified_by"],
-            "created_at": row["created_at"],
-            "modified_at": row["modified_at"],
-            "is_active": row["is_active"],
-        }
+        return records.NoteImageRow.to_json_row(row)
 
     def create_note_image(
         self,
@@ -1866,11 +2167,14 @@ class Database:
         annotations_json: Dict[str, Any],
         order_index: int,
         created_by: str,
+        variants: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
-            if not self.note_exists(note_scope, note_id):
+            cursor.execute("BEGIN IMMEDIATE")
+            if not self._note_exists_in(cursor, note_scope, note_id):
+                conn.rollback()
                 conn.close()
                 return {"success": False, "error": "Notatka nie istnieje", "status": 404}
 
@@ -1880,16 +2184,47 @@ class Database:
             )
             active_count = cursor.fetchone()[0]
             if active_count >= 3:
+                conn.rollback()
                 conn.close()
                 return {"success": False, "error": "Limit 3 zdjec na notatke", "status": 400}
 
+            stored_size = _stored_size(size_bytes, variants)
+            if sha256_hex:
+                # Referencja do pliku adresowanego treścią. Przy konflikcie (plik już jest)
+                # zostaje istniejąca ścieżka - zdjęcie wskazuje na nią.
+                cursor.execute("SELECT 1 FROM note_image_blobs WHERE sha256 = ?", (sha256_hex,))
+                blob_is_new = cursor.fetchone() is None
+                cursor.execute(
+                    '''
+                    INSERT INTO note_image_blobs (sha256, storage_path, variants_json, size_bytes, ref_count)
+                    VALUES (?, ?, ?, ?, 1)
+                    ON CONFLICT(sha256) DO UPDATE SET ref_count = ref_count + 1, modified_at = CURRENT_TIMESTAMP
+                    ''',
+                    (sha256_hex, storage_path, json.dumps(variants) if variants else None, stored_size),
+                )
+                cursor.execute(
+                    "SELECT storage_path, variants_json, size_bytes FROM note_image_blobs WHERE sha256 = ?",
+                    (sha256_hex,),
+                )
+                blob = cursor.fetchone()
+                storage_path = blob["storage_path"]
+                variants = _parse_variants_json(blob["variants_json"])
+                stored_size = int(blob["size_bytes"] or 0)
+            if not sha256_hex or blob_is_new:
+                _bump_storage_usage(
+                    cursor, "dir", posixpath.dirname(storage_path),
+                    len(_storage_paths(storage_path, variants)), stored_size,
+                )
+            _bump_storage_usage(cursor, "scope", note_scope, 1, stored_size)
+
             payload = json.dumps(annotations_json or {"objects": []}, ensure_ascii=False)
             cursor.execute(
                 '''
                 INSERT INTO note_images (
                     note_scope, note_id, storage_path, original_filename, mime_type, width, height,
-                    size_bytes, sha256, annotations_json, order_index, revision, created_by, modified_by, modified_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, CURRENT_TIMESTAMP)
+                    size_bytes, sha256, annotations_json, order_index, revision, created_by, modified_by, modified_at,
+                    variants_json
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, CURRENT_TIMESTAMP, ?)
                 ''',
                 (
                     note_scope,
@@ -1905,16 +2240,38 @@ class Database:
                     order_index,
                     created_by,
                     created_by,
+                    json.dumps(variants) if variants else None,
                 ),
             )
             image_id = cursor.lastrowid
             conn.commit()
             conn.close()
-            return {"success": True, "image_id": image_id}
+            return {"success": True, "image_id": image_id, "storage_path": storage_path, "variants": variants or {}}
         except Exception as e:
+            conn.rollback()
             conn.close()
             return {"success": False, "error": str(e), "status": 500}
 
+    def get_note_image_blob(self, sha256_hex: str) -> Optional[Dict[str, Any]]:
+        """Pobiera plik adresowany treścią (None jeśli takiego jeszcze nie ma)."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT sha256, storage_path, variants_json, size_bytes, ref_count FROM note_image_blobs WHERE sha256 = ?",
+            (sha256_hex,),
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {
+            "sha256": row["sha256"],
+            "storage_path": row["storage_path"],
+            "variants": _parse_variants_json(row["variants_json"]),
+            "size_bytes": row["size_bytes"],
+            "ref_count": row["ref_count"],
+        }
+
     def update_note_image_annotations(
         self,
         image_id: int,
@@ -1966,19 +2323,517 @@ class Database:
         conn.close()
         return {"success": True, "revision": next_revision}
 
+    def _release_note_image_in(self, cursor, row) -> List[str]:
+        """
+        Soft delete zdjęcia (wiersz note_images) w transakcji wywołującego: zwalnia referencję
+        do pliku i aktualizuje liczniki zajętości. Zwraca ścieżki plików do usunięcia z dysku.
+        """
+        cursor.execute(
+            "UPDATE note_images SET is_active = 0, modified_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (row["id"],),
+        )
+
+        blob = None
+        if row["sha256"]:
+            cursor.execute(
+                "SELECT storage_path, variants_json, size_bytes, ref_count FROM note_image_blobs WHERE sha256 = ?",
+                (row["sha256"],),
+            )
+            blob = cursor.fetchone()
+
+        released_paths: List[str] = []
+        if blob and blob["storage_path"] == row["storage_path"]:
+            stored_size = int(blob["size_bytes"] or 0)
+            if blob["ref_count"] <= 1:
+                cursor.execute("DELETE FROM note_image_blobs WHERE sha256 = ?", (row["sha256"],))
+                released_paths = _storage_paths(blob["storage_path"], _parse_variants_json(blob["variants_json"]))
+                _bump_storage_usage(
+                    cursor, "dir", posixpath.dirname(blob["storage_path"]), -len(released_paths), -stored_size
+                )
+            else:
+                cursor.execute(
+                    "UPDATE note_image_blobs SET ref_count = ref_count - 1, modified_at = CURRENT_TIMESTAMP WHERE sha256 = ?",
+                    (row["sha256"],),
+                )
+        else:
+            # Zdjęcie sprzed deduplikacji (plik uuid) - jedyna referencja do swoich plików.
+            variants = _parse_variants_json(row["variants_json"])
+            stored_size = _stored_size(row["size_bytes"], variants)
+            released_paths = _storage_paths(row["storage_path"], variants)
+            _bump_storage_usage(
+                cursor, "dir", posixpath.dirname(row["storage_path"]), -len(released_paths), -stored_size
+            )
+        _bump_storage_usage(cursor, "scope", row["note_scope"], -1, -stored_size)
+        return released_paths
+
     def soft_delete_note_image(self, image_id: int) -> Dict[str, Any]:
+        """
+        Soft delete zdjęcia i zwolnienie referencji do pliku.
+        Zwraca "released_paths" - pliki bez żadnej aktywnej referencji, do usunięcia z dysku.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE note_images SET is_active = 0, modified_at = CURRENT_TIMESTAMP WHERE id = ? AND is_active = 1",
-            (image_id,),
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                '''
+                SELECT id, note_scope, storage_path, size_bytes, sha256, variants_json
+                FROM note_images WHERE id = ? AND is_active = 1
+                ''',
+                (image_id,),
+            )
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                return {"success": False, "error": "Obraz nie istnieje", "status": 404}
+
+            released_paths = self._release_note_image_in(cursor, row)
+            conn.commit()
+            return {"success": True, "released_paths": released_paths}
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e), "status": 500}
+        finally:
+            conn.close()
+
+    # --- Porządkowanie zdjęć (note_images_gc.py) ---
+
+    def get_maintenance_state(self, state_key: str) -> Optional[str]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT state_value FROM maintenance_state WHERE state_key = ?", (state_key,))
+        row = cursor.fetchone()
+        conn.close()
+        return row["state_value"] if row else None
+
+    def set_maintenance_state(self, state_key: str, state_value: str) -> None:
+        conn = self.get_connection()
+        conn.execute(
+            '''
+            INSERT INTO maintenance_state (state_key, state_value, modified_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(state_key) DO UPDATE SET state_value = excluded.state_value, modified_at = CURRENT_TIMESTAMP
+            ''',
+            (state_key, state_value),
         )
-        updated = cursor.rowcount
         conn.commit()
         conn.close()
-        if updated == 0:
-            return {"success": False, "error": "Obraz nie istnieje", "status": 404}
-        return {"success": True}
+
+    def get_inactive_notes_after(
+        self, note_scope: str, after_modified_at: str, after_id: int, grace_seconds: int, limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Usunięte (is_active = 0) notatki po watermarku (modified_at, id), starsze niż okres karencji.
+        Kolejność (modified_at, id) - kolejna partia zaczyna się tam, gdzie skończyła poprzednia.
+        """
+        table = "operator_notes" if note_scope == "operator_note" else "product_machine_notes"
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''
+            SELECT id, modified_at FROM {table}
+            WHERE is_active = 0
+              AND (modified_at > ? OR (modified_at = ? AND id > ?))
+              AND modified_at <= datetime('now', ?)
+            ORDER BY modified_at ASC, id ASC
+            LIMIT ?
+            ''',
+            (after_modified_at, after_modified_at, after_id, f"-{int(grace_seconds)} seconds", limit),
+        )
+        rows = [{"id": row["id"], "modified_at": row["modified_at"]} for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    def release_images_of_inactive_note(self, note_scope: str, note_id: int) -> Dict[str, Any]:
+        """
+        Soft delete aktywnych zdjęć usuniętej notatki (jedna transakcja).
+        Jeśli notatka została w międzyczasie przywrócona, nic nie robi.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            if self._note_exists_in(cursor, note_scope, note_id):
+                conn.rollback()
+                return {"success": True, "released_images": 0, "released_paths": []}
+            cursor.execute(
+                '''
+                SELECT id, note_scope, storage_path, size_bytes, sha256, variants_json
+                FROM note_images WHERE note_scope = ? AND note_id = ? AND is_active = 1
+                ''',
+                (note_scope, note_id),
+            )
+            rows = cursor.fetchall()
+            released_paths: List[str] = []
+            for row in rows:
+                released_paths.extend(self._release_note_image_in(cursor, row))
+            conn.commit()
+            return {"success": True, "released_images": len(rows), "released_paths": released_paths}
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e), "status": 500}
+        finally:
+            conn.close()
+
+    def get_referenced_image_paths(self, dir_prefix: str) -> set:
+        """Ścieżki plików (z wariantami) w katalogu dir_prefix, do których istnieje aktywna referencja."""
+        # Zakres [prefix/, prefix0) zamiast LIKE - korzysta z indeksu na storage_path.
+        low = dir_prefix.rstrip("/") + "/"
+        high = dir_prefix.rstrip("/") + "0"
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        referenced = set()
+        cursor.execute(
+            "SELECT storage_path, variants_json FROM note_images WHERE storage_path >= ? AND storage_path < ? AND is_active = 1",
+            (low, high),
+        )
+        for row in cursor.fetchall():
+            referenced.update(_storage_paths(row["storage_path"], _parse_variants_json(row["variants_json"])))
+        cursor.execute(
+            "SELECT storage_path, variants_json FROM note_image_blobs WHERE storage_path >= ? AND storage_path < ?",
+            (low, high),
+        )
+        for row in cursor.fetchall():
+            referenced.update(_storage_paths(row["storage_path"], _parse_variants_json(row["variants_json"])))
+        conn.close()
+        return referenced
+
+    def get_storage_usage(self) -> Dict[str, Any]:
+        """Zajętość dysku per katalog YYYY/MM i per zakres notatek (z liczników, bez skanowania plików)."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT dimension, usage_key, files, size_bytes FROM note_storage_usage ORDER BY dimension, usage_key"
+        )
+        usage: Dict[str, Any] = {"dirs": [], "scopes": [], "total_files": 0, "total_bytes": 0}
+        for row in cursor.fetchall():
+            entry = {"key": row["usage_key"], "files": row["files"], "size_bytes": row["size_bytes"]}
+            if row["dimension"] == "dir":
+                usage["dirs"].append(entry)
+                usage["total_files"] += row["files"]
+                usage["total_bytes"] += row["size_bytes"]
+            else:
+                usage["scopes"].append(entry)
+        conn.close()
+        return usage
+
+    def rebuild_storage_usage(self) -> Dict[str, Any]:
+        """
+        Przelicza liczniki zajętości od zera z note_image_blobs i note_images
+        (pierwsze uruchomienie lub naprawa po ręcznych zmianach w bazie).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            dirs: Dict[str, List[int]] = {}
+            scopes: Dict[str, List[int]] = {}
+            blobs: Dict[str, tuple] = {}
+            cursor.execute("SELECT sha256, storage_path, variants_json, size_bytes FROM note_image_blobs")
+            for row in cursor.fetchall():
+                stored_size = int(row["size_bytes"] or 0)
+                blobs[row["sha256"]] = (row["storage_path"], stored_size)
+                totals = dirs.setdefault(posixpath.dirname(row["storage_path"]), [0, 0])
+                totals[0] += len(_storage_paths(row["storage_path"], _parse_variants_json(row["variants_json"])))
+                totals[1] += stored_size
+
+            cursor.execute(
+                "SELECT note_scope, storage_path, size_bytes, sha256, variants_json FROM note_images WHERE is_active = 1"
+            )
+            for row in cursor.fetchall():
+                blob = blobs.get(row["sha256"])
+                if blob and blob[0] == row["storage_path"]:
+                    stored_size = blob[1]
+                else:
+                    # Zdjęcie sprzed deduplikacji - własne pliki
+                    variants = _parse_variants_json(row["variants_json"])
+                    stored_size = _stored_size(row["size_bytes"], variants)
+                    totals = dirs.setdefault(posixpath.dirname(row["storage_path"]), [0, 0])
+                    totals[0] += len(_storage_paths(row["storage_path"], variants))
+                    totals[1] += stored_size
+                totals = scopes.setdefault(row["note_scope"], [0, 0])
+                totals[0] += 1
+                totals[1] += stored_size
+
+            cursor.execute("DELETE FROM note_storage_usage")
+            for dimension, values in (("dir", dirs), ("scope", scopes)):
+                for key, (files, size_bytes) in values.items():
+                    _bump_storage_usage(cursor, dimension, key, files, size_bytes)
+            conn.commit()
+            return {"success": True, "dirs": len(dirs), "scopes": len(scopes)}
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e), "status": 500}
+        finally:
+            conn.close()
+
+    # --- Migawki stanu hali (floor_state.py) ---
+
+    def get_floor_snapshot(self, at: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Najnowsza migawka z as_of <= at (bez at: najnowsza w ogóle) albo None."""
+        conn = self.get_connection()
+        try:
+            where, params = ("WHERE as_of <= ?", (at,)) if at is not None else ("", ())
+            row = conn.execute(
+                f"""
+                SELECT id, last_event_id, as_of, envelope_count
+                FROM floor_snapshots {where}
+                ORDER BY as_of DESC, last_event_id DESC LIMIT 1
+                """,
+                params,
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def get_floor_snapshot_payload(self, snapshot_id: int) -> Optional[bytes]:
+        """Treść migawki (zlib) albo None, gdy została już usunięta."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("SELECT payload FROM floor_snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            return bytes(row[0]) if row else None
+        finally:
+            conn.close()
+
+    def get_events_after(
+        self, as_of: str, last_event_id: int, until: Optional[str] = None, limit: Optional[int] = None, conn=None
+    ) -> List[tuple]:
+        """
+        Zdarzenia po pozycji (as_of, last_event_id) w kolejności (timestamp, id), do until włącznie.
+        Krotki (id, envelope_key, to_status, to_holder, timestamp); zakres po idx_events_timestamp.
+        conn - połączenie wywołującego (odczyt w jego transakcji).
+        """
+        sql = """
+            SELECT id, envelope_key, to_status, to_holder, timestamp FROM events
+            WHERE timestamp >= ? AND (timestamp > ? OR id > ?)
+        """
+        params: list = [as_of, as_of, last_event_id]
+        if until is not None:
+            sql += " AND timestamp <= ?"
+            params.append(until)
+        sql += " ORDER BY timestamp, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        own_conn = conn is None
+        conn = conn or self.get_connection()
+        try:
+            cursor = records.tuple_cursor(conn)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def insert_floor_snapshot(self, last_event_id: int, as_of: str, envelope_count: int, payload: bytes, keep: int = 0) -> bool:
+        """
+        Zapisuje migawkę (druga o tym samym last_event_id - np. z innego workera - jest pomijana).
+        keep > 0: zostaje tylko tyle najnowszych migawek. Zwraca, czy wiersz został dodany.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO floor_snapshots (last_event_id, as_of, envelope_count, payload)
+                VALUES (?, ?, ?, ?)
+                """,
+                (last_event_id, as_of, envelope_count, sqlite3.Binary(payload)),
+            )
+            inserted = cursor.rowcount > 0
+            if keep > 0:
+                conn.execute(
+                    """
+                    DELETE FROM floor_snapshots WHERE id NOT IN (
+                        SELECT id FROM floor_snapshots ORDER BY as_of DESC, last_event_id DESC LIMIT ?
+                    )
+                    """,
+                    (keep,),
+                )
+            conn.commit()
+            return inserted
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def delete_floor_snapshots(self) -> int:
+        """Usuwa wszystkie migawki (przebudowa po imporcie zdarzeń z datami wstecz)."""
+        conn = self.get_connection()
+        try:
+            deleted = conn.execute("DELETE FROM floor_snapshots").rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+    # --- Czasy przebywania (dwell_rollups.py) ---
+
+    @staticmethod
+    def _read_position(conn, state_key: str) -> tuple:
+        row = conn.execute("SELECT state_value FROM maintenance_state WHERE state_key = ?", (state_key,)).fetchone()
+        return tuple(json.loads(row[0])) if row and row[0] else ("", 0)
+
+    def get_dwell_rollup_batch(self, state_key: str, limit: int) -> Dict[str, Any]:
+        """
+        Kolejna partia agregacji w jednej transakcji odczytu: watermark (timestamp, id),
+        do `limit` zdarzeń po nim i otwarte okresy (dwell_open) kopert z tych zdarzeń.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN")
+            position = self._read_position(conn, state_key)
+            events = self.get_events_after(*position, limit=limit, conn=conn)
+            keys = list(dict.fromkeys(event[1] for event in events))
+            open_periods = {}
+            cursor = records.tuple_cursor(conn)
+            for start in range(0, len(keys), 500):  # limit parametrów SQLite
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(
+                    "SELECT envelope_key, status, status_since, holder, holder_since, event_id "
+                    f"FROM dwell_open WHERE envelope_key IN ({placeholders})",
+                    chunk,
+                )
+                for row in cursor.fetchall():
+                    open_periods[row[0]] = row[1:]
+            conn.commit()
+            return {"position": position, "events": events, "open": open_periods}
+        finally:
+            conn.close()
+
+    def apply_dwell_rollup_batch(
+        self, state_key: str, expected_position: tuple, new_position: tuple,
+        open_periods: Dict[str, tuple], hourly: Dict[tuple, list], totals: Dict[tuple, list]
+    ) -> Dict[str, Any]:
+        """
+        Agregaty partii + otwarte okresy + watermark w jednej transakcji.
+        hourly: {(dimension, bucket, dim_key, bin): [dwells, total_seconds, min_seconds, max_seconds]}, totals - bez bucket.
+        Watermark inny niż expected_position (partię zapisał już inny worker) -> status 409, bez zmian.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if self._read_position(conn, state_key) != tuple(expected_position):
+                conn.rollback()
+                return {"success": False, "error": "Watermark przesuniety przez inny proces", "status": 409}
+            conn.executemany(
+                """
+                INSERT INTO dwell_hourly (dimension, bucket, dim_key, bin, dwells, total_seconds, min_seconds, max_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(dimension, bucket, dim_key, bin) DO UPDATE SET
+                    dwells = dwells + excluded.dwells,
+                    total_seconds = total_seconds + excluded.total_seconds,
+                    min_seconds = MIN(min_seconds, excluded.min_seconds),
+                    max_seconds = MAX(max_seconds, excluded.max_seconds)
+                """,
+                [(*key, *values) for key, values in hourly.items()],
+            )
+            conn.executemany(
+                """
+                INSERT INTO dwell_totals (dimension, dim_key, bin, dwells, total_seconds, min_seconds, max_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(dimension, dim_key, bin) DO UPDATE SET
+                    dwells = dwells + excluded.dwells,
+                    total_seconds = total_seconds + excluded.total_seconds,
+                    min_seconds = MIN(min_seconds, excluded.min_seconds),
+                    max_seconds = MAX(max_seconds, excluded.max_seconds)
+                """,
+                [(*key, *values) for key, values in totals.items()],
+            )
+            conn.executemany(
+                """
+                INSERT INTO dwell_open (envelope_key, status, status_since, holder, holder_since, event_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(envelope_key) DO UPDATE SET
+                    status = excluded.status, status_since = excluded.status_since,
+                    holder = excluded.holder, holder_since = excluded.holder_since,
+                    event_id = excluded.event_id
+                """,
+                [(key, *period) for key, period in open_periods.items()],
+            )
+            conn.execute(
+                """
+                INSERT INTO maintenance_state (state_key, state_value, modified_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(state_key) DO UPDATE SET state_value = excluded.state_value, modified_at = CURRENT_TIMESTAMP
+                """,
+                (state_key, json.dumps(list(new_position))),
+            )
+            conn.commit()
+            return {"success": True}
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e), "status": 500}
+        finally:
+            conn.close()
+
+    def reset_dwell_rollups(self, state_key: str) -> None:
+        """Czyści agregaty, otwarte okresy i watermark (przebudowa od pierwszego zdarzenia)."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("dwell_hourly", "dwell_totals", "dwell_open"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("DELETE FROM maintenance_state WHERE state_key = ?", (state_key,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_dwell_histograms(
+        self, dimension: str, start: Optional[str] = None, end: Optional[str] = None,
+        dim_key: Optional[str] = None, by_bucket: bool = False
+    ) -> List[tuple]:
+        """
+        Zsumowane przedziały histogramu: krotki ([bucket,] dim_key, bin, dwells, total_seconds, min_seconds, max_seconds).
+        Bez start/end - dwell_totals (cała historia), inaczej dwell_hourly z bucket w [start, end).
+        """
+        if start is None and end is None and not by_bucket:
+            sql = "SELECT dim_key, bin, dwells, total_seconds, min_seconds, max_seconds FROM dwell_totals WHERE dimension = ?"
+            params: list = [dimension]
+            if dim_key is not None:
+                sql += " AND dim_key = ?"
+                params.append(dim_key)
+        else:
+            group = "bucket, dim_key, bin" if by_bucket else "dim_key, bin"
+            sql = f"""
+                SELECT {group}, SUM(dwells), SUM(total_seconds), MIN(min_seconds), MAX(max_seconds)
+                FROM dwell_hourly WHERE dimension = ?
+            """
+            params = [dimension]
+            if start is not None:
+                sql += " AND bucket >= ?"
+                params.append(start)
+            if end is not None:
+                sql += " AND bucket < ?"
+                params.append(end)
+            if dim_key is not None:
+                sql += " AND dim_key = ?"
+                params.append(dim_key)
+            sql += f" GROUP BY {group} ORDER BY {group}"
+        conn = self.get_connection()
+        try:
+            cursor = records.tuple_cursor(conn)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def get_dwell_open_counts(self, dimension: str) -> Dict[str, Dict[str, Any]]:
+        """Trwające okresy wg statusu / posiadacza: {klucz: {"open": liczba, "oldest_since": czas}}."""
+        column = {"status": "status", "holder": "holder"}[dimension]
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(
+                f"SELECT COALESCE({column}, ''), COUNT(*), MIN({column}_since) FROM dwell_open GROUP BY 1"
+            ).fetchall()
+            return {row[0]: {"open": row[1], "oldest_since": row[2]} for row in rows}
+        finally:
+            conn.close()
 
 # Helper do szybkiego użycia
 db = Database()
@@ -1,7 +1,8 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Optional, Dict, List
+from itertools import repeat
+from typing import Optional, Dict, List, Sequence, Tuple
 
 class EnvelopeStatus(Enum):
     """Definiuje dozwolone stany koperty (Maszyna Stanów)."""
@@ -41,7 +42,167 @@ ALLOWED_TRANSITIONS: Dict[EnvelopeStatus, List[EnvelopeStatus]] = {
     # WYCOFANA to stan końcowy
 }
 
-@dataclass
+# ========================
+# SKOMPILOWANA MASZYNA STANÓW
+# ========================
+# ALLOWED_TRANSITIONS kompilujemy przy imporcie do postaci, którą da się sprawdzać bez
+# przeszukiwania list: statusy -> kody całkowite, przejścia -> maska bitowa per stan
+# źródłowy (bit kodu stanu docelowego). Operacje skanera (OPERATIONS) mają z góry
+# policzone: maskę stanów wejściowych, stan/posiadacza po operacji i kod błędu dla
+# każdego niedozwolonego stanu. Database używa tego jako jedynego źródła reguł.
+
+STATUS_BY_CODE: Tuple[str, ...] = tuple(status.value for status in EnvelopeStatus)
+STATUS_CODE: Dict[str, int] = {value: code for code, value in enumerate(STATUS_BY_CODE)}
+# Status spoza EnvelopeStatus (np. ręczna zmiana w bazie) - żadne przejście nie jest dozwolone
+UNKNOWN_STATUS_CODE = len(STATUS_BY_CODE)
+
+TRANSITION_MASK: Tuple[int, ...] = tuple(
+    sum(1 << STATUS_CODE[target.value] for target in ALLOWED_TRANSITIONS.get(status, []))
+    for status in EnvelopeStatus
+) + (0,)
+
+
+class Operation(IntEnum):
+    """Operacje zmieniające stan koperty (wartość kolumny events.operation = nazwa)."""
+    ISSUE = 0            # magazyn -> wózek wydawczy (hala)
+    LOAD = 1             # hala -> maszyna
+    TRANSFER_AUTO = 2    # maszyna -> inna maszyna
+    RELEASE = 3          # maszyna -> hala / wózek zwrotny (paletyzacja)
+    RETURN = 4           # -> magazyn (także zmiana sekcji koperty w magazynie)
+    MOVE = 5             # wózek -> inny wózek (bez zmiany stanu)
+
+
+@dataclass(frozen=True, slots=True)
+class OperationSpec:
+    """Skompilowana operacja: maska stanów wejściowych i wynik (stan, posiadacz, typ)."""
+    operation: Operation
+    source_mask: int
+    to_status: str
+    holder: Optional[str]              # stały posiadacz po operacji (None = z argumentu)
+    holder_type: str
+    errors: Tuple[Optional[str], ...]  # kod błędu per kod stanu wejściowego (None = dozwolone)
+    pallet_route: Optional[Tuple[str, str, str]] = None   # (stan, posiadacz, typ) gdy posiadacz to paletyzacja
+    event_from_holder: Optional[str] = None   # stała wartość events.from_holder (zgodność z historią)
+    event_to_holder: Optional[str] = None     # stała wartość events.to_holder
+
+    @property
+    def source_statuses(self) -> Tuple[str, ...]:
+        """Statusy wejściowe jako krotka - np. do WHERE status IN (...) w operacjach zbiorczych."""
+        return tuple(value for code, value in enumerate(STATUS_BY_CODE) if self.source_mask >> code & 1)
+
+
+@dataclass(slots=True)
+class Transition:
+    """Wynik sprawdzenia operacji dla jednej koperty."""
+    operation: Operation
+    from_status: str
+    from_holder: Optional[str]
+    to_status: Optional[str] = None
+    to_holder: Optional[str] = None
+    holder_type: Optional[str] = None
+    error_code: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error_code is None
+
+    @property
+    def event_from_holder(self) -> Optional[str]:
+        return OPERATIONS[self.operation].event_from_holder or self.from_holder
+
+    @property
+    def event_to_holder(self) -> Optional[str]:
+        return OPERATIONS[self.operation].event_to_holder or self.to_holder
+
+
+def _compile_operation(operation: Operation, scope, to_status: EnvelopeStatus, holder, holder_type: HolderType,
+                       same_status: bool = False, error_overrides: Dict[EnvelopeStatus, str] = None,
+                       pallet_route=None, **event_holders) -> OperationSpec:
+    """
+    Maska wejść = stany z `scope`, z których ALLOWED_TRANSITIONS pozwala przejść do to_status
+    (i do stanu z pallet_route). same_status: zmiana posiadacza bez zmiany stanu (np. maszyna -> maszyna).
+    """
+    targets = [to_status] + ([pallet_route[0]] if pallet_route else [])
+    mask = 0
+    for status in scope:
+        if (same_status and status == to_status) or all(target in ALLOWED_TRANSITIONS.get(status, []) for target in targets):
+            mask |= 1 << STATUS_CODE[status.value]
+    overrides = {STATUS_CODE[status.value]: code for status, code in (error_overrides or {}).items()}
+    errors = tuple(
+        None if mask >> code & 1 else overrides.get(code, 'ERR_INVALID_STATUS')
+        for code in range(UNKNOWN_STATUS_CODE + 1)
+    )
+    route = (pallet_route[0].value, pallet_route[1], pallet_route[2].value) if pallet_route else None
+    return OperationSpec(operation, mask, to_status.value, holder, holder_type.value, errors, route, **event_holders)
+
+
+OPERATIONS: Dict[Operation, OperationSpec] = {
+    Operation.ISSUE: _compile_operation(
+        Operation.ISSUE, [EnvelopeStatus.MAGAZYN], EnvelopeStatus.SHOP_FLOOR, None, HolderType.CART_OUT,
+        error_overrides={EnvelopeStatus.W_PRODUKCJI: 'ERR_DUPLICATE_ACTIVE'},
+        event_from_holder='MAGAZYN',
+    ),
+    Operation.LOAD: _compile_operation(
+        Operation.LOAD, [EnvelopeStatus.SHOP_FLOOR], EnvelopeStatus.W_PRODUKCJI, None, HolderType.MACHINE,
+        error_overrides={EnvelopeStatus.MAGAZYN: 'ERR_NOT_ISSUED'},
+    ),
+    Operation.TRANSFER_AUTO: _compile_operation(
+        Operation.TRANSFER_AUTO, [EnvelopeStatus.W_PRODUKCJI], EnvelopeStatus.W_PRODUKCJI, None, HolderType.MACHINE,
+        same_status=True,
+    ),
+    Operation.RELEASE: _compile_operation(
+        Operation.RELEASE, [EnvelopeStatus.W_PRODUKCJI], EnvelopeStatus.SHOP_FLOOR, 'SHOP_FLOOR', HolderType.FLOOR,
+        pallet_route=(EnvelopeStatus.CART_RET_05, 'CART-RET-05', HolderType.CART_IN),
+    ),
+    # Do magazynu z każdego stanu, z którego pozwala ALLOWED_TRANSITIONS; MAGAZYN -> MAGAZYN = zmiana sekcji
+    Operation.RETURN: _compile_operation(
+        Operation.RETURN, list(EnvelopeStatus), EnvelopeStatus.MAGAZYN, 'MAGAZYN', HolderType.WAREHOUSE,
+        same_status=True, event_to_holder='WAREHOUSE',
+    ),
+    # Przełożenie wydanych kopert na inny wózek wydawczy (posiadacz z argumentu)
+    Operation.MOVE: _compile_operation(
+        Operation.MOVE, [EnvelopeStatus.SHOP_FLOOR], EnvelopeStatus.SHOP_FLOOR, None, HolderType.CART_OUT,
+        same_status=True,
+    ),
+}
+
+# Wózki to posiadacze z prefiksem CART- (CART-OUT-*, CART-RET-05); wózek zwrotny jest
+# jednocześnie statusem i posiadaczem - trafia się na niego tylko przez RELEASE z paletyzacji.
+CART_PREFIX = "CART-"
+RETURN_CART = EnvelopeStatus.CART_RET_05.value
+
+
+def is_cart(holder_id: Optional[str]) -> bool:
+    return str(holder_id or "").upper().startswith(CART_PREFIX)
+
+
+def resolve_transition(operation: Operation, from_status: str, from_holder: Optional[str] = None,
+                       holder: Optional[str] = None) -> Transition:
+    """
+    Sprawdza operację dla koperty w stanie from_status (posiadacz from_holder) i wylicza
+    stan oraz posiadacza po operacji. holder = posiadacz z argumentu (wózek, maszyna).
+    """
+    spec = OPERATIONS[operation]
+    error_code = spec.errors[STATUS_CODE.get(from_status, UNKNOWN_STATUS_CODE)]
+    if error_code:
+        return Transition(operation, from_status, from_holder, error_code=error_code)
+    if spec.pallet_route and 'PALLET' in str(from_holder).upper():
+        to_status, to_holder, holder_type = spec.pallet_route
+    else:
+        to_status, to_holder, holder_type = spec.to_status, spec.holder or holder, spec.holder_type
+    return Transition(operation, from_status, from_holder, to_status, to_holder, holder_type)
+
+
+def validate_batch(operation: Operation, statuses: Sequence[str]) -> List[Optional[str]]:
+    """
+    Kody błędów dla wielu kopert naraz (None = operacja dozwolona) - jedna tablica
+    kodów stanów i jeden odczyt z tablicy błędów operacji na kopertę.
+    """
+    errors = OPERATIONS[operation].errors
+    codes = map(STATUS_CODE.get, statuses, repeat(UNKNOWN_STATUS_CODE))
+    return [errors[code] for code in codes]
+
+@dataclass(slots=True)
 class Envelope:
     """
     Fizyczna reprezentacja jednej koperty w systemie.
@@ -84,7 +245,7 @@ class Envelope:
 
     def can_transition_to(self, new_status: EnvelopeStatus) -> bool:
         """Sprawdza, czy przejście jest dozwolone."""
-        return new_status in ALLOWED_TRANSITIONS.get(self.status, [])
+        return bool(TRANSITION_MASK[STATUS_CODE[self.status.value]] >> STATUS_CODE[new_status.value] & 1)
 
     def transition_to(
         self, 
@@ -111,7 +272,7 @@ class Envelope:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class EnvelopeEvent:
     """Zdarzenie w historii koperty (audit trail)."""
     envelope_key: str
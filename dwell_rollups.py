@@ -0,0 +1,367 @@
+"""
+Czasy przebywania kopert (dwell time) wg statusu i posiadacza - agregaty przyrostowe.
+
+Pytanie "ile koperty leżą na SHOP_FLOOR / stoją na BOOBST 1?" bez parowania surowych
+zdarzeń: zadanie z watermarkiem (timestamp, id) przechodzi po nowych wierszach events
+w kolejności (timestamp, id) i dla każdej koperty zamyka okres poprzedniego statusu
+(zmiana statusu) i poprzedniego posiadacza (zmiana posiadacza). Zamknięty okres trafia do:
+- dwell_totals  - cała historia: (wymiar, klucz, przedział histogramu) -> liczba, suma, min, max
+- dwell_hourly  - to samo per godzina zakończenia okresu (raporty z zakresem dat i serie)
+Trwające okresy są w dwell_open (liczba kopert "teraz" i najstarszy początek).
+
+- Percentyle (p50/p90/p95/p99) są szacowane z histogramu o przedziałach DWELL_BINS
+  (interpolacja w przedziale) - dokładność rzędu szerokości przedziału.
+- Agregaty, dwell_open i watermark zapisuje jedna transakcja; drugi worker z tą samą
+  partią dostaje 409 i nic nie zapisuje (bez podwójnego liczenia).
+- Zadanie: CLI/cron, endpoint admina, w tle po DWELL_ROLLUP_CHECK_EVERY udanych operacjach
+  workera, a raporty doliczają przed odczytem jedną partię (jeśli nikt inny nie liczy).
+- Import zdarzeń z datami wstecz (starszymi niż watermark) wymaga przebudowy:
+  python dwell_rollups.py --rebuild
+- Zakres dat raportu liczony po godzinie zakończenia okresu, z dokładnością do godziny (UTC).
+
+Konfiguracja (zmienne środowiskowe):
+- DWELL_ROLLUP_BATCH          - zdarzeń na partię (jedna transakcja zapisu)
+- DWELL_ROLLUP_CHECK_EVERY    - co ile udanych operacji w workerze doliczać w tle (0 = wyłączone)
+
+Uruchomienie:
+    python dwell_rollups.py [--rebuild] [--batch N] [--report status|holder]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import floor_state
+from database import db as default_db
+
+DWELL_ROLLUP_BATCH = int(os.environ.get('DWELL_ROLLUP_BATCH', '5000'))
+DWELL_ROLLUP_CHECK_EVERY = int(os.environ.get('DWELL_ROLLUP_CHECK_EVERY', '200'))
+
+WATERMARK_KEY = "dwell_rollups:position"
+DIMENSIONS = ("status", "holder")
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+# Górne granice przedziałów histogramu (sekundy); ostatni przedział (indeks len) - powyżej 90 dni.
+# Zmiana granic wymaga przebudowy (--rebuild) - przedziały są zapisane w bazie jako indeksy.
+DWELL_BINS = (
+    60, 300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 12 * 3600,
+    86400, 2 * 86400, 3 * 86400, 7 * 86400, 14 * 86400, 30 * 86400, 90 * 86400,
+)
+
+# Jeden przebieg agregacji naraz w procesie (CLI, endpoint admina, raport, wątek w tle)
+_rollup_lock = threading.Lock()
+_operations_since_check = 0
+
+
+def _reset_after_fork():
+    global _rollup_lock, _operations_since_check
+    _rollup_lock = threading.Lock()
+    _operations_since_check = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def bin_index(seconds: float) -> int:
+    return bisect_left(DWELL_BINS, seconds)
+
+
+def _seconds_between(start: str, end: str) -> float:
+    return max(0.0, (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds())
+
+
+def _add(aggregates: dict, key: tuple, seconds: float) -> None:
+    values = aggregates.get(key)
+    if values is None:
+        aggregates[key] = [1, seconds, seconds, seconds]
+    else:
+        values[0] += 1
+        values[1] += seconds
+        if seconds < values[2]:
+            values[2] = seconds
+        if seconds > values[3]:
+            values[3] = seconds
+
+
+def aggregate_batch(events, open_periods: dict) -> tuple:
+    """
+    Partia zdarzeń (id, klucz, status, posiadacz, timestamp) w kolejności (timestamp, id)
+    -> (zmienione otwarte okresy, agregaty godzinowe, agregaty łączne).
+    open_periods: {klucz: (status, status_since, holder, holder_since, event_id)}.
+    """
+    periods = dict(open_periods)
+    hourly: Dict[tuple, list] = {}
+    totals: Dict[tuple, list] = {}
+    touched = set()
+    for event_id, envelope_key, to_status, to_holder, stamp in events:
+        touched.add(envelope_key)
+        previous = periods.get(envelope_key)
+        if previous is None:
+            periods[envelope_key] = (to_status, stamp, to_holder, stamp, event_id)
+            continue
+        status, status_since, holder, holder_since, _ = previous
+        bucket = stamp[:13] + ":00:00"
+        if to_status != status:
+            if status_since is not None:
+                seconds = _seconds_between(status_since, stamp)
+                _add(hourly, ("status", bucket, status or "", bin_index(seconds)), seconds)
+                _add(totals, ("status", status or "", bin_index(seconds)), seconds)
+            status, status_since = to_status, stamp
+        if to_holder != holder:
+            if holder_since is not None:
+                seconds = _seconds_between(holder_since, stamp)
+                _add(hourly, ("holder", bucket, holder or "", bin_index(seconds)), seconds)
+                _add(totals, ("holder", holder or "", bin_index(seconds)), seconds)
+            holder, holder_since = to_holder, stamp
+        periods[envelope_key] = (status, status_since, holder, holder_since, event_id)
+    return {key: periods[key] for key in touched}, hourly, totals
+
+
+def catch_up(database=None, batch_size: int = None, max_batches: Optional[int] = None) -> dict:
+    """
+    Dolicza zdarzenia po watermarku partiami (max_batches=None - do końca).
+    Przy trwającym przebiegu w tym procesie status 409.
+    """
+    database = database or default_db
+    batch_size = max(1, batch_size or DWELL_ROLLUP_BATCH)
+    if not _rollup_lock.acquire(blocking=False):
+        return {"success": False, "error": "Agregacja czasow juz trwa", "status": 409}
+    try:
+        started = time.perf_counter()
+        batches = events_applied = 0
+        position = None
+        while max_batches is None or batches < max_batches:
+            batch = database.get_dwell_rollup_batch(WATERMARK_KEY, batch_size)
+            events = batch["events"]
+            position = batch["position"]
+            if not events:
+                break
+            periods, hourly, totals = aggregate_batch(events, batch["open"])
+            new_position = (events[-1][4], events[-1][0])
+            result = database.apply_dwell_rollup_batch(
+                WATERMARK_KEY, position, new_position, periods, hourly, totals
+            )
+            if not result.get("success"):
+                if result.get("status") == 409:
+                    break  # partię policzył inny worker - następny przebieg zacznie od jego watermarku
+                return result
+            batches += 1
+            events_applied += len(events)
+            position = new_position
+            if len(events) < batch_size:
+                break
+        return {
+            "success": True,
+            "batches": batches,
+            "events_applied": events_applied,
+            "watermark": _watermark_json(position),
+            "duration_ms": (time.perf_counter() - started) * 1000.0,
+        }
+    finally:
+        _rollup_lock.release()
+
+
+def _watermark_json(position) -> Optional[dict]:
+    if not position or not position[0]:
+        return None
+    return {"timestamp": position[0], "event_id": position[1]}
+
+
+def rebuild(database=None, batch_size: int = None) -> dict:
+    """Czyści agregaty i liczy od pierwszego zdarzenia (po imporcie danych z datami wstecz)."""
+    database = database or default_db
+    if not _rollup_lock.acquire(blocking=False):
+        return {"success": False, "error": "Agregacja czasow juz trwa", "status": 409}
+    try:
+        database.reset_dwell_rollups(WATERMARK_KEY)
+    finally:
+        _rollup_lock.release()
+    return catch_up(database, batch_size=batch_size)
+
+
+def request_catch_up(database=None) -> bool:
+    """Doliczenie w wątku w tle (bez czekania); False, gdy przebieg już trwa."""
+    if _rollup_lock.locked():
+        return False
+    threading.Thread(target=catch_up, args=(database,), name="dwell-rollups", daemon=True).start()
+    return True
+
+
+def note_operations(count: int = 1, database=None) -> None:
+    """Udane operacje na kopertach; co DWELL_ROLLUP_CHECK_EVERY - doliczenie w tle."""
+    global _operations_since_check
+    if DWELL_ROLLUP_CHECK_EVERY <= 0:
+        return
+    _operations_since_check += count
+    if _operations_since_check >= DWELL_ROLLUP_CHECK_EVERY:
+        _operations_since_check = 0
+        request_catch_up(database)
+
+
+def estimate_percentiles(histogram: Dict[int, int], min_seconds: float, max_seconds: float) -> dict:
+    """Percentyle z histogramu {przedział: liczba} - interpolacja liniowa wewnątrz przedziału (w granicach min-max)."""
+    total = sum(histogram.values())
+    result = {}
+    if not total:
+        return result
+    bins = sorted(histogram)
+    for quantile in PERCENTILES:
+        rank = quantile * total
+        cumulative = 0
+        for index in bins:
+            count = histogram[index]
+            if cumulative + count >= rank:
+                upper = DWELL_BINS[index] if index < len(DWELL_BINS) else max_seconds
+                upper = min(upper, max_seconds)
+                lower = min(max(DWELL_BINS[index - 1] if index > 0 else 0, min_seconds), upper)
+                result[f"p{round(quantile * 100)}_seconds"] = round(lower + (upper - lower) * (rank - cumulative) / count, 1)
+                break
+            cumulative += count
+    return result
+
+
+def _summaries(rows) -> dict:
+    """Wiersze (dim_key, bin, dwells, total, min, max) -> {klucz: podsumowanie z percentylami}."""
+    grouped: Dict[str, dict] = {}
+    for dim_key, index, dwells, total_seconds, min_seconds, max_seconds in rows:
+        entry = grouped.setdefault(dim_key, {
+            "dwells": 0, "total_seconds": 0.0, "min_seconds": min_seconds, "max_seconds": 0.0, "histogram": {},
+        })
+        entry["dwells"] += dwells
+        entry["total_seconds"] += total_seconds
+        entry["min_seconds"] = min(entry["min_seconds"], min_seconds)
+        entry["max_seconds"] = max(entry["max_seconds"], max_seconds)
+        entry["histogram"][index] = entry["histogram"].get(index, 0) + dwells
+    summaries = {}
+    for dim_key, entry in grouped.items():
+        summary = {
+            "dwells": entry["dwells"],
+            "total_seconds": round(entry["total_seconds"], 1),
+            "avg_seconds": round(entry["total_seconds"] / entry["dwells"], 1) if entry["dwells"] else None,
+            "min_seconds": round(entry["min_seconds"], 1),
+            "max_seconds": round(entry["max_seconds"], 1),
+        }
+        summary.update(estimate_percentiles(entry["histogram"], entry["min_seconds"], entry["max_seconds"]))
+        summaries[dim_key] = summary
+    return summaries
+
+
+def _parse_range(start: Optional[str], end: Optional[str]) -> tuple:
+    """Zakres ISO 8601 -> godziny 'YYYY-MM-DD HH:00:00' (start w dół, koniec w górę); błąd -> ValueError."""
+    bounds = []
+    for value, round_up in ((start, False), (end, True)):
+        if not value:
+            bounds.append(None)
+            continue
+        parsed = floor_state.parse_at(value)
+        if parsed is None:
+            raise ValueError(value)
+        moment = datetime.fromisoformat(parsed)
+        hour = moment.replace(minute=0, second=0)
+        if round_up and hour != moment:
+            hour += timedelta(hours=1)
+        bounds.append(hour.strftime(floor_state.TIMESTAMP_FORMAT))
+    return tuple(bounds)
+
+
+def _validate(dimension: str, start: Optional[str], end: Optional[str]):
+    if dimension not in DIMENSIONS:
+        return None, {"success": False, "error": f"Nieprawidlowy wymiar (dozwolone: {', '.join(DIMENSIONS)})", "status": 400}
+    try:
+        return _parse_range(start, end), None
+    except ValueError:
+        return None, {"success": False, "error": "Nieprawidlowy zakres dat (ISO 8601)", "status": 400}
+
+
+def dwell_report(database=None, dimension: str = "status", start: Optional[str] = None,
+                 end: Optional[str] = None, dim_key: Optional[str] = None, refresh: bool = True) -> dict:
+    """
+    Czasy przebywania wg statusu / posiadacza: liczba okresów, suma, średnia, max, percentyle
+    oraz trwające okresy (bez zakresu dat - cała historia z dwell_totals).
+    """
+    database = database or default_db
+    bounds, error = _validate(dimension, start, end)
+    if error:
+        return error
+    if refresh:
+        catch_up(database, max_batches=1)
+
+    started = time.perf_counter()
+    rows = database.get_dwell_histograms(dimension, bounds[0], bounds[1], dim_key)
+    summaries = _summaries(rows)
+    open_counts = database.get_dwell_open_counts(dimension)
+    keys = sorted(set(summaries) | set(open_counts)) if dim_key is None else [dim_key]
+    items = []
+    for key in keys:
+        item = {"key": key}
+        item.update(summaries.get(key, {"dwells": 0}))
+        item.update(open_counts.get(key, {"open": 0, "oldest_since": None}))
+        items.append(item)
+    return {
+        "success": True,
+        "dimension": dimension,
+        "from": bounds[0],
+        "to": bounds[1],
+        "watermark": _watermark_json(_read_watermark(database)),
+        "items": items,
+        "duration_ms": (time.perf_counter() - started) * 1000.0,
+    }
+
+
+def dwell_hourly_report(database=None, dimension: str = "status", start: Optional[str] = None,
+                        end: Optional[str] = None, dim_key: Optional[str] = None, refresh: bool = True) -> dict:
+    """Seria godzinowa (godzina zakończenia okresu): liczba, średnia i percentyle per klucz."""
+    database = database or default_db
+    bounds, error = _validate(dimension, start, end)
+    if error:
+        return error
+    if refresh:
+        catch_up(database, max_batches=1)
+
+    started = time.perf_counter()
+    rows = database.get_dwell_histograms(dimension, bounds[0], bounds[1], dim_key, by_bucket=True)
+    by_bucket: Dict[str, list] = {}
+    for bucket, *row in rows:
+        by_bucket.setdefault(bucket, []).append(row)
+    series = [
+        {"bucket": bucket, "keys": _summaries(bucket_rows)}
+        for bucket, bucket_rows in sorted(by_bucket.items())
+    ]
+    return {
+        "success": True,
+        "dimension": dimension,
+        "from": bounds[0],
+        "to": bounds[1],
+        "watermark": _watermark_json(_read_watermark(database)),
+        "series": series,
+        "duration_ms": (time.perf_counter() - started) * 1000.0,
+    }
+
+
+def _read_watermark(database):
+    raw = database.get_maintenance_state(WATERMARK_KEY)
+    return tuple(json.loads(raw)) if raw else None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Agregaty czasów przebywania kopert (status / posiadacz)")
+    parser.add_argument("--rebuild", action="store_true", help="wyczyść agregaty i policz od początku")
+    parser.add_argument("--batch", type=int, default=DWELL_ROLLUP_BATCH, help="zdarzeń na partię")
+    parser.add_argument("--report", choices=DIMENSIONS, help="tylko wypisz raport dla wymiaru")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        result = dwell_report(dimension=args.report)
+    elif args.rebuild:
+        result = rebuild(batch_size=args.batch)
+    else:
+        result = catch_up(batch_size=args.batch)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if result.get("success") else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,318 @@
+"""
+Stan hali w dowolnej chwili: migawki stanu kopert + ogon zdarzeń (event sourcing).
+
+Tabela events jest dziennikiem zmian stanu. Zamiast odtwarzać ją całą dla pytania
+"gdzie była każda koperta o 06:00 wczoraj?", co FLOOR_SNAPSHOT_EVERY_EVENTS zdarzeń
+zapisujemy migawkę (floor_snapshots): stan każdej koperty (status, posiadacz, czas
+i id ostatniego zdarzenia) po zdarzeniu (as_of, last_event_id).
+
+- Kolejność zdarzeń: (timestamp, id). Na żywej bazie to to samo co kolejność id
+  (CURRENT_TIMESTAMP w transakcji zapisu), ale dane importowane (dataset_generator.py)
+  mają id niezgodne z czasem - kolejność po czasie daje poprawny stan w obu przypadkach.
+- Zapytanie o chwilę T: najnowsza migawka z as_of <= T + zdarzenia po niej do T włącznie
+  (zakres po indeksie idx_events_timestamp, najwyżej ok. FLOOR_SNAPSHOT_EVERY_EVENTS
+  wierszy) - koszt nie zależy od rozmiaru tabeli events.
+- Migawki powstają przyrostowo (poprzednia migawka + kolejne zdarzenia): z CLI/crona,
+  z endpointu admina albo w tle po FLOOR_SNAPSHOT_CHECK_EVERY udanych operacjach workera.
+  Kilka workerów naraz = ten sam last_event_id, drugi zapis jest pomijany (UNIQUE).
+- Import zdarzeń z datami wstecz (starszymi niż ostatnia migawka) wymaga przebudowy:
+  python floor_state.py --rebuild
+- Stan obejmuje koperty, które mają zdarzenia. delete_envelope usuwa historię koperty,
+  ale starsze migawki nadal ją zawierają (do przebudowy).
+- Czas bez strefy = UTC (jak CURRENT_TIMESTAMP w events).
+
+Konfiguracja (zmienne środowiskowe):
+- FLOOR_SNAPSHOT_EVERY_EVENTS   - co ile zdarzeń migawka (= maks. długość ogona zapytania)
+- FLOOR_SNAPSHOT_KEEP           - ile najnowszych migawek trzymać (0 = wszystkie); zapytania
+                                  sprzed najstarszej odtwarzają zdarzenia od początku
+- FLOOR_SNAPSHOT_CHECK_EVERY    - co ile udanych operacji w workerze sprawdzać (w tle), czy
+                                  czas na migawkę (0 = tylko CLI / endpoint admina)
+- FLOOR_STATE_CACHE_SNAPSHOTS   - ile zdekodowanych migawek trzymać w pamięci workera
+
+Uruchomienie:
+    python floor_state.py [--rebuild] [--force] [--every N] [--at 2026-01-01T06:00:00Z]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from database import db as default_db
+
+FLOOR_SNAPSHOT_EVERY_EVENTS = int(os.environ.get('FLOOR_SNAPSHOT_EVERY_EVENTS', '5000'))
+FLOOR_SNAPSHOT_KEEP = int(os.environ.get('FLOOR_SNAPSHOT_KEEP', '500'))
+FLOOR_SNAPSHOT_CHECK_EVERY = int(os.environ.get('FLOOR_SNAPSHOT_CHECK_EVERY', '500'))
+FLOOR_STATE_CACHE_SNAPSHOTS = int(os.environ.get('FLOOR_STATE_CACHE_SNAPSHOTS', '4'))
+
+PAYLOAD_VERSION = 1
+MAX_DETAILS_LIMIT = 50000
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Jeden przebieg budowy migawek naraz w procesie (CLI, endpoint admina, wątek w tle)
+_snapshot_lock = threading.Lock()
+# id migawki -> {klucz koperty: (status, posiadacz, timestamp, id zdarzenia)}; tylko do odczytu
+_decoded_cache: "OrderedDict[int, dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+_operations_since_check = 0
+
+
+def _reset_after_fork():
+    global _snapshot_lock, _cache_lock, _operations_since_check
+    _snapshot_lock = threading.Lock()
+    _cache_lock = threading.Lock()
+    _decoded_cache.clear()
+    _operations_since_check = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def parse_at(value: str) -> Optional[str]:
+    """ISO 8601 (z 'Z'/strefą albo bez = UTC) -> 'YYYY-MM-DD HH:MM:SS' UTC jak w events; błąd -> None."""
+    try:
+        moment = datetime.fromisoformat(value.strip().replace(' ', 'T'))
+    except (AttributeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def encode_state(state: dict) -> bytes:
+    """Stan -> zlib(JSON kolumnowego); statusy i posiadacze jako indeksy do słowników."""
+    keys = sorted(state)
+    statuses: Dict[Any, int] = {}
+    holders: Dict[Any, int] = {}
+    status_index, holder_index, stamps, event_ids = [], [], [], []
+    for key in keys:
+        status, holder, stamp, event_id = state[key]
+        status_index.append(statuses.setdefault(status, len(statuses)))
+        holder_index.append(holders.setdefault(holder, len(holders)))
+        stamps.append(stamp)
+        event_ids.append(event_id)
+    document = {
+        "v": PAYLOAD_VERSION,
+        "keys": keys,
+        "statuses": list(statuses),
+        "holders": list(holders),
+        "s": status_index,
+        "h": holder_index,
+        "ts": stamps,
+        "ids": event_ids,
+    }
+    return zlib.compress(json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_state(payload: bytes) -> dict:
+    document = json.loads(zlib.decompress(payload))
+    if document.get("v") != PAYLOAD_VERSION:
+        raise ValueError(f"Nieznana wersja migawki: {document.get('v')}")
+    statuses, holders = document["statuses"], document["holders"]
+    return {
+        key: (statuses[s], holders[h], stamp, event_id)
+        for key, s, h, stamp, event_id in zip(
+            document["keys"], document["s"], document["h"], document["ts"], document["ids"]
+        )
+    }
+
+
+def _snapshot_state(database, snapshot: dict) -> Optional[dict]:
+    """Zdekodowany stan migawki (z cache workera); None, gdy migawkę właśnie usunięto."""
+    snapshot_id = snapshot["id"]
+    with _cache_lock:
+        state = _decoded_cache.get(snapshot_id)
+        if state is not None:
+            _decoded_cache.move_to_end(snapshot_id)
+            return state
+    payload = database.get_floor_snapshot_payload(snapshot_id)
+    if payload is None:
+        return None
+    state = decode_state(payload)
+    if FLOOR_STATE_CACHE_SNAPSHOTS > 0:
+        with _cache_lock:
+            _decoded_cache[snapshot_id] = state
+            while len(_decoded_cache) > FLOOR_STATE_CACHE_SNAPSHOTS:
+                _decoded_cache.popitem(last=False)
+    return state
+
+
+def _apply(state: dict, events) -> None:
+    for event_id, envelope_key, to_status, to_holder, stamp in events:
+        state[envelope_key] = (to_status, to_holder, stamp, event_id)
+
+
+def state_at(database, at: Optional[str]) -> tuple:
+    """
+    Stan kopert w chwili at ('YYYY-MM-DD HH:MM:SS' UTC; None = teraz).
+    Zwraca (stan, migawka albo None, liczba zdarzeń ogona). Stanu nie wolno modyfikować.
+    """
+    snapshot = database.get_floor_snapshot(at)
+    base = _snapshot_state(database, snapshot) if snapshot else None
+    if base is None:
+        snapshot, base, position = None, {}, ("", 0)
+    else:
+        position = (snapshot["as_of"], snapshot["last_event_id"])
+    tail = database.get_events_after(*position, until=at)
+    if not tail:
+        return base, snapshot, 0
+    state = dict(base)
+    _apply(state, tail)
+    return state, snapshot, len(tail)
+
+
+def build_snapshots(database=None, every: int = None, force: bool = False, keep: int = None) -> dict:
+    """
+    Dopisuje migawki co `every` zdarzeń od ostatniej migawki. force - także migawka
+    z niepełnej ostatniej partii (stan "teraz"). Przy trwającym przebiegu status 409.
+    """
+    database = database or default_db
+    every = max(1, every or FLOOR_SNAPSHOT_EVERY_EVENTS)
+    keep = FLOOR_SNAPSHOT_KEEP if keep is None else keep
+
+    if not _snapshot_lock.acquire(blocking=False):
+        return {"success": False, "error": "Budowa migawek juz trwa", "status": 409}
+    try:
+        started = time.perf_counter()
+        latest = database.get_floor_snapshot()
+        base = _snapshot_state(database, latest) if latest else None
+        if base is None:
+            latest, state, position = None, {}, ("", 0)
+        else:
+            state, position = dict(base), (latest["as_of"], latest["last_event_id"])
+
+        written = events_applied = 0
+        while True:
+            events = database.get_events_after(*position, limit=every)
+            if not events or (len(events) < every and not force):
+                break
+            _apply(state, events)
+            events_applied += len(events)
+            last_event_id, stamp = events[-1][0], events[-1][4]
+            position = (stamp, last_event_id)
+            if database.insert_floor_snapshot(last_event_id, stamp, len(state), encode_state(state), keep):
+                written += 1
+            if len(events) < every:
+                break
+
+        return {
+            "success": True,
+            "snapshots_written": written,
+            "events_applied": events_applied,
+            "envelopes": len(state),
+            "last_event_id": position[1] or None,
+            "as_of": position[0] or None,
+            "duration_ms": (time.perf_counter() - started) * 1000.0,
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e), "status": 500}
+    finally:
+        _snapshot_lock.release()
+
+
+def rebuild(database=None, every: int = None, keep: int = None) -> dict:
+    """Usuwa migawki i buduje je od pierwszego zdarzenia (po imporcie danych z datami wstecz)."""
+    database = database or default_db
+    if _snapshot_lock.locked():
+        return {"success": False, "error": "Budowa migawek juz trwa", "status": 409}
+    deleted = database.delete_floor_snapshots()
+    with _cache_lock:
+        _decoded_cache.clear()
+    result = build_snapshots(database, every=every, keep=keep)
+    result["snapshots_deleted"] = deleted
+    return result
+
+
+def request_snapshot(database=None) -> bool:
+    """Budowa migawek w wątku w tle (bez czekania); False, gdy przebieg już trwa."""
+    if _snapshot_lock.locked():
+        return False
+    threading.Thread(target=build_snapshots, args=(database,), name="floor-snapshots", daemon=True).start()
+    return True
+
+
+def note_operations(count: int = 1, database=None) -> None:
+    """Udane operacje na kopertach; co FLOOR_SNAPSHOT_CHECK_EVERY - sprawdzenie migawek w tle."""
+    global _operations_since_check
+    if FLOOR_SNAPSHOT_CHECK_EVERY <= 0:
+        return
+    _operations_since_check += count
+    if _operations_since_check >= FLOOR_SNAPSHOT_CHECK_EVERY:
+        _operations_since_check = 0
+        request_snapshot(database)
+
+
+def floor_state(database=None, at: Optional[str] = None, details: bool = False,
+                status: Optional[str] = None, holder: Optional[str] = None, limit: int = 1000) -> dict:
+    """
+    Stan hali w chwili at (ISO 8601; brak = teraz): liczniki wg statusu i posiadacza,
+    opcjonalnie (details) lista kopert filtrowana po statusie / posiadaczu.
+    """
+    database = database or default_db
+    at_ts = None
+    if at:
+        at_ts = parse_at(at)
+        if at_ts is None:
+            return {"success": False, "error": "Nieprawidlowy parametr at (ISO 8601, np. 2026-01-01T06:00:00Z)", "status": 400}
+
+    started = time.perf_counter()
+    state, snapshot, tail_events = state_at(database, at_ts)
+    by_status = Counter(entry[0] for entry in state.values())
+    by_holder = Counter(entry[1] for entry in state.values())
+    result = {
+        "success": True,
+        "at": at_ts or datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT),
+        "snapshot": {
+            "id": snapshot["id"],
+            "last_event_id": snapshot["last_event_id"],
+            "as_of": snapshot["as_of"],
+        } if snapshot else None,
+        "tail_events": tail_events,
+        "envelopes": len(state),
+        "by_status": dict(by_status.most_common()),
+        "by_holder": {str(key): count for key, count in by_holder.most_common()},
+    }
+    if details:
+        limit = max(1, min(limit, MAX_DETAILS_LIMIT))
+        keys = sorted(
+            key for key, entry in state.items()
+            if (status is None or entry[0] == status) and (holder is None or entry[1] == holder)
+        )
+        result["matched"] = len(keys)
+        result["items"] = [
+            {"id": key, "status": state[key][0], "holder": state[key][1],
+             "since": state[key][2], "event_id": state[key][3]}
+            for key in keys[:limit]
+        ]
+    result["duration_ms"] = (time.perf_counter() - started) * 1000.0
+
+    # Długi ogon = brakuje migawek (np. wyłączone sprawdzanie w workerach) - dobudowa w tle
+    if tail_events >= FLOOR_SNAPSHOT_EVERY_EVENTS:
+        request_snapshot(database)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migawki stanu hali (event sourcing zdarzeń kopert)")
+    parser.add_argument("--rebuild", action="store_true", help="usuń migawki i zbuduj od początku")
+    parser.add_argument("--force", action="store_true", help="migawka także z niepełnej ostatniej partii")
+    parser.add_argument("--every", type=int, default=FLOOR_SNAPSHOT_EVERY_EVENTS, help="zdarzeń na migawkę")
+    parser.add_argument("--at", help="tylko wypisz stan w chwili (ISO 8601)")
+    args = parser.parse_args(argv)
+
+    if args.at:
+        result = floor_state(at=args.at)
+    elif args.rebuild:
+        result = rebuild(every=args.every)
+    else:
+        result = build_snapshots(every=args.every, force=args.force)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if result.get("success") else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
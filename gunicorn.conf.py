@@ -0,0 +1,52 @@
+"""
+Konfiguracja gunicorn (produkcja): wiele workerów (procesy) x wątki.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- preload_app - aplikacja ładowana w master przed fork (wspólna pamięć epok cache,
+  jedna inicjalizacja bazy, szybszy start workerów)
+- max_requests (+ jitter) - workery są co jakiś czas wymieniane, bez restartu wszystkich naraz
+- Przeładowanie bez przerwy: kill -HUP <master> wymienia workery (ta sama wersja kodu,
+  bo kod jest załadowany w master). Nowy kod: kill -USR2 <master> (nowy master obok
+  starego), po starcie nowych workerów kill -TERM <stary master>.
+
+Stan współdzielony między workerami:
+- limiter zapytań - backend sqlite (RATE_LIMIT_BACKEND), wspólny plik na hoście
+- metryki - pliki procesów w METRICS_DIR, sumowane przez /metrics
+- cache notatek - per worker, unieważnienia przez epoki w pamięci współdzielonej
+- baza - Database otwiera połączenie na każde wywołanie, więc nic nie przechodzi przez fork
+
+Konfiguracja (zmienne środowiskowe):
+- PORT                                - port nasłuchu
+- GUNICORN_WORKERS / WEB_CONCURRENCY  - liczba workerów (domyślnie liczba rdzeni)
+- GUNICORN_THREADS                    - wątki na worker
+- GUNICORN_TIMEOUT                    - limit czasu requestu (s); musi objąć przetwarzanie zdjęć
+- GUNICORN_MAX_REQUESTS               - po ilu requestach worker jest wymieniany (0 = nigdy)
+"""
+import os
+
+# Ustawiane przed importem aplikacji (preload) - moduły czytają je przy imporcie
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+os.environ.setdefault('METRICS_DIR', './data/metrics')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', os.environ.get('WEB_CONCURRENCY', str(os.cpu_count() or 1))))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '90'))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    # Ostatni zrzut metryk workera - atexit nie zawsze zdąży przy wymianie procesu
+    import metrics
+    if metrics.METRICS_DIR:
+        metrics.flush()
@@ -0,0 +1,393 @@
+"""
+Normalizacja zdjęć notatek (dekodowanie -> miniatura -> WebP) poza wątkiem requestu.
+
+Kodowanie WebP (LANCZOS + method=6) jest ciężkie dla CPU, dlatego wykonujemy je
+w ograniczonej puli procesów. Request czeka na wynik (future), a gdy kolejka jest
+pełna, dostaje od razu błąd 503 zamiast blokować kolejne skany.
+
+Konfiguracja (zmienne środowiskowe):
+- NOTE_IMAGE_WORKERS        - liczba procesów puli (0 = przetwarzanie w wątku requestu)
+- NOTE_IMAGE_QUEUE_LIMIT    - ile zadań może czekać ponad liczbę procesów
+- NOTE_IMAGE_TIMEOUT_SECONDS - maksymalny czas oczekiwania requestu na wynik
+- NOTE_IMAGE_MP_START       - metoda startu procesów (spawn / forkserver / fork)
+- NOTE_IMAGE_MAX_PIXELS     - limit pikseli obrazu źródłowego (ochrona przed "decompression bomb")
+- NOTE_IMAGE_PIXEL_BUDGET   - ile pikseli może być jednocześnie zdekodowanych w jednym procesie
+
+Duże zdjęcia z telefonu (np. 48 MP) nie są dekodowane w pełnej rozdzielczości:
+JPEG korzysta z trybu draft (skalowanie 1/2, 1/4, 1/8 w dekoderze), a pozostałe
+formaty są najpierw zmniejszane całkowitym krokiem (reduce) przed LANCZOS.
+
+Pillow importujemy przy pierwszym zdjęciu (_pil), nie przy starcie serwera.
+"""
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+NOTE_IMAGE_WORKERS = int(os.environ.get('NOTE_IMAGE_WORKERS', str(min(2, os.cpu_count() or 1))))
+NOTE_IMAGE_QUEUE_LIMIT = int(os.environ.get('NOTE_IMAGE_QUEUE_LIMIT', '8'))
+NOTE_IMAGE_TIMEOUT_SECONDS = int(os.environ.get('NOTE_IMAGE_TIMEOUT_SECONDS', '60'))
+NOTE_IMAGE_MP_START = os.environ.get('NOTE_IMAGE_MP_START', 'spawn')
+NOTE_IMAGE_MAX_PIXELS = int(os.environ.get('NOTE_IMAGE_MAX_PIXELS', str(64 * 1000 * 1000)))
+NOTE_IMAGE_PIXEL_BUDGET = int(os.environ.get('NOTE_IMAGE_PIXEL_BUDGET', str(48 * 1000 * 1000)))
+MAX_IMAGE_DIM = 1600
+# Warianty rozdzielczości zapisywane obok pełnego obrazu ("full" = MAX_IMAGE_DIM)
+IMAGE_VARIANT_SIZES = {"thumb": 160, "preview": 640}
+
+_pil_image = None
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, NOTE_IMAGE_WORKERS) + max(0, NOTE_IMAGE_QUEUE_LIMIT))
+_stats_lock = threading.Lock()
+_stats = {
+    "queue_depth": 0,
+    "queue_depth_max": 0,
+    "queue_rejected": 0,
+    "encode_count": 0,
+    "encode_ms_total": 0.0,
+    "encode_ms_max": 0.0,
+    "decode_bytes_last": 0,
+    "decode_bytes_max": 0,
+    "rss_peak_kb_last": 0,
+    "rss_peak_kb_max": 0,
+    "decode_rejected": 0,
+}
+
+# Budżet pikseli dekodowanych jednocześnie w tym procesie (ważne przy
+# NOTE_IMAGE_WORKERS=0, gdy dekodowanie idzie równolegle w wątkach requestów).
+_pixel_budget_cond = threading.Condition()
+_pixels_in_use = 0
+
+
+def _pil():
+    """Moduł PIL.Image, importowany przy pierwszym użyciu."""
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+        # Pillow rzuca DecompressionBombError powyżej 2x tego limitu; sami odrzucamy już powyżej 1x.
+        Image.MAX_IMAGE_PIXELS = NOTE_IMAGE_MAX_PIXELS
+        _pil_image = Image
+    return _pil_image
+
+
+def _acquire_pixels(pixels: int, timeout: float) -> int:
+    """Rezerwuje piksele z budżetu procesu. Zwraca zarezerwowaną liczbę lub 0 po timeoucie."""
+    global _pixels_in_use
+    # Pojedynczy obraz większy od budżetu (po draft) może wejść tylko sam.
+    pixels = min(pixels, NOTE_IMAGE_PIXEL_BUDGET)
+    with _pixel_budget_cond:
+        ok = _pixel_budget_cond.wait_for(
+            lambda: _pixels_in_use + pixels <= NOTE_IMAGE_PIXEL_BUDGET, timeout=timeout
+        )
+        if not ok:
+            return 0
+        _pixels_in_use += pixels
+        return pixels
+
+
+def _release_pixels(pixels: int) -> None:
+    global _pixels_in_use
+    with _pixel_budget_cond:
+        _pixels_in_use -= pixels
+        _pixel_budget_cond.notify_all()
+
+
+def _proc_status_kb(field: str) -> int:
+    """Pole VmRSS / VmHWM z /proc/self/status w KB (0, gdy nie ma /proc - np. macOS)."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class _MemoryProbe:
+    """
+    Szczyt pamięci jednego zdjęcia: przyrost RSS ponad stan z początku zadania.
+    exclusive - proces puli (jedno zadanie naraz): zerujemy licznik szczytu jądra
+    (/proc/self/clear_refs, VmHWM) i czytamy go na końcu - łapie też chwilowe bufory
+    enkodera. Inline (wątki requestów dzielą proces) tylko próbki VmRSS (sample()).
+    """
+    __slots__ = ("exclusive", "baseline", "peak")
+
+    def __init__(self, exclusive: bool):
+        if exclusive:
+            try:
+                with open("/proc/self/clear_refs", "w") as clear_refs:
+                    clear_refs.write("5")
+            except OSError:
+                exclusive = False
+        self.exclusive = exclusive
+        self.baseline = self.peak = _proc_status_kb("VmRSS")
+
+    def sample(self) -> None:
+        self.peak = max(self.peak, _proc_status_kb("VmRSS"))
+
+    def peak_kb(self) -> int:
+        self.sample()
+        if self.exclusive:
+            self.peak = max(self.peak, _proc_status_kb("VmHWM"))
+        return max(0, self.peak - self.baseline)
+
+
+def _draft_reduced(image, max_dim: int) -> int:
+    """
+    JPEG: draft() przed load() - dekoder skaluje DCT (1/2, 1/4, 1/8), dopóki dłuższy bok
+    zostaje >= max_dim. Pudełko ma proporcje obrazu, bo draft() zmniejsza tylko wtedy,
+    gdy oba boki mieszczą się w żądanym rozmiarze (kwadrat max_dim x max_dim
+    blokowałby np. 4000x3000). Zwraca liczbę pikseli, które faktycznie zdekoduje load()
+    (image.size po draft) - wg niej rezerwujemy budżet.
+    """
+    if image.format == "JPEG":
+        longest = max(image.width, image.height)
+        if longest > max_dim:
+            image.draft(None, (math.ceil(image.width * max_dim / longest), math.ceil(image.height * max_dim / longest)))
+    return image.width * image.height
+
+
+def _decode_reduced(image, max_dim: int):
+    """
+    Dekoduje obraz (po _draft_reduced) i zmniejsza formaty bez draft() przez reduce()
+    całkowitym współczynnikiem tak, by do LANCZOS zostało najwyżej ~2x docelowego rozmiaru.
+    Zwraca (obraz, szacowany rozmiar bufora dekodera w bajtach).
+    """
+    image.load()
+    # Szacunek szczytowego bufora dekodera: szerokość x wysokość x liczba kanałów
+    decode_bytes = image.width * image.height * len(image.getbands())
+    factor = max(image.width, image.height) // (max_dim * 2)
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image, decode_bytes
+
+
+def _encode_variant(image, max_dim: int) -> dict:
+    variant = image.copy()
+    variant.thumbnail((max_dim, max_dim), _pil().Resampling.LANCZOS)
+    out = io.BytesIO()
+    variant.save(out, format='WEBP', quality=80, method=4)
+    data = out.getvalue()
+    return {
+        "bytes": data,
+        "width": variant.width,
+        "height": variant.height,
+        "size_bytes": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def normalize_image_bytes(raw: bytes, exclusive_process: bool = False):
+    """
+    Dekoduje obraz, zmniejsza do MAX_IMAGE_DIM i koduje jako WebP
+    (plus mniejsze warianty z IMAGE_VARIANT_SIZES).
+    Uruchamiane w procesie puli - zwraca (wynik, błąd, status HTTP) jak reszta API.
+    exclusive_process - proces wykonuje tylko to zadanie (pula), patrz _MemoryProbe.
+    """
+    started = time.perf_counter()
+    probe = _MemoryProbe(exclusive_process)
+    Image = _pil()
+    try:
+        # Ostrzeżenie Pillow (1x-2x limitu) zastępuje nasz własny, twardy limit poniżej
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            image = Image.open(io.BytesIO(raw))
+    except Image.UnidentifiedImageError:
+        return None, "Nie udalo sie odczytac obrazu", 400
+    except Image.DecompressionBombError:
+        return None, "Obraz ma zbyt wiele pikseli", 413
+    except Exception as e:
+        return None, f"Uszkodzony obraz: {e}", 400
+
+    if image.width * image.height > NOTE_IMAGE_MAX_PIXELS:
+        return None, "Obraz ma zbyt wiele pikseli", 413
+
+    # Rezerwujemy budżet wg rozmiaru po draft (dla JPEG) - to jest faktycznie dekodowany bufor.
+    decode_pixels = _draft_reduced(image, MAX_IMAGE_DIM)
+    reserved = _acquire_pixels(decode_pixels, NOTE_IMAGE_TIMEOUT_SECONDS)
+    if not reserved:
+        return None, "Serwer przetwarza zbyt wiele zdjec, sprobuj ponownie", 503
+    try:
+        try:
+            image, decode_bytes = _decode_reduced(image, MAX_IMAGE_DIM)
+        except Image.DecompressionBombError:
+            return None, "Obraz ma zbyt wiele pikseli", 413
+        except Exception as e:
+            return None, f"Uszkodzony obraz: {e}", 400
+        probe.sample()
+        return _encode_normalized(image, started, decode_bytes, probe)
+    finally:
+        _release_pixels(reserved)
+
+
+def _encode_normalized(image, started: float, decode_bytes: int, probe: _MemoryProbe):
+    """Koduje zdekodowany (już zmniejszony) obraz i jego warianty jako WebP."""
+    Image = _pil()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    image.thumbnail((MAX_IMAGE_DIM, MAX_IMAGE_DIM), Image.Resampling.LANCZOS)
+    if image.mode == "RGBA":
+        bg = Image.new("RGB", image.size, (255, 255, 255))
+        bg.paste(image, mask=image.split()[3])
+        image = bg
+
+    out = io.BytesIO()
+    image.save(out, format='WEBP', quality=82, method=6)
+    webp_bytes = out.getvalue()
+    sha256_hex = hashlib.sha256(webp_bytes).hexdigest()
+
+    # Warianty tylko gdy są faktycznie mniejsze od pełnego obrazu.
+    variants = {}
+    for name, max_dim in IMAGE_VARIANT_SIZES.items():
+        if max(image.width, image.height) > max_dim:
+            variants[name] = _encode_variant(image, max_dim)
+
+    return {
+        "bytes": webp_bytes,
+        "mime_type": "image/webp",
+        "width": image.width,
+        "height": image.height,
+        "size_bytes": len(webp_bytes),
+        "sha256": sha256_hex,
+        "variants": variants,
+        "encode_ms": (time.perf_counter() - started) * 1000.0,
+        "decode_bytes": decode_bytes,
+        # Przyrost RSS w trakcie tego zdjęcia (nie szczyt całego procesu)
+        "rss_peak_kb": probe.peak_kb(),
+    }, None, 200
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=NOTE_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context(NOTE_IMAGE_MP_START),
+            )
+        return _executor
+
+
+def _reset_executor(broken) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    try:
+        broken.shutdown(wait=False, cancel_futures=True)
+    except Exception:
+        pass
+
+
+def _reset_after_fork() -> None:
+    """Nowy proces po fork (worker): pula procesów, blokady i statystyki rodzica nie są jego."""
+    global _executor, _executor_lock, _slots, _stats_lock, _pixel_budget_cond, _pixels_in_use
+    # Procesy puli należą do rodzica - nie zamykamy jej, tylko zapominamy
+    _executor = None
+    _executor_lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(max(1, NOTE_IMAGE_WORKERS) + max(0, NOTE_IMAGE_QUEUE_LIMIT))
+    _stats_lock = threading.Lock()
+    for name in _stats:
+        _stats[name] = 0
+    _pixel_budget_cond = threading.Condition()
+    _pixels_in_use = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _record_encode(encode_ms: float, decode_bytes: int = 0, rss_peak_kb: int = 0) -> None:
+    with _stats_lock:
+        _stats["encode_count"] += 1
+        _stats["encode_ms_total"] += encode_ms
+        if encode_ms > _stats["encode_ms_max"]:
+            _stats["encode_ms_max"] = encode_ms
+        _stats["decode_bytes_last"] = decode_bytes
+        if decode_bytes > _stats["decode_bytes_max"]:
+            _stats["decode_bytes_max"] = decode_bytes
+        _stats["rss_peak_kb_last"] = rss_peak_kb
+        if rss_peak_kb > _stats["rss_peak_kb_max"]:
+            _stats["rss_peak_kb_max"] = rss_peak_kb
+
+
+def _release_slot(slots) -> None:
+    with _stats_lock:
+        _stats["queue_depth"] -= 1
+    slots.release()
+
+
+def normalize_image(raw: bytes):
+    """
+    Normalizuje obraz w puli procesów i czeka na wynik.
+    Zwraca (wynik, błąd, status HTTP); przy pełnej kolejce status 503.
+    Slot kolejki zwalnia dopiero zakończenie zadania - po timeoucie requestu zadanie,
+    które już ruszyło, dalej zajmuje proces puli i musi się liczyć do limitu.
+    """
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["queue_rejected"] += 1
+        return None, "Serwer przetwarza zbyt wiele zdjec, sprobuj ponownie", 503
+
+    with _stats_lock:
+        _stats["queue_depth"] += 1
+        if _stats["queue_depth"] > _stats["queue_depth_max"]:
+            _stats["queue_depth_max"] = _stats["queue_depth"]
+    if NOTE_IMAGE_WORKERS <= 0:
+        try:
+            result = normalize_image_bytes(raw)
+        finally:
+            _release_slot(slots)
+    else:
+        executor = _get_executor()
+        try:
+            future = executor.submit(normalize_image_bytes, raw, True)
+        except BrokenProcessPool:
+            _release_slot(slots)
+            _reset_executor(executor)
+            return None, "Blad puli przetwarzania obrazow", 503
+        except BaseException:
+            _release_slot(slots)
+            raise
+        future.add_done_callback(lambda _future: _release_slot(slots))
+        try:
+            result = future.result(timeout=NOTE_IMAGE_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            # cancel() działa tylko dla zadania jeszcze w kolejce; uruchomione zwolni slot po zakończeniu
+            future.cancel()
+            return None, "Przekroczono czas przetwarzania obrazu", 503
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            return None, "Blad puli przetwarzania obrazow", 503
+
+    normalized, _err, status_code = result
+    if normalized is not None:
+        _record_encode(
+            normalized.pop("encode_ms", 0.0),
+            normalized.pop("decode_bytes", 0),
+            normalized.pop("rss_peak_kb", 0),
+        )
+    elif status_code == 413:
+        with _stats_lock:
+            _stats["decode_rejected"] += 1
+    return result
+
+
+def get_stats() -> dict:
+    """Zwraca metryki kolejki i czasu kodowania (dla /api/note-images/metrics)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["workers"] = NOTE_IMAGE_WORKERS
+    stats["queue_limit"] = NOTE_IMAGE_QUEUE_LIMIT
+    stats["max_pixels"] = NOTE_IMAGE_MAX_PIXELS
+    stats["pixel_budget"] = NOTE_IMAGE_PIXEL_BUDGET
+    stats["encode_ms_avg"] = (stats["encode_ms_total"] / stats["encode_count"]) if stats["encode_count"] else 0.0
+    return stats
@@ -0,0 +1,122 @@
+"""
+Dostawca JSON dla Flask (app.json): szybki enkoder, strumieniowanie dużych list.
+
+- Enkoder: orjson, gdy jest zainstalowany (pip install orjson), inaczej json ze stdlib
+  (jak domyślny DefaultJSONProvider). JSON_ENCODER=stdlib wymusza stdlib.
+  Wynik jest równoważny: klucze sortowane (sort_keys Flaska), daty przez default()
+  Flaska (format HTTP), liczby spoza 64 bitów i inne typy nieobsługiwane przez orjson
+  -> stdlib. Różnica: orjson nie escapuje znaków spoza ASCII (UTF-8 jak Content-Type).
+- Strumieniowanie: odpowiedź jsonify z listą >= JSON_STREAM_MIN_ITEMS elementów
+  (na najwyższym poziomie albo jako wartość słownika najwyższego poziomu, np.
+  {"data": [...], "meta": {...}}) jest wysyłana partiami po JSON_STREAM_CHUNK_ITEMS
+  elementów - bez budowania całego dokumentu w pamięci. Bez Content-Length.
+- Tryb debug z wcięciami (JSONIFY_PRETTYPRINT) - zawsze stdlib, bez strumieniowania.
+
+Konfiguracja (zmienne środowiskowe):
+- JSON_ENCODER              - auto (domyślnie) | orjson | stdlib
+- JSON_STREAM_MIN_ITEMS     - od ilu elementów listy strumieniować (0 = nigdy)
+- JSON_STREAM_CHUNK_ITEMS   - elementów na jedną partię
+"""
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # opcjonalne - bez orjson enkoder ze stdlib
+    orjson = None
+
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto').lower()
+JSON_STREAM_MIN_ITEMS = int(os.environ.get('JSON_STREAM_MIN_ITEMS', '2000'))
+JSON_STREAM_CHUNK_ITEMS = int(os.environ.get('JSON_STREAM_CHUNK_ITEMS', '500'))
+
+
+def _use_orjson() -> bool:
+    if JSON_ENCODER == 'stdlib':
+        return False
+    if JSON_ENCODER == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_ENCODER=orjson, ale biblioteka orjson nie jest zainstalowana (pip install orjson)")
+    return orjson is not None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider z enkoderem orjson i strumieniowaniem dużych list w response()."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.encoder_name = "orjson" if _use_orjson() else "stdlib"
+        self._orjson_options = 0
+        if self.encoder_name == "orjson":
+            # Daty przez default() Flaska (format HTTP jak dotychczas), klucze nie-str jak w stdlib
+            self._orjson_options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                self._orjson_options |= orjson.OPT_SORT_KEYS
+
+    def _encode_fast(self, obj) -> str:
+        """Kompaktowy JSON; orjson z powrotem do stdlib dla typów, których nie obsługuje."""
+        if self.encoder_name == "orjson":
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._orjson_options).decode("utf-8")
+            except (orjson.JSONEncodeError, TypeError):
+                pass
+        return json.dumps(obj, default=self.default, ensure_ascii=self.ensure_ascii,
+                          sort_keys=self.sort_keys, separators=(",", ":"))
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Wywołania z własnymi opcjami (indent, cls, ...) - zachowanie stdlib bez zmian
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode_fast(obj)
+
+    def _iter_list(self, items: list):
+        yield "["
+        step = max(1, JSON_STREAM_CHUNK_ITEMS)
+        for start in range(0, len(items), step):
+            chunk = self._encode_fast(items[start:start + step])
+            yield ("," if start else "") + chunk[1:-1]
+        yield "]"
+
+    def _iter_encode(self, obj):
+        """Dokument w partiach: duże listy (także wartości słownika najwyższego poziomu) po kawałku."""
+        if isinstance(obj, list):
+            yield from self._iter_list(obj)
+            return
+        keys = sorted(obj) if self.sort_keys else list(obj)
+        yield "{"
+        for index, key in enumerate(keys):
+            value = obj[key]
+            yield ("," if index else "") + self._encode_fast(str(key)) + ":"
+            if isinstance(value, list) and len(value) >= JSON_STREAM_MIN_ITEMS:
+                yield from self._iter_list(value)
+            else:
+                yield self._encode_fast(value)
+        yield "}"
+
+    def _should_stream(self, obj) -> bool:
+        if JSON_STREAM_MIN_ITEMS <= 0:
+            return False
+        if isinstance(obj, list):
+            return len(obj) >= JSON_STREAM_MIN_ITEMS
+        if isinstance(obj, dict) and all(isinstance(key, str) for key in obj):
+            return any(isinstance(value, list) and len(value) >= JSON_STREAM_MIN_ITEMS for value in obj.values())
+        return False
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        if pretty:
+            return super().response(obj)
+        if not self._should_stream(obj):
+            return self._app.response_class(f"{self._encode_fast(obj)}\n", mimetype=self.mimetype)
+        return self._app.response_class(self._iter_document(obj), mimetype=self.mimetype)
+
+    def _iter_document(self, obj):
+        yield from self._iter_encode(obj)
+        yield "\n"
+
+
+def install(app) -> FastJSONProvider:
+    """Podpina dostawcę do aplikacji (app.json) - jsonify i request.get_json używają go od razu."""
+    app.json = FastJSONProvider(app)
+    return app.json
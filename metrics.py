@@ -0,0 +1,496 @@
+"""
+Metryki aplikacji w formacie Prometheus (tekst), zbierane z wielu procesów.
+
+- Liczniki (counter), histogramy i wskaźniki (gauge) z etykietami, w pamięci procesu.
+- Przy wielu workerach (gunicorn) każdy proces co METRICS_FLUSH_SECONDS zapisuje swój
+  stan do METRICS_DIR/metrics_<pid>_<start>.json. /metrics sumuje pliki wszystkich
+  procesów; stan zakończonych procesów jest dopisywany do metrics_archive.json,
+  więc liczniki nie maleją po restarcie workera. Wskaźniki (gauge) liczymy tylko
+  z żyjących procesów.
+- Bez METRICS_DIR eksportujemy wyłącznie bieżący proces (tryb deweloperski).
+- TimedConnection / TimedCursor mierzą czas zapytań SQLite: łącznie (sqlite_query_seconds)
+  oraz per request (contextvar ustawiany w before_request). Czas jawnego BEGIN IMMEDIATE /
+  EXCLUSIVE to oczekiwanie na blokadę zapisu (sqlite_lock_wait_seconds).
+
+Konfiguracja (zmienne środowiskowe):
+- METRICS_DIR            - katalog plików procesów (wspólny dla workerów jednej instancji)
+- METRICS_FLUSH_SECONDS  - jak często proces zapisuje swój stan
+"""
+import atexit
+import collections
+import contextvars
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows - bez blokady pliku (tryb jednego procesu)
+    fcntl = None
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+RATIO_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0)
+
+_lock = threading.Lock()
+_definitions: dict = {}   # nazwa -> {"kind", "help", "labels", "buckets"}
+_values: dict = {}        # nazwa -> {krotka wartości etykiet -> liczba | [kubełki, suma, liczba]}
+# Połączenia zamknięte przez GC (TimedConnection.__del__): finalizer może ruszyć w wątku,
+# który trzyma już _lock, więc tylko dopisuje do kolejki (deque.append bez blokady),
+# a zmniejszenie sqlite_connections_open robi następne inc / odczyt pod _lock.
+_gc_closed = collections.deque()
+_pid = os.getpid()
+_started = int(time.time())
+_last_flush = 0.0
+
+
+def _define(name: str, kind: str, help_text: str, labels: tuple = (), buckets: tuple = None) -> None:
+    with _lock:
+        if name not in _definitions:
+            _definitions[name] = {"kind": kind, "help": help_text, "labels": list(labels), "buckets": list(buckets or ())}
+            _values[name] = {}
+
+
+def counter(name: str, help_text: str, labels: tuple = ()) -> None:
+    _define(name, "counter", help_text, labels)
+
+
+def gauge(name: str, help_text: str, labels: tuple = ()) -> None:
+    _define(name, "gauge", help_text, labels)
+
+
+def histogram(name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+    _define(name, "histogram", help_text, labels, buckets)
+
+
+def _apply_gc_closed() -> None:
+    """Dolicza zamknięcia z finalizerów (wywoływać pod _lock)."""
+    closed = 0
+    while _gc_closed:
+        _gc_closed.popleft()
+        closed += 1
+    if closed:
+        series = _values["sqlite_connections_open"]
+        series[()] = series.get((), 0.0) - closed
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    """Zwiększa licznik (lub gauge - także o wartość ujemną)."""
+    key = tuple(str(labels.get(label, "")) for label in _definitions[name]["labels"])
+    with _lock:
+        if _gc_closed:
+            _apply_gc_closed()
+        series = _values[name]
+        series[key] = series.get(key, 0.0) + amount
+
+
+def set_value(name: str, value: float, **labels) -> None:
+    key = tuple(str(labels.get(label, "")) for label in _definitions[name]["labels"])
+    with _lock:
+        _values[name][key] = float(value)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    definition = _definitions[name]
+    key = tuple(str(labels.get(label, "")) for label in definition["labels"])
+    buckets = definition["buckets"]
+    with _lock:
+        series = _values[name].get(key)
+        if series is None:
+            series = _values[name][key] = [[0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+
+def get_value(name: str, **labels) -> float:
+    """Wartość serii w bieżącym procesie (dla endpointów JSON)."""
+    key = tuple(str(labels.get(label, "")) for label in _definitions[name]["labels"])
+    with _lock:
+        _apply_gc_closed()
+        return _values[name].get(key, 0.0)
+
+
+# ========================
+# ZAPYTANIA SQLITE
+# ========================
+
+# [sekundy SQL, liczba zapytań, sekundy oczekiwania na blokadę] bieżącego requestu (None poza requestem)
+_request_sql = contextvars.ContextVar("request_sql", default=None)
+
+
+def begin_request_sql() -> None:
+    _request_sql.set([0.0, 0, 0.0])
+
+
+def request_sql_stats():
+    """(sekundy, liczba zapytań) SQLite w bieżącym requeście."""
+    stats = _request_sql.get()
+    return (stats[0], stats[1]) if stats else (0.0, 0)
+
+
+def request_lock_wait_seconds() -> float:
+    """Czas oczekiwania na blokadę zapisu (BEGIN IMMEDIATE) w bieżącym requeście."""
+    stats = _request_sql.get()
+    return stats[2] if stats else 0.0
+
+
+def _is_write_lock(sql) -> bool:
+    head = sql.lstrip()[:15].upper() if isinstance(sql, str) else ""
+    return head.startswith("BEGIN IMMEDIATE") or head.startswith("BEGIN EXCLUSIVE")
+
+
+def _record_sql(elapsed: float, sql=None) -> None:
+    stats = _request_sql.get()
+    lock_wait = sql is not None and _is_write_lock(sql)
+    if stats is not None:
+        stats[0] += elapsed
+        stats[1] += 1
+        if lock_wait:
+            stats[2] += elapsed
+    observe("sqlite_query_seconds", elapsed)
+    if lock_wait:
+        observe("sqlite_lock_wait_seconds", elapsed)
+
+
+def _finish_traced(conn, keep_open_for_rows: bool = False, cursor=None) -> None:
+    """Zamyka instrukcję w sql_trace (jeśli włączony). SELECT zostaje otwarty do fetchall."""
+    tracer = getattr(conn, "sql_tracer", None)
+    if tracer is not None and not (keep_open_for_rows and cursor.description is not None):
+        tracer.finish()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Kursor mierzący czas execute/fetch (łącznie z krokiem VM SQLite)."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(time.perf_counter() - started, sql)
+            _finish_traced(self.connection, True, self)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(time.perf_counter() - started)
+            _finish_traced(self.connection)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_sql(time.perf_counter() - started)
+            _finish_traced(self.connection)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            stats = _request_sql.get()
+            if stats is not None:
+                stats[0] += time.perf_counter() - started
+            _finish_traced(self.connection)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Połączenie liczące otwarcia/zamknięcia i tworzące TimedCursor."""
+
+    # StatementTracer z sql_trace.py (SQL_TRACE=1)
+    sql_tracer = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_open = True
+        inc("sqlite_connections_opened_total")
+        inc("sqlite_connections_open")
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            _finish_traced(self)
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            _finish_traced(self)
+
+    def _mark_closed(self) -> None:
+        if getattr(self, "_metrics_open", False):
+            self._metrics_open = False
+            inc("sqlite_connections_open", -1)
+
+    def close(self):
+        self._mark_closed()
+        _finish_traced(self)
+        super().close()
+
+    def __del__(self):
+        # Połączenie zamknięte przez GC (bez close()) - bez _lock, patrz _gc_closed
+        if getattr(self, "_metrics_open", False):
+            self._metrics_open = False
+            _gc_closed.append(1)
+
+
+# ========================
+# AGREGACJA I EKSPORT
+# ========================
+
+def _snapshot() -> dict:
+    with _lock:
+        _apply_gc_closed()
+        return {
+            "pid": _pid,
+            "metrics": {
+                name: {
+                    **_definitions[name],
+                    "values": [
+                        [list(key), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                        for key, value in _values[name].items()
+                    ],
+                }
+                for name in _definitions
+            },
+        }
+
+
+def _process_file() -> Path:
+    return Path(METRICS_DIR) / f"metrics_{_pid}_{_started}.json"
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush() -> None:
+    """Zapisuje stan procesu do METRICS_DIR (no-op bez METRICS_DIR)."""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    Path(METRICS_DIR).mkdir(parents=True, exist_ok=True)
+    _write_json(_process_file(), _snapshot())
+    _last_flush = time.monotonic()
+
+
+def maybe_flush() -> None:
+    if METRICS_DIR and time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def reset_after_fork() -> None:
+    """Nowy proces po fork: własny pid i pusty stan (liczniki rodzica zostają w jego pliku)."""
+    global _pid, _started, _last_flush, _lock
+    _pid = os.getpid()
+    _started = int(time.time())
+    _last_flush = 0.0
+    # Blokada mogła być zajęta przez inny wątek rodzica w chwili fork
+    _lock = threading.Lock()
+    _gc_closed.clear()
+    for name in _values:
+        _values[name] = {}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(target: dict, snapshot: dict, include_gauges: bool = True) -> None:
+    for name, metric in snapshot.get("metrics", {}).items():
+        if metric["kind"] == "gauge" and not include_gauges:
+            continue
+        definition = _definitions.get(name)
+        if definition is not None and metric.get("labels") != definition["labels"]:
+            continue  # plik/archiwum sprzed zmiany etykiet metryki - serie nie pasują do definicji
+        entry = target.setdefault(name, {**{k: v for k, v in metric.items() if k != "values"}, "series": {}})
+        series = entry["series"]
+        for labels, value in metric["values"]:
+            key = tuple(labels)
+            if metric["kind"] == "histogram":
+                current = series.get(key)
+                if current is None or len(current[0]) != len(value[0]):
+                    series[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+            else:
+                series[key] = series.get(key, 0.0) + value
+
+
+def _load(path: Path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _compact_dead_processes(metrics_dir: Path) -> None:
+    """Przenosi liczniki/histogramy zakończonych procesów do metrics_archive.json."""
+    if fcntl is None:
+        return
+    with open(metrics_dir / ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        dead = []
+        for path in metrics_dir.glob("metrics_*_*.json"):
+            pid = int(path.name.split("_")[1])
+            if pid != _pid and not _pid_alive(pid):
+                dead.append(path)
+        if not dead:
+            return
+        archive_path = metrics_dir / "metrics_archive.json"
+        merged: dict = {}
+        archive = _load(archive_path)
+        if archive:
+            _merge(merged, archive, include_gauges=False)
+        for path in dead:
+            data = _load(path)
+            if data:
+                _merge(merged, data, include_gauges=False)
+        _write_json(archive_path, {
+            "pid": 0,
+            "metrics": {
+                name: {**{k: v for k, v in m.items() if k != "series"},
+                       "values": [[list(key), value] for key, value in m["series"].items()]}
+                for name, m in merged.items()
+            },
+        })
+        for path in dead:
+            path.unlink(missing_ok=True)
+
+
+def collect() -> dict:
+    """Zagregowany stan wszystkich procesów: nazwa -> definicja + "series"."""
+    merged: dict = {}
+    if METRICS_DIR:
+        metrics_dir = Path(METRICS_DIR)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            _compact_dead_processes(metrics_dir)
+        except OSError:
+            pass
+        archive = _load(metrics_dir / "metrics_archive.json")
+        if archive:
+            _merge(merged, archive, include_gauges=False)
+        own = _process_file().name
+        for path in metrics_dir.glob("metrics_*_*.json"):
+            if path.name == own:
+                continue
+            data = _load(path)
+            if data:
+                _merge(merged, data, include_gauges=_pid_alive(int(data.get("pid", 0))))
+    # Bieżący proces - zawsze stan na żywo
+    _merge(merged, _snapshot())
+    return merged
+
+
+def aggregated_series(name: str) -> dict:
+    """Wartości serii metryki zsumowane ze wszystkich procesów: krotka etykiet -> wartość."""
+    return collect().get(name, {}).get("series", {})
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """Eksport w formacie tekstowym Prometheus (text/plain; version=0.0.4)."""
+    lines = []
+    for name, metric in sorted(collect().items()):
+        labels = metric["labels"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric["series"].items()):
+            if metric["kind"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value[0]):
+                    cumulative += count
+                    le = 'le="%s"' % _format_number(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_format_labels(labels, key, le)} {value[2]}")
+                lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_number(value[1])}")
+                lines.append(f"{name}_count{_format_labels(labels, key)} {value[2]}")
+            else:
+                lines.append(f"{name}{_format_labels(labels, key)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ========================
+# DEFINICJE METRYK
+# ========================
+
+counter("http_requests_total", "Liczba requestow HTTP", ("method", "route", "status"))
+histogram("http_request_duration_seconds", "Czas obslugi requestu", ("method", "route", "status"))
+histogram("http_response_size_bytes", "Rozmiar odpowiedzi", ("method", "route", "status"), SIZE_BUCKETS)
+histogram("http_compression_ratio", "Rozmiar odpowiedzi po kompresji / przed", ("encoding",), RATIO_BUCKETS)
+counter("http_compression_input_bytes_total", "Bajty odpowiedzi przed kompresja", ("encoding",))
+counter("http_compression_output_bytes_total", "Bajty odpowiedzi po kompresji", ("encoding",))
+histogram("http_request_sql_seconds", "Czas zapytan SQLite w jednym requescie", ("route",))
+counter("http_request_sql_queries_total", "Liczba zapytan SQLite wg endpointu", ("route",))
+histogram("sqlite_query_seconds", "Czas pojedynczego zapytania SQLite")
+histogram("sqlite_lock_wait_seconds", "Oczekiwanie na blokade zapisu SQLite (BEGIN IMMEDIATE)")
+counter("sqlite_connections_opened_total", "Otwarte polaczenia SQLite (lacznie)")
+gauge("sqlite_connections_open", "Aktualnie otwarte polaczenia SQLite")
+counter("envelope_transitions_total", "Zmiany stanu kopert wg operacji", ("operation",))
+counter("envelope_errors_total", "Odrzucone operacje na kopertach wg kodu bledu", ("error_code",))
+counter("note_image_events_total", "Zdarzenia uploadu/edycji zdjec notatek", ("event",))
+
+atexit.register(lambda: METRICS_DIR and flush())
+os.register_at_fork(after_in_child=reset_after_fork)
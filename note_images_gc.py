@@ -0,0 +1,209 @@
+"""
+Porządkowanie zdjęć notatek (GC) i liczniki zajętości dysku.
+
+Dwa przebiegi, oba przyrostowe i ograniczone partią:
+1. Zdjęcia usuniętych notatek - soft delete notatki (operator_notes / product_machine_notes)
+   zostawia aktywne wiersze note_images i pliki. Przechodzimy po usuniętych notatkach
+   wg watermarku (modified_at, id) i zwalniamy ich zdjęcia (licznik referencji plików).
+2. Osierocone pliki w NOTE_IMAGES_DIR - pliki bez aktywnej referencji w bazie (np. po
+   nieudanym uploadzie, pliki .tmp). Skan idzie w kolejności ścieżek od zapamiętanego
+   miejsca; po dojściu do końca zaczyna od początku.
+
+Obie operacje pomijają wszystko, co jest młodsze niż okres karencji (upload w toku,
+notatka przywrócona chwilę po usunięciu).
+
+Zajętość dysku (per katalog YYYY/MM i per zakres notatek) jest aktualizowana
+w transakcjach zapisu/usunięcia zdjęć - tutaj tylko ją odczytujemy lub przeliczamy.
+
+Konfiguracja (zmienne środowiskowe):
+- NOTE_IMAGES_DIR                - katalog zdjęć (jak w api_server.py)
+- NOTE_IMAGES_GC_GRACE_SECONDS   - okres karencji (domyślnie 1 h)
+- NOTE_IMAGES_GC_BATCH           - maks. liczba notatek / plików w jednym przebiegu
+
+Uruchomienie:
+    python note_images_gc.py [--dry-run] [--batch N] [--grace-seconds S] [--rebuild-usage]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from database import db as default_db
+
+NOTE_IMAGES_DIR = Path(os.environ.get('NOTE_IMAGES_DIR', './data/note_images'))
+NOTE_IMAGES_GC_GRACE_SECONDS = int(os.environ.get('NOTE_IMAGES_GC_GRACE_SECONDS', '3600'))
+NOTE_IMAGES_GC_BATCH = int(os.environ.get('NOTE_IMAGES_GC_BATCH', '500'))
+NOTE_SCOPES = ("operator_note", "product_machine_note")
+
+# Jeden przebieg naraz w procesie (endpoint admina + ewentualny wątek harmonogramu)
+_gc_lock = threading.Lock()
+
+
+def _notes_watermark_key(note_scope: str) -> str:
+    return f"note_images_gc:notes:{note_scope}"
+
+
+FILES_WATERMARK_KEY = "note_images_gc:files"
+USAGE_INITIALIZED_KEY = "note_images_gc:usage_initialized"
+
+
+def _remove_files(images_dir: Path, rel_paths: list) -> int:
+    removed = 0
+    for rel_path in rel_paths:
+        try:
+            (images_dir / rel_path).unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def collect_inactive_note_images(database, images_dir: Path, batch_size: int, grace_seconds: int, dry_run: bool = False) -> dict:
+    """Zwalnia zdjęcia usuniętych notatek (kolejna partia po watermarku)."""
+    stats = {"notes_scanned": 0, "images_released": 0, "files_removed": 0, "notes": []}
+    for note_scope in NOTE_SCOPES:
+        raw = database.get_maintenance_state(_notes_watermark_key(note_scope))
+        watermark = json.loads(raw) if raw else {"modified_at": "", "id": 0}
+        notes = database.get_inactive_notes_after(
+            note_scope, watermark["modified_at"], watermark["id"], grace_seconds, batch_size
+        )
+        for note in notes:
+            stats["notes_scanned"] += 1
+            if dry_run:
+                continue
+            result = database.release_images_of_inactive_note(note_scope, note["id"])
+            if not result.get("success"):
+                # Watermark zostaje przed tą notatką - ponowimy przy następnym przebiegu
+                stats["error"] = result.get("error")
+                break
+            if result["released_images"]:
+                stats["images_released"] += result["released_images"]
+                stats["notes"].append({"note_scope": note_scope, "note_id": note["id"]})
+            stats["files_removed"] += _remove_files(images_dir, result["released_paths"])
+            watermark = {"modified_at": note["modified_at"], "id": note["id"]}
+            database.set_maintenance_state(_notes_watermark_key(note_scope), json.dumps(watermark))
+    return stats
+
+
+def _iter_files(root: Path, after: str, rel_dir: str = ""):
+    """
+    Pliki pod root w kolejności ścieżek względnych (jak porównanie stringów), od ścieżki > after.
+    Katalogi w całości przed watermarkiem są pomijane bez listowania.
+    """
+    try:
+        entries = list(os.scandir(root / rel_dir if rel_dir else root))
+    except FileNotFoundError:
+        return
+    # Klucz "nazwa/" dla katalogów - kolejność DFS zgodna z porównaniem pełnych ścieżek
+    entries.sort(key=lambda e: e.name + "/" if e.is_dir(follow_symlinks=False) else e.name)
+    for entry in entries:
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            prefix = rel_path + "/"
+            if after > prefix and not after.startswith(prefix):
+                continue
+            yield from _iter_files(root, after, rel_path)
+        elif entry.is_file(follow_symlinks=False) and rel_path > after:
+            yield rel_path, entry
+
+
+def collect_stray_files(database, images_dir: Path, batch_size: int, grace_seconds: int, dry_run: bool = False) -> dict:
+    """Usuwa pliki bez referencji w bazie (kolejna partia po watermarku ścieżki)."""
+    stats = {"files_scanned": 0, "stray_files": 0, "stray_bytes": 0, "files_removed": 0, "wrapped": False}
+    after = database.get_maintenance_state(FILES_WATERMARK_KEY) or ""
+    cutoff = time.time() - grace_seconds
+    referenced_by_dir: dict = {}
+    last_path = after
+
+    for rel_path, entry in _iter_files(images_dir, after):
+        if stats["files_scanned"] >= batch_size:
+            break
+        stats["files_scanned"] += 1
+        last_path = rel_path
+        rel_dir = rel_path.rsplit("/", 1)[0] if "/" in rel_path else ""
+        if rel_dir not in referenced_by_dir:
+            referenced_by_dir[rel_dir] = database.get_referenced_image_paths(rel_dir) if rel_dir else set()
+        if rel_path in referenced_by_dir[rel_dir]:
+            continue
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if st.st_mtime > cutoff:
+            continue
+        stats["stray_files"] += 1
+        stats["stray_bytes"] += st.st_size
+        if not dry_run:
+            stats["files_removed"] += _remove_files(images_dir, [rel_path])
+    else:
+        # Doszliśmy do końca drzewa - następny przebieg od początku
+        last_path = ""
+        stats["wrapped"] = True
+
+    if not dry_run:
+        database.set_maintenance_state(FILES_WATERMARK_KEY, last_path)
+    return stats
+
+
+def run_gc(database=None, images_dir: Path = None, batch_size: int = None, grace_seconds: int = None, dry_run: bool = False) -> dict:
+    """
+    Jeden przebieg GC (zdjęcia usuniętych notatek + osierocone pliki).
+    Zwraca słownik jak reszta API; przy trwającym przebiegu status 409.
+    """
+    database = database or default_db
+    images_dir = Path(images_dir or NOTE_IMAGES_DIR)
+    batch_size = batch_size or NOTE_IMAGES_GC_BATCH
+    grace_seconds = NOTE_IMAGES_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+
+    if not _gc_lock.acquire(blocking=False):
+        return {"success": False, "error": "GC zdjec juz trwa", "status": 409}
+    try:
+        started = time.perf_counter()
+        # Pierwsze uruchomienie: liczniki zajętości z istniejących danych
+        if not dry_run and not database.get_maintenance_state(USAGE_INITIALIZED_KEY):
+            rebuilt = database.rebuild_storage_usage()
+            if rebuilt.get("success"):
+                database.set_maintenance_state(USAGE_INITIALIZED_KEY, "1")
+
+        notes = collect_inactive_note_images(database, images_dir, batch_size, grace_seconds, dry_run)
+        files = collect_stray_files(database, images_dir, batch_size, grace_seconds, dry_run)
+        return {
+            "success": True,
+            "dry_run": dry_run,
+            "notes": notes,
+            "files": files,
+            "usage": database.get_storage_usage(),
+            "duration_ms": (time.perf_counter() - started) * 1000.0,
+        }
+    finally:
+        _gc_lock.release()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="GC zdjęć notatek i liczniki zajętości dysku")
+    parser.add_argument("--dry-run", action="store_true", help="tylko raport, bez usuwania")
+    parser.add_argument("--batch", type=int, default=NOTE_IMAGES_GC_BATCH, help="maks. notatek / plików na przebieg")
+    parser.add_argument("--grace-seconds", type=int, default=NOTE_IMAGES_GC_GRACE_SECONDS)
+    parser.add_argument("--rebuild-usage", action="store_true", help="przelicz liczniki zajętości od zera")
+    parser.add_argument("--usage", action="store_true", help="tylko wypisz zajętość dysku")
+    args = parser.parse_args(argv)
+
+    if args.usage:
+        print(json.dumps(default_db.get_storage_usage(), indent=2))
+        return 0
+    if args.rebuild_usage:
+        result = default_db.rebuild_storage_usage()
+        if result.get("success"):
+            default_db.set_maintenance_state(USAGE_INITIALIZED_KEY, "1")
+        print(json.dumps(result, indent=2))
+        return 0 if result.get("success") else 1
+
+    result = run_gc(batch_size=args.batch, grace_seconds=args.grace_seconds, dry_run=args.dry_run)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if result.get("success") else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+"""
+Limiter zapytań (token bucket) z usuwaniem nieaktywnych kluczy.
+
+Każdy klucz (np. "user:jan", "ip:10.0.0.5") to stała para (tokeny, czas ostatniej
+aktualizacji) - O(1) pamięci niezależnie od limitu. Kubełek o pojemności max_requests
+napełnia się w tempie max_requests / window_seconds. Klucz, którego kubełek i tak
+byłby już pełny, nie niesie żadnej informacji i jest usuwany.
+
+Backendy (RATE_LIMIT_BACKEND):
+- memory  - OrderedDict w procesie (LRU + usuwanie pełnych kubełków); limit per proces
+- sqlite  - osobny plik SQLite (RATE_LIMIT_DB), wspólny dla wszystkich workerów na hoście
+            (domyślny w produkcji - gunicorn.conf.py)
+
+Konfiguracja (zmienne środowiskowe):
+- RATE_LIMIT_BACKEND       - memory / sqlite
+- RATE_LIMIT_DB            - plik bazy limitera (backend sqlite)
+- RATE_LIMIT_MAX_KEYS      - maks. liczba kluczy w pamięci (backend memory)
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', './data/rate_limit.db')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# Co ile sekund backend sqlite usuwa nieaktywne klucze
+RATE_LIMIT_SWEEP_SECONDS = 60
+
+
+def _take_token(tokens: float, updated_at: float, now: float, capacity: int, window_seconds: float):
+    """Dolewa tokeny za czas od ostatniej aktualizacji i próbuje pobrać jeden. Zwraca (limited, tokens)."""
+    rate = capacity / window_seconds
+    tokens = min(float(capacity), tokens + (now - updated_at) * rate)
+    if tokens < 1.0:
+        return True, tokens
+    return False, tokens - 1.0
+
+
+class MemoryRateLimiter:
+    """Kubełki w pamięci procesu; najdawniej używane klucze na początku OrderedDict."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_rate_limited(self, key: str, max_requests: int, window_seconds: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens, updated_at = float(max_requests), now
+            else:
+                tokens, updated_at = bucket[0], bucket[1]
+            limited, tokens = _take_token(tokens, updated_at, now, max_requests, window_seconds)
+            self._buckets[key] = [tokens, now, max_requests, window_seconds]
+            self._buckets.move_to_end(key)
+            self._evict(now)
+            return limited
+
+    def _evict(self, now: float) -> None:
+        # Na początku są klucze nieużywane najdłużej - zdejmujemy te, których kubełek już by się napełnił
+        while self._buckets:
+            key, (tokens, updated_at, capacity, window) = next(iter(self._buckets.items()))
+            full = tokens + (now - updated_at) * capacity / window >= capacity
+            if not full and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SqliteRateLimiter:
+    """Kubełki w osobnej bazie SQLite - wspólne dla wszystkich procesów na hoście."""
+
+    def __init__(self, db_path: str = RATE_LIMIT_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                full_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_full_at ON rate_limit_buckets(full_at)')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit - transakcje otwieramy jawnie (BEGIN IMMEDIATE)
+            conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Stan limitera nie musi przetrwać awarii zasilania
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def is_rate_limited(self, key: str, max_requests: int, window_seconds: int) -> bool:
+        # Czas ścienny - wspólny dla wszystkich procesów
+        now = time.time()
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?", (key,)
+            ).fetchone()
+            tokens, updated_at = (row[0], row[1]) if row else (float(max_requests), now)
+            limited, tokens = _take_token(tokens, updated_at, now, max_requests, window_seconds)
+            full_at = now + (max_requests - tokens) * window_seconds / max_requests
+            conn.execute(
+                '''
+                INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(bucket_key) DO UPDATE SET
+                    tokens = excluded.tokens, updated_at = excluded.updated_at, full_at = excluded.full_at
+                ''',
+                (key, tokens, now, full_at),
+            )
+            if now - self._last_sweep >= RATE_LIMIT_SWEEP_SECONDS:
+                self._last_sweep = now
+                conn.execute("DELETE FROM rate_limit_buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+            return limited
+        except sqlite3.Error as e:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            # Awaria limitera nie może blokować uploadów - przepuszczamy
+            print(f"⚠️ Rate limiter (sqlite) niedostępny: {e}")
+            return False
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            if RATE_LIMIT_BACKEND == 'sqlite':
+                _limiter = SqliteRateLimiter(RATE_LIMIT_DB)
+            else:
+                _limiter = MemoryRateLimiter(RATE_LIMIT_MAX_KEYS)
+        return _limiter
+
+
+def _reset_after_fork() -> None:
+    """Worker po fork tworzy własny limiter - połączenie SQLite rodzica nie może być współdzielone."""
+    global _limiter, _limiter_lock
+    _limiter = None
+    _limiter_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def is_rate_limited(key: str, max_requests: int, window_seconds: int) -> bool:
+    """True, jeśli klucz wyczerpał limit (max_requests na window_seconds)."""
+    return get_limiter().is_rate_limited(key, max_requests, window_seconds)
@@ -0,0 +1,218 @@
+"""
+Lekkie rekordy wierszy dla gorących ścieżek odczytu (listy kopert, historia, zdjęcia notatek).
+
+sqlite3.Row + ręczne przepisywanie pól do dict tworzy na każdy wiersz obiekt Row, dict
+i wywołania __getitem__ po nazwie. Tutaj:
+- kursor bez row_factory zwraca zwykłe krotki (tuple_cursor),
+- mapper JSON jest kompilowany raz przy imporcie z listy kolumn do funkcji
+  "krotka -> dict" (rozpakowanie krotki + literał dict, jak namedtuple/dataclasses),
+- typy rekordów mają __slots__ (bez __dict__) - do użycia w kodzie, który
+  potrzebuje atrybutów zamiast dict.
+
+Kolejność kolumn w SELECT musi odpowiadać COLUMNS rekordu (SELECT budujemy z select_list).
+"""
+import json
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+JsonMapper = Callable[[tuple], Dict[str, Any]]
+
+
+def tuple_cursor(conn):
+    """Kursor zwracający krotki (bez sqlite3.Row ustawionego w Database.get_connection)."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def compile_json_mapper(columns: Sequence[str], fields: Sequence[Tuple[str, str]],
+                        namespace: Optional[Dict[str, Any]] = None, name: str = "row_to_json") -> JsonMapper:
+    """
+    Kompiluje funkcję krotka -> dict.
+    fields: (klucz JSON, wyrażenie Pythona) - wyrażenie widzi kolumny jako zmienne lokalne
+    oraz funkcje z namespace (np. parsery JSON).
+    """
+    for column in columns:
+        if not column.isidentifier():
+            raise ValueError(f"Nieprawidłowa nazwa kolumny: {column!r}")
+    unpack = ", ".join(columns) + ("," if len(columns) == 1 else "")
+    items = ", ".join(f"{key!r}: {expression}" for key, expression in fields)
+    source = f"def {name}(row):\n    {unpack} = row\n    return {{{items}}}\n"
+    scope = dict(namespace or {})
+    exec(compile(source, f"<records.{name}>", "exec"), scope)
+    mapper = scope[name]
+    mapper.__source__ = source
+    return mapper
+
+
+def _loads_or(raw, default):
+    """json.loads z wartością domyślną dla NULL i uszkodzonego JSON-a."""
+    if not raw:
+        return default() if callable(default) else default
+    try:
+        return json.loads(raw)
+    except Exception:
+        return default() if callable(default) else default
+
+
+def _parse_variants(raw):
+    """Warianty rozdzielczości zdjęcia; stare wiersze (bez wariantów) -> {}."""
+    variants = _loads_or(raw, dict)
+    return variants if isinstance(variants, dict) else {}
+
+
+def _empty_annotations():
+    return {"objects": []}
+
+
+_NAMESPACE = {
+    "_loads_or": _loads_or,
+    "_parse_variants": _parse_variants,
+    "_empty_annotations": _empty_annotations,
+}
+
+
+class Record:
+    """Baza rekordów: __slots__ = COLUMNS, konstrukcja z krotki wiersza."""
+    __slots__ = ()
+    COLUMNS: Tuple[str, ...] = ()
+    to_json_row: JsonMapper = None   # krotka -> dict (bez tworzenia rekordu)
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Record":
+        record = cls.__new__(cls)
+        for column, value in zip(cls.COLUMNS, row):
+            setattr(record, column, value)
+        return record
+
+    @classmethod
+    def select_list(cls, alias: str = "", column_aliases: Optional[Dict[str, str]] = None) -> str:
+        """
+        Kolumny SELECT w kolejności COLUMNS. alias - tabela domyślna, column_aliases -
+        tabela dla wybranych kolumn (JOIN), np. {"company_name": "p"}.
+        """
+        column_aliases = column_aliases or {}
+        unknown = set(column_aliases) - set(cls.COLUMNS)
+        if unknown:
+            raise ValueError(f"{cls.__name__}: nieznane kolumny {sorted(unknown)}")
+        return ", ".join(
+            f"{column_aliases.get(column, alias)}.{column}" if column_aliases.get(column, alias) else column
+            for column in cls.COLUMNS
+        )
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, column) for column in self.COLUMNS)
+
+    def to_json(self) -> Dict[str, Any]:
+        return type(self).to_json_row(self.astuple())
+
+    def __repr__(self):
+        values = ", ".join(f"{column}={getattr(self, column, None)!r}" for column in self.COLUMNS)
+        return f"{type(self).__name__}({values})"
+
+
+def record_type(name: str, columns: Sequence[str], fields: Sequence[Tuple[str, str]]) -> type:
+    """Tworzy klasę rekordu ze slotami i skompilowanym mapperem JSON."""
+    columns = tuple(columns)
+    mapper = compile_json_mapper(columns, fields, _NAMESPACE, name=f"{name}_to_json")
+    return type(name, (Record,), {
+        "__slots__": columns,
+        "COLUMNS": columns,
+        "to_json_row": staticmethod(mapper),
+    })
+
+
+# ========================
+# KOPERTY (lista z paginacją)
+# ========================
+
+EnvelopeListRow = record_type(
+    "EnvelopeListRow",
+    ("unique_key", "rcs_id", "status", "current_holder_id", "current_holder_type", "warehouse_section",
+     "is_green", "last_operator_id", "product_id", "company_name", "product_name"),
+    (
+        ("id", "unique_key"),
+        ("rcs_id", "rcs_id"),
+        ("product", "f'{company_name} | {product_name}' if product_id and company_name else f'KOPERTA {rcs_id}'"),
+        ("company_name", "company_name"),
+        ("product_name", "product_name"),
+        ("status", "status"),
+        ("machine", "current_holder_id if current_holder_id else None"),
+        ("location", "warehouse_section if status == 'MAGAZYN' else None"),
+    ),
+)
+
+# ========================
+# HISTORIA (events)
+# ========================
+
+EventRow = record_type(
+    "EventRow",
+    ("id", "user_id", "from_status", "to_status", "from_holder", "to_holder", "timestamp", "comment"),
+    (
+        ("id", "id"),
+        ("user_id", "user_id"),
+        ("from_status", "from_status"),
+        ("to_status", "to_status"),
+        ("from_holder", "from_holder"),
+        ("to_holder", "to_holder"),
+        ("timestamp", "timestamp"),
+        ("comment", "comment"),
+    ),
+)
+
+# ========================
+# NOTATKI OPERATORA I ZDJĘCIA
+# ========================
+
+OperatorNoteRow = record_type(
+    "OperatorNoteRow",
+    ("id", "envelope_id", "machine_id", "note_kind", "note_data_json", "created_by", "created_at", "modified_at", "rcs_id"),
+    (
+        ("id", "id"),
+        ("envelope_id", "envelope_id"),
+        ("machine_id", "machine_id"),
+        ("note_kind", "note_kind"),
+        ("note_data", "_loads_or(note_data_json, dict)"),
+        ("created_by", "created_by"),
+        ("created_at", "created_at"),
+        ("modified_at", "modified_at"),
+        ("rcs_id", "rcs_id"),
+    ),
+)
+
+_NOTE_IMAGE_FIELDS = (
+    ("id", "id"),
+    ("note_scope", "note_scope"),
+    ("note_id", "note_id"),
+    ("storage_path", "storage_path"),
+    ("original_filename", "original_filename"),
+    ("mime_type", "mime_type"),
+    ("width", "width"),
+    ("height", "height"),
+    ("size_bytes", "size_bytes"),
+    ("sha256", "sha256"),
+    ("annotations_json", "_loads_or(annotations_json, _empty_annotations)"),
+    ("order_index", "order_index"),
+    ("revision", "revision"),
+    ("created_by", "created_by"),
+    ("modified_by", "modified_by"),
+    ("created_at", "created_at"),
+    ("modified_at", "modified_at"),
+)
+
+NoteImageRow = record_type(
+    "NoteImageRow",
+    ("id", "note_scope", "note_id", "storage_path", "original_filename", "mime_type", "width", "height",
+     "size_bytes", "sha256", "annotations_json", "order_index", "revision", "created_by", "modified_by",
+     "created_at", "modified_at", "is_active", "variants_json"),
+    _NOTE_IMAGE_FIELDS + (("is_active", "is_active"), ("variants", "_parse_variants(variants_json)")),
+)
+
+# Lista zdjęć notatki (tylko aktywne) - bez pola is_active, jak dotychczas
+NOTE_IMAGE_LIST_COLUMNS = tuple(column for column in NoteImageRow.COLUMNS if column != "is_active")
+note_image_list_to_json = compile_json_mapper(
+    NOTE_IMAGE_LIST_COLUMNS,
+    _NOTE_IMAGE_FIELDS + (("variants", "_parse_variants(variants_json)"),),
+    _NAMESPACE,
+    name="note_image_list_to_json",
+)
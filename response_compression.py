@@ -0,0 +1,158 @@
+"""
+Kompresja odpowiedzi API w locie (after_request): JSON i tekst powyżej progu.
+
+- Kodowanie wg Accept-Encoding: br (gdy jest biblioteka brotli) > gzip > deflate.
+- Pomijane: odpowiedzi już zakodowane (np. static_assets.py), 204/206/304, HEAD,
+  send_file (direct_passthrough), Cache-Control: no-transform, typy spoza listy
+  i treści poniżej RESPONSE_COMPRESSION_MIN_BYTES. Wynik nie mniejszy od oryginału
+  -> wysyłamy oryginał.
+- Odpowiedzi strumieniowane (np. duże listy z json_provider.py) zostają strumieniem:
+  każda partia jest kompresowana i opróżniana (sync flush), bez Content-Length.
+- ETag odpowiedzi skompresowanej dostaje sufiks kodowania (inna treść = inny ETag).
+- Metryki: http_compression_ratio (rozmiar po / przed) oraz bajty przed i po, wg kodowania.
+
+Konfiguracja (zmienne środowiskowe):
+- RESPONSE_COMPRESSION            - 0 = wyłączone (np. gdy kompresuje nginx)
+- RESPONSE_COMPRESSION_MIN_BYTES  - próg rozmiaru treści
+- RESPONSE_GZIP_LEVEL             - poziom gzip/deflate (1-9)
+- RESPONSE_BROTLI_QUALITY         - jakość brotli (0-11; wysokie są za wolne na odpowiedzi w locie)
+"""
+import os
+import zlib
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # opcjonalne - bez brotli gzip/deflate
+    brotli = None
+
+RESPONSE_COMPRESSION_ENABLED = os.environ.get('RESPONSE_COMPRESSION', '1') == '1'
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+}
+SKIPPED_STATUS_CODES = {204, 206, 304}
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES or mimetype.endswith('+json')
+
+
+def choose_encoding(accept_encodings) -> str:
+    """Najlepsze kodowanie akceptowane przez klienta (werkzeug request.accept_encodings) albo None."""
+    for encoding in ('br', 'gzip', 'deflate'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """Wspólny interfejs strumieniowej kompresji: compress(partia) / flush() / finish()."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=RESPONSE_BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            # gzip: nagłówek gzip (wbits 16+), deflate: strumień zlib (RFC 1950) jak oczekują przeglądarki
+            wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+            self._zlib = zlib.compressobj(RESPONSE_GZIP_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._zlib is not None:
+            return self._zlib.compress(data)
+        return self._brotli.process(data)
+
+    def flush(self) -> bytes:
+        if self._zlib is not None:
+            return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        return self._brotli.flush()
+
+    def finish(self) -> bytes:
+        if self._zlib is not None:
+            return self._zlib.flush(zlib.Z_FINISH)
+        return self._brotli.finish()
+
+
+def _record(encoding: str, original: int, compressed: int) -> None:
+    if original <= 0:
+        return
+    metrics.observe("http_compression_ratio", compressed / original, encoding=encoding)
+    metrics.inc("http_compression_input_bytes_total", original, encoding=encoding)
+    metrics.inc("http_compression_output_bytes_total", compressed, encoding=encoding)
+
+
+def _iter_compressed(chunks, compressor: _Compressor, close=None):
+    """Strumień partii -> strumień skompresowany; metryki po wysłaniu całości."""
+    original = compressed = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            original += len(chunk)
+            data = compressor.compress(chunk) + compressor.flush()
+            compressed += len(data)
+            if data:
+                yield data
+        tail = compressor.finish()
+        compressed += len(tail)
+        if tail:
+            yield tail
+        _record(compressor.encoding, original, compressed)
+    finally:
+        if close is not None:
+            close()
+
+
+def compress_response(response, request):
+    """Kompresuje odpowiedź, jeśli klient to akceptuje i ma to sens (after_request)."""
+    if not RESPONSE_COMPRESSION_ENABLED:
+        return response
+    if (
+        response.status_code in SKIPPED_STATUS_CODES
+        or response.status_code < 200
+        or request.method == 'HEAD'
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or not _is_compressible(response.mimetype or '')
+        or 'no-transform' in (response.headers.get('Cache-Control') or '')
+    ):
+        return response
+
+    # Treść zależy od Accept-Encoding - także gdy tym razem nie kompresujemy
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    if response.is_streamed:
+        iterable = response.response
+        response.response = _iter_compressed(iterable, _Compressor(encoding), getattr(iterable, 'close', None))
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+        compressor = _Compressor(encoding)
+        data = compressor.compress(body) + compressor.finish()
+        if len(data) >= len(body):
+            return response
+        response.set_data(data)
+        _record(encoding, len(body), len(data))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
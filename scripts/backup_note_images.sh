@@ -1,21 +1,18 @@
 #!/usr/bin/env bash
+# Kopia zapasowa bazy i zdjęć notatek - nakładka na backup.py
+# (snapshoty zdjęć na twardych dowiązaniach, kopia bazy przez sqlite3 backup API).
+#
+# Użycie: scripts/backup_note_images.sh [db|images|all|verify] [opcje backup.py]   (domyślnie: all)
+#         np. scripts/backup_note_images.sh verify --snapshot NAZWA
+# Zmienne: NOTE_IMAGES_DIR, NOTE_IMAGES_BACKUP_DIR, NOTE_IMAGES_BACKUP_RETENTION_DAYS,
+#          DB_BACKUP_SOURCE, DB_BACKUP_DIR (opis w backup.py)
 set -euo pipefail
 
-SRC_DIR="${NOTE_IMAGES_DIR:-./data/note_images}"
-BACKUP_ROOT="${NOTE_IMAGES_BACKUP_DIR:-./data/backups/note_images}"
-RETENTION_DAYS="${NOTE_IMAGES_BACKUP_RETENTION_DAYS:-14}"
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+PYTHON="${PYTHON:-python3}"
 
-TIMESTAMP="$(date +%Y%m%d_%H%M%S)"
-DEST_DIR="${BACKUP_ROOT}/${TIMESTAMP}"
-
-mkdir -p "${DEST_DIR}"
-
-if [[ -d "${SRC_DIR}" ]]; then
-  rsync -a --delete "${SRC_DIR}/" "${DEST_DIR}/"
-  echo "Backup completed: ${DEST_DIR}"
-else
-  echo "Source directory does not exist: ${SRC_DIR}" >&2
-  exit 1
+if [ "$#" -eq 0 ]; then
+    set -- all
 fi
 
-find "${BACKUP_ROOT}" -mindepth 1 -maxdepth 1 -type d -mtime +"${RETENTION_DAYS}" -print -exec rm -rf {} +
+exec "${PYTHON}" "${SCRIPT_DIR}/../backup.py" "$@"
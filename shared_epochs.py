@@ -0,0 +1,40 @@
+"""
+Epoki unieważnień cache współdzielone między workerami (pamięć współdzielona).
+
+Każdy worker trzyma własny cache w pamięci; zapis w jednym workerze musi unieważnić
+wpisy we wszystkich. Zamiast rozsyłać komunikaty trzymamy w pamięci współdzielonej
+(multiprocessing.Array, tworzona przed fork - gunicorn z preload_app) tablicę liczników:
+- slot 0          - epoka globalna (unieważnia wszystko)
+- sloty 1..N      - epoki kluczy (hash klucza modulo N)
+
+Wpis cache zapamiętuje epoki z chwili odczytu z bazy (przed zapytaniem!); przy trafieniu
+porównujemy je z bieżącymi. Kolizje hashy powodują tylko nadmiarowe unieważnienia.
+
+Bez preload (każdy worker importuje moduł osobno) tablice są niezależne - unieważnienia
+działają wtedy tylko w obrębie procesu.
+"""
+import multiprocessing
+import zlib
+
+
+class SharedEpochs:
+    """Tablica liczników epok w pamięci współdzielonej procesów."""
+
+    def __init__(self, slots: int = 1024):
+        self.slots = max(1, slots)
+        self._array = multiprocessing.Array('Q', self.slots + 1)
+
+    def _slot(self, key: str) -> int:
+        return 1 + zlib.crc32(key.encode("utf-8")) % self.slots
+
+    def snapshot(self, key: str) -> tuple:
+        """(epoka globalna, epoka klucza) - odczyt bez blokady (wyrównane 64 bity)."""
+        values = self._array.get_obj()
+        return values[0], values[self._slot(key)]
+
+    def bump(self, key: str = None) -> None:
+        """Unieważnia klucz (lub wszystko, gdy key=None) we wszystkich procesach."""
+        index = 0 if key is None else self._slot(key)
+        with self._array.get_lock():
+            values = self._array.get_obj()
+            values[index] += 1
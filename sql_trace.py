@@ -0,0 +1,250 @@
+"""
+Śledzenie zapytań SQLite (opcjonalne, SQL_TRACE=1) i log wolnych zapytań.
+
+Per połączenie (Database.get_connection):
+- set_trace_callback   - początek każdej instrukcji (z podstawionymi parametrami), także
+                         BEGIN/COMMIT wykonywanych niejawnie przez moduł sqlite3
+- set_progress_handler - "tyknięcia" co SQL_TRACE_PROGRESS_OPS instrukcji VM; koniec
+                         instrukcji bez jawnego zakończenia = ostatnie tyknięcie
+- TimedCursor/TimedConnection (metrics.py) zamykają instrukcję po powrocie execute/fetchall/
+  commit, więc czas obejmuje też oczekiwanie na blokadę (busy_timeout) i fsync przy COMMIT.
+
+Każda instrukcja jest przypisywana do metody Database (najbardziej zewnętrzna ramka
+z database.py na stosie) i do endpointu HTTP (contextvar ustawiany w before_request).
+Statystyki agregujemy po znormalizowanym SQL (literały -> ?), per proces.
+
+Instrukcje powyżej SQL_SLOW_MS trafiają do rotowanego logu SQL_SLOW_LOG razem z
+EXPLAIN QUERY PLAN (liczonym na osobnym połączeniu tylko do odczytu, z cache per SQL).
+
+Konfiguracja (zmienne środowiskowe):
+- SQL_TRACE                 - 1 = włączone (domyślnie wyłączone, zero narzutu)
+- SQL_SLOW_MS               - próg wolnego zapytania w ms
+- SQL_SLOW_LOG              - plik logu (rotacja: SQL_SLOW_LOG_MAX_BYTES x SQL_SLOW_LOG_BACKUPS)
+- SQL_TRACE_PROGRESS_OPS    - co ile instrukcji VM wywoływany jest progress handler
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+SQL_TRACE_ENABLED = os.environ.get('SQL_TRACE', '0') == '1'
+SQL_SLOW_MS = float(os.environ.get('SQL_SLOW_MS', '100'))
+SQL_SLOW_LOG = os.environ.get('SQL_SLOW_LOG', './data/logs/slow_queries.log')
+SQL_SLOW_LOG_MAX_BYTES = int(os.environ.get('SQL_SLOW_LOG_MAX_BYTES', str(5 * 1024 * 1024)))
+SQL_SLOW_LOG_BACKUPS = int(os.environ.get('SQL_SLOW_LOG_BACKUPS', '5'))
+SQL_TRACE_PROGRESS_OPS = int(os.environ.get('SQL_TRACE_PROGRESS_OPS', '1000'))
+# Limit różnych (sql, metoda, endpoint) w statystykach - najrzadsze wypadają
+SQL_TRACE_MAX_STATEMENTS = 2000
+
+_DATABASE_FILE = os.path.normcase(os.path.abspath(os.path.join(os.path.dirname(__file__), 'database.py')))
+_OWN_FILES = {
+    os.path.normcase(os.path.abspath(__file__)),
+    os.path.normcase(os.path.abspath(os.path.join(os.path.dirname(__file__), 'metrics.py'))),
+}
+_PROJECT_DIR = os.path.normcase(os.path.abspath(os.path.dirname(__file__)))
+
+_current_route = contextvars.ContextVar("sql_trace_route", default=None)
+
+_stats_lock = threading.Lock()
+# (znormalizowany sql, metoda, endpoint) -> [liczba, suma ms, max ms]
+_stats: "OrderedDict[tuple, list]" = OrderedDict()
+_plan_cache: "OrderedDict[str, list]" = OrderedDict()
+_plan_local = threading.local()
+_slow_logger = None
+_slow_logger_lock = threading.Lock()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL bez literałów (-> ?) i nadmiarowych białych znaków - klucz agregacji."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    return _IN_LIST.sub("(?, ...)", sql)
+
+
+def set_route(route) -> None:
+    _current_route.set(route)
+
+
+def _caller() -> str:
+    """Najbardziej zewnętrzna metoda Database na stosie; bez niej - pierwsza ramka projektu."""
+    frame = sys._getframe(2)
+    method = None
+    fallback = None
+    while frame is not None:
+        filename = os.path.normcase(os.path.abspath(frame.f_code.co_filename))
+        if filename == _DATABASE_FILE and not frame.f_code.co_name.startswith("<"):
+            method = f"Database.{frame.f_code.co_name}"
+        elif fallback is None and filename not in _OWN_FILES and filename.startswith(_PROJECT_DIR):
+            fallback = f"{os.path.splitext(os.path.basename(filename))[0]}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return method or fallback or "<unknown>"
+
+
+def _get_slow_logger():
+    global _slow_logger
+    with _slow_logger_lock:
+        if _slow_logger is None:
+            Path(SQL_SLOW_LOG).parent.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger("koperty.slow_sql")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(SQL_SLOW_LOG, maxBytes=SQL_SLOW_LOG_MAX_BYTES, backupCount=SQL_SLOW_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _slow_logger = logger
+        return _slow_logger
+
+
+def _query_plan(db_path: str, sql: str, normalized: str) -> list:
+    """EXPLAIN QUERY PLAN na osobnym połączeniu (read-only), z cache per znormalizowany SQL."""
+    with _stats_lock:
+        if normalized in _plan_cache:
+            return _plan_cache[normalized]
+    keyword = normalized.split(" ", 1)[0].upper()
+    if keyword not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE"):
+        return []
+    connections = getattr(_plan_local, "connections", None)
+    if connections is None:
+        connections = _plan_local.connections = {}
+    try:
+        conn = connections.get(db_path)
+        if conn is None:
+            conn = connections[db_path] = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+    except sqlite3.Error as e:
+        plan = [f"<brak planu: {e}>"]
+    with _stats_lock:
+        _plan_cache[normalized] = plan
+        while len(_plan_cache) > 500:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+class StatementTracer:
+    """Stan śledzenia jednego połączenia: bieżąca instrukcja i jej ostatnie tyknięcie."""
+
+    __slots__ = ("db_path", "_sql", "_caller", "_route", "_started", "_last_tick")
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._sql = None
+        self._caller = None
+        self._route = None
+        self._started = 0.0
+        self._last_tick = 0.0
+
+    def on_statement(self, sql: str) -> None:
+        # Instrukcja bez jawnego zakończenia (np. niejawny BEGIN) - koniec przy ostatnim tyknięciu
+        if self._sql is not None:
+            self._close(self._last_tick)
+        now = time.perf_counter()
+        self._sql = sql
+        self._caller = _caller()
+        self._route = _current_route.get()
+        self._started = now
+        self._last_tick = now
+
+    def on_progress(self) -> int:
+        self._last_tick = time.perf_counter()
+        return 0  # 0 = kontynuuj wykonanie
+
+    def finish(self) -> None:
+        """Zakończenie instrukcji - wołane po powrocie execute/fetchall/commit."""
+        if self._sql is not None:
+            self._close(time.perf_counter())
+
+    def _close(self, ended: float) -> None:
+        sql, self._sql = self._sql, None
+        elapsed_ms = max(0.0, ended - self._started) * 1000.0
+        normalized = normalize_sql(sql)
+        key = (normalized, self._caller, self._route or "")
+        with _stats_lock:
+            entry = _stats.get(key)
+            if entry is None:
+                entry = _stats[key] = [0, 0.0, 0.0]
+                if len(_stats) > SQL_TRACE_MAX_STATEMENTS:
+                    # usuń najrzadszą instrukcję (poza bieżącą)
+                    victim = min((k for k in _stats if k != key), key=lambda k: _stats[k][1])
+                    _stats.pop(victim, None)
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            if elapsed_ms > entry[2]:
+                entry[2] = elapsed_ms
+        if elapsed_ms >= SQL_SLOW_MS:
+            self._log_slow(sql, normalized, elapsed_ms)
+
+    def _log_slow(self, sql: str, normalized: str, elapsed_ms: float) -> None:
+        try:
+            record = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "ms": round(elapsed_ms, 2),
+                "method": self._caller,
+                "route": self._route,
+                "sql": sql[:2000],
+                "plan": _query_plan(self.db_path, sql, normalized),
+            }
+            _get_slow_logger().info(json.dumps(record, ensure_ascii=False))
+        except Exception:
+            pass  # log wolnych zapytań nie może przerwać requestu
+
+
+def _reset_after_fork() -> None:
+    """Worker po fork: własne statystyki i połączenia do planów (nie dziedziczymy po rodzicu)."""
+    global _stats_lock, _plan_local, _slow_logger_lock
+    _stats_lock = threading.Lock()
+    _slow_logger_lock = threading.Lock()
+    _plan_local = threading.local()
+    _stats.clear()
+    _plan_cache.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def instrument(conn, db_path: str) -> None:
+    """Podpina trace callback i progress handler do połączenia (TimedConnection)."""
+    tracer = StatementTracer(db_path)
+    conn.set_trace_callback(tracer.on_statement)
+    conn.set_progress_handler(tracer.on_progress, SQL_TRACE_PROGRESS_OPS)
+    conn.sql_tracer = tracer
+
+
+def top_statements(limit: int = 20, sort: str = "total_ms") -> list:
+    """Top-N instrukcji (per proces) wg łącznego czasu / max / liczby wykonań."""
+    with _stats_lock:
+        rows = [
+            {
+                "sql": key[0],
+                "method": key[1],
+                "route": key[2] or None,
+                "count": entry[0],
+                "total_ms": round(entry[1], 3),
+                "avg_ms": round(entry[1] / entry[0], 3) if entry[0] else 0.0,
+                "max_ms": round(entry[2], 3),
+            }
+            for key, entry in _stats.items()
+        ]
+    if sort not in ("total_ms", "max_ms", "avg_ms", "count"):
+        sort = "total_ms"
+    rows.sort(key=lambda row: row[sort], reverse=True)
+    return rows[:limit]
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+        _plan_cache.clear()
@@ -0,0 +1,91 @@
+"""
+Profil startu aplikacji (STARTUP_PROFILE=1): czas poszczególnych faz zimnego startu.
+
+Fazy:
+- imports        - import api_server i zależności (bez faz zagnieżdżonych poniżej)
+- schema         - przebieg schematu/migracji bazy (tylko gdy PRAGMA user_version jest stara)
+- seed           - seed użytkowników i maszyn (PBKDF2 PIN-ów)
+- app            - rejestracja endpointów, hooków itd. (reszta modułu api_server)
+- demo_data      - dane przykładowe (init_demo_envelopes)
+- first_request  - obsługa pierwszego requestu
+
+Raport (stdout) jest wypisywany po pierwszym requeście, razem z czasem od importu tego
+modułu do odpowiedzi. Szczegóły importów: python -X importtime -c "import api_server".
+Bez flagi wszystkie funkcje są pustymi wywołaniami.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STARTUP_PROFILE_ENABLED = os.environ.get('STARTUP_PROFILE', '0') == '1'
+
+_started = time.perf_counter()
+_last_checkpoint = _started
+_nested_ms = 0.0
+_phases: list = []          # [(nazwa, ms)]
+_first_request_lock = threading.Lock()
+_first_request_started = None
+_reported = False
+
+
+def _record(name: str, ms: float) -> None:
+    _phases.append((name, ms))
+
+
+@contextmanager
+def phase(name: str):
+    """Mierzy fazę zagnieżdżoną w innej (np. schemat bazy w trakcie importów)."""
+    global _nested_ms
+    if not STARTUP_PROFILE_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - started) * 1000.0
+        _nested_ms += ms
+        _record(name, ms)
+
+
+def checkpoint(name: str) -> None:
+    """Zamyka fazę liniową: czas od poprzedniego checkpointu minus fazy zagnieżdżone."""
+    global _last_checkpoint, _nested_ms
+    if not STARTUP_PROFILE_ENABLED:
+        return
+    now = time.perf_counter()
+    _record(name, max(0.0, (now - _last_checkpoint) * 1000.0 - _nested_ms))
+    _last_checkpoint = now
+    _nested_ms = 0.0
+
+
+def request_started() -> None:
+    global _first_request_started
+    if not STARTUP_PROFILE_ENABLED or _first_request_started is not None:
+        return
+    with _first_request_lock:
+        if _first_request_started is None:
+            _first_request_started = time.perf_counter()
+
+
+def request_finished() -> None:
+    """Po pierwszym requeście wypisuje raport (raz na proces)."""
+    global _reported
+    if not STARTUP_PROFILE_ENABLED or _reported or _first_request_started is None:
+        return
+    with _first_request_lock:
+        if _reported:
+            return
+        _reported = True
+    now = time.perf_counter()
+    _record("first_request", (now - _first_request_started) * 1000.0)
+    print(f"⏱️ Profil startu (pid {os.getpid()}):")
+    for name, ms in _phases:
+        print(f"   {name:<14} {ms:9.1f} ms")
+    print(f"   {'do odpowiedzi':<14} {(now - _started) * 1000.0:9.1f} ms (od importu aplikacji)")
+
+
+def report() -> dict:
+    """Zebrane fazy (ms) - np. do testów zimnego startu."""
+    return {"phases": [{"name": name, "ms": round(ms, 2)} for name, ms in _phases], "enabled": STARTUP_PROFILE_ENABLED}
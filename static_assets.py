@@ -0,0 +1,281 @@
+"""
+Pliki frontendu: prekompresja (gzip/brotli), odciski treści i cache przeglądarki.
+
+- Zasoby: *.html, *.js, *.css z katalogu aplikacji oraz vendor/.
+- Każdy zasób ma odcisk (pierwsze znaki sha256 treści) i adres
+  /assets/<nazwa>.<odcisk>.<ext>, np. /assets/translations.1a2b3c4d5e6f.js.
+  Taki adres nigdy nie zmienia treści: Cache-Control: immutable na rok - po pierwszej
+  wizycie tablet nie pyta o niego wcale.
+- Strony HTML (prototype.html, generator-qr.html, ...) mają odwołania do zasobów
+  ("translations.js", 'vendor/konva.min.js') podmienione na adresy z odciskiem i są
+  serwowane z Cache-Control: no-cache + ETag - ponowna wizyta to odpowiedź 304 bez treści.
+- Warianty gzip i brotli (jeśli jest biblioteka brotli) liczone raz i trzymane w pamięci
+  oraz w STATIC_BUILD_DIR (nazwy po sha256 wariantu źródłowego), więc kolejny start
+  tylko je wczytuje. Wybór wg Accept-Encoding (br > gzip > bez kompresji); wariant jest
+  używany tylko, gdy jest mniejszy od oryginału.
+- Stare adresy (/translations.js) nadal działają - bez immutable, z ETag.
+
+Budowa przed startem (np. w buildCommand): python static_assets.py build
+W trybie deweloperskim (APP_ENV=development) zmienione pliki są przebudowywane przy
+kolejnym żądaniu (sprawdzenie mtime nie częściej niż co STATIC_RELOAD_SECONDS).
+
+Konfiguracja (zmienne środowiskowe):
+- STATIC_BUILD_DIR          - katalog wariantów skompresowanych
+- STATIC_BROTLI_QUALITY     - jakość brotli (0-11)
+- STATIC_GZIP_LEVEL         - poziom gzip (1-9)
+- STATIC_RELOAD_SECONDS     - jak często sprawdzać zmiany plików w trybie deweloperskim
+"""
+import gzip
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # opcjonalne - bez brotli tylko gzip
+    brotli = None
+
+APP_DIR = Path(__file__).resolve().parent
+STATIC_BUILD_DIR = Path(os.environ.get('STATIC_BUILD_DIR', './data/static_assets'))
+STATIC_BROTLI_QUALITY = int(os.environ.get('STATIC_BROTLI_QUALITY', '11'))
+STATIC_GZIP_LEVEL = int(os.environ.get('STATIC_GZIP_LEVEL', '9'))
+STATIC_RELOAD_SECONDS = float(os.environ.get('STATIC_RELOAD_SECONDS', '1'))
+
+ASSET_EXTENSIONS = ('.html', '.js', '.css')
+ASSET_DIRS = ('', 'vendor')
+ASSETS_URL_PREFIX = '/assets/'
+FINGERPRINT_LENGTH = 12
+
+_FINGERPRINTED_NAME = re.compile(r'^(.+)\.[0-9a-f]{%d}(\.[a-z]+)$' % FINGERPRINT_LENGTH)
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+MIMETYPES = {
+    '.html': 'text/html',
+    '.js': 'text/javascript',
+    '.css': 'text/css',
+}
+
+
+class Asset:
+    """Jeden plik: treść (po przepisaniu odwołań dla HTML), odcisk i warianty kompresji."""
+
+    __slots__ = ("name", "source", "mtime_ns", "body", "digest", "etag", "variants", "mimetype")
+
+    def __init__(self, name: str, source: Path, mtime_ns: int, body: bytes):
+        self.name = name                  # ścieżka logiczna, np. "vendor/konva.min.js"
+        self.source = source
+        self.mtime_ns = mtime_ns
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = self.digest[:32]
+        self.variants: dict = {}          # "br" / "gzip" -> bajty (tylko mniejsze od body)
+        self.mimetype = MIMETYPES[os.path.splitext(name)[1]]
+
+    @property
+    def fingerprinted_url(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{ASSETS_URL_PREFIX}{stem}.{self.digest[:FINGERPRINT_LENGTH]}{ext}"
+
+    @property
+    def is_html(self) -> bool:
+        return self.name.endswith('.html')
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL, mtime=0)
+
+
+def _encodings() -> tuple:
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _attach_variants(asset: Asset, build_dir: Path) -> int:
+    """Warianty z build_dir albo liczone na nowo (i zapisywane). Zwraca liczbę skompresowanych."""
+    compressed = 0
+    for encoding in _encodings():
+        suffix = 'br' if encoding == 'br' else 'gz'
+        cached = build_dir / f"{asset.digest}.{suffix}"
+        data = None
+        if cached.exists():
+            try:
+                data = cached.read_bytes()
+            except OSError:
+                data = None
+        if data is None:
+            data = _compress(asset.body, encoding)
+            compressed += 1
+            try:
+                build_dir.mkdir(parents=True, exist_ok=True)
+                tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, cached)
+            except OSError:
+                pass  # brak zapisu = liczymy ponownie przy następnym starcie
+        if len(data) < len(asset.body):
+            asset.variants[encoding] = data
+    return compressed
+
+
+def _discover(root: Path) -> dict:
+    """{ścieżka logiczna: plik} - pliki frontendu z katalogu aplikacji i vendor/."""
+    found = {}
+    for directory in ASSET_DIRS:
+        base = root / directory if directory else root
+        if not base.is_dir():
+            continue
+        for path in sorted(base.iterdir()):
+            if path.is_file() and path.suffix in ASSET_EXTENSIONS:
+                found[f"{directory}/{path.name}" if directory else path.name] = path
+    return found
+
+
+def _reference_pattern(names) -> "re.Pattern":
+    """Odwołania do zasobów w cudzysłowach: "translations.js", './vendor/konva.min.js'."""
+    alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    return re.compile(r"""(["'])(?:\./|/)?(""" + alternatives + r""")\1""")
+
+
+class AssetPipeline:
+    """Zbiór zasobów aplikacji; budowa przy starcie, odczyt bez blokad."""
+
+    def __init__(self, root: Path = APP_DIR, build_dir: Path = STATIC_BUILD_DIR, reload: bool = False):
+        self.root = root
+        self.build_dir = build_dir
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._by_name: dict = {}
+        self._by_url: dict = {}
+        self._sources: dict = {}
+        self._last_check = 0.0
+        self.stats = {"assets": 0, "compressed": 0, "build_ms": 0.0}
+
+    def build(self) -> dict:
+        """Wczytuje pliki, przepisuje HTML, dołącza warianty. Zwraca statystyki."""
+        started = time.perf_counter()
+        sources = _discover(self.root)
+        plain, compressed = {}, 0
+        for name, path in sources.items():
+            stat = path.stat()
+            plain[name] = Asset(name, path, stat.st_mtime_ns, path.read_bytes())
+
+        # Najpierw zasoby bez HTML (ich odciski trafiają do HTML), potem strony
+        urls = {name: asset.fingerprinted_url for name, asset in plain.items() if not asset.is_html}
+        pattern = _reference_pattern(urls) if urls else None
+        by_name = {}
+        for name, asset in plain.items():
+            if asset.is_html and pattern is not None:
+                text = asset.body.decode('utf-8')
+                rewritten = pattern.sub(lambda m: f"{m.group(1)}{urls[m.group(2)]}{m.group(1)}", text)
+                asset = Asset(name, asset.source, asset.mtime_ns, rewritten.encode('utf-8'))
+            compressed += _attach_variants(asset, self.build_dir)
+            by_name[name] = asset
+
+        with self._lock:
+            self._by_name = by_name
+            self._by_url = {asset.fingerprinted_url: asset for asset in by_name.values()}
+            self._sources = {name: asset.mtime_ns for name, asset in by_name.items()}
+            self._last_check = time.monotonic()
+        self.stats = {
+            "assets": len(by_name),
+            "compressed": compressed,
+            "build_ms": round((time.perf_counter() - started) * 1000.0, 1),
+            "encodings": list(_encodings()),
+        }
+        return self.stats
+
+    def _maybe_reload(self) -> None:
+        """Tryb deweloperski: przebudowa po zmianie mtime któregoś pliku."""
+        if not self.reload or time.monotonic() - self._last_check < STATIC_RELOAD_SECONDS:
+            return
+        self._last_check = time.monotonic()
+        sources = _discover(self.root)
+        current = {}
+        for name, path in sources.items():
+            try:
+                current[name] = path.stat().st_mtime_ns
+            except OSError:
+                continue
+        if current != self._sources:
+            self.build()
+
+    def get(self, name: str):
+        """Zasób po ścieżce logicznej (np. "translations.js") albo None."""
+        self._maybe_reload()
+        return self._by_name.get(name.lstrip('/'))
+
+    def get_fingerprinted(self, path: str) -> tuple:
+        """
+        Zasób po adresie /assets/... -> (zasób, czy odcisk aktualny).
+        Stary odcisk (strona HTML sprzed wdrożenia) -> bieżąca wersja zasobu, False.
+        """
+        self._maybe_reload()
+        asset = self._by_url.get(ASSETS_URL_PREFIX + path.lstrip('/'))
+        if asset is not None:
+            return asset, True
+        match = _FINGERPRINTED_NAME.match(path.lstrip('/'))
+        if match is None:
+            return None, False
+        return self._by_name.get(match.group(1) + match.group(2)), False
+
+    def cleanup_build_dir(self) -> int:
+        """Usuwa z STATIC_BUILD_DIR warianty nieużywane przez bieżące pliki."""
+        keep = {asset.digest for asset in self._by_name.values()}
+        removed = 0
+        if not self.build_dir.is_dir():
+            return 0
+        for path in self.build_dir.iterdir():
+            if path.suffix in ('.gz', '.br') and path.stem not in keep:
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def choose_encoding(asset: Asset, accept_encodings) -> str:
+    """Najlepszy dostępny wariant wg Accept-Encoding (werkzeug request.accept_encodings)."""
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.variants and accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+def make_response(app, request, asset: Asset, immutable: bool):
+    """Odpowiedź z właściwym wariantem, ETag (per wariant) i nagłówkami cache; 304 przy zgodnym ETag."""
+    encoding = choose_encoding(asset, request.accept_encodings)
+    body = asset.body if encoding == 'identity' else asset.variants[encoding]
+    response = app.response_class(body, mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    response.set_etag(asset.etag if encoding == 'identity' else f"{asset.etag}-{encoding}")
+    return response.make_conditional(request)
+
+
+def main(argv=None) -> int:
+    """python static_assets.py build - prekompresja do STATIC_BUILD_DIR."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ['build']:
+        print("Użycie: python static_assets.py build")
+        return 2
+    pipeline = AssetPipeline()
+    stats = pipeline.build()
+    removed = pipeline.cleanup_build_dir()
+    print(f"📦 Zasoby: {stats['assets']}, skompresowane teraz: {stats['compressed']}, "
+          f"kodowania: {', '.join(stats['encodings'])}, {stats['build_ms']} ms, usunięte stare warianty: {removed}")
+    if brotli is None:
+        print("⚠️ Brak biblioteki brotli - tylko gzip (pip install brotli)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
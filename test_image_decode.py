@@ -0,0 +1,61 @@
+"""
+Zmniejszone dekodowanie JPEG (image_processing): rozmiar po draft() i rezerwacja budżetu pikseli.
+
+Uruchomienie: python test_image_decode.py  (albo pytest test_image_decode.py)
+"""
+import io
+
+from PIL import Image
+
+import image_processing
+
+MAX_DIM = image_processing.MAX_IMAGE_DIM
+
+# (rozmiar źródła 4:3, oczekiwany rozmiar po dekodowaniu w skali DCT)
+CASES = [
+    ((8000, 6000), (2000, 1500)),   # 48 MP -> 1/4
+    ((6000, 8000), (1500, 2000)),   # pion
+    ((4000, 3000), (2000, 1500)),   # typowe zdjęcie z telefonu -> 1/2
+    ((3000, 4000), (1500, 2000)),
+    ((2000, 1500), (2000, 1500)),   # 1/2 dałoby dłuższy bok < MAX_DIM - bez zmniejszania
+]
+
+
+def _jpeg(size) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(out, format="JPEG", quality=70)
+    return out.getvalue()
+
+
+def test_draft_keeps_longest_side_and_reserves_decoded_pixels():
+    reserved = []
+    acquire = image_processing._acquire_pixels
+
+    def recording_acquire(pixels, timeout):
+        reserved.append(pixels)
+        return acquire(pixels, timeout)
+
+    image_processing._acquire_pixels = recording_acquire
+    try:
+        for source, expected in CASES:
+            image = Image.open(io.BytesIO(_jpeg(source)))
+            pixels = image_processing._draft_reduced(image, MAX_DIM)
+            image.load()
+            assert image.size == expected, (source, image.size)
+            assert pixels == expected[0] * expected[1], (source, pixels)
+            assert MAX_DIM <= max(image.size) < 2 * MAX_DIM or max(source) < 2 * MAX_DIM
+
+            reserved.clear()
+            result, error, status = image_processing.normalize_image_bytes(_jpeg(source))
+            assert status == 200, error
+            # Rezerwacja = piksele faktycznie zdekodowane (decode_bytes = piksele x 3 kanały RGB)
+            assert reserved == [expected[0] * expected[1]], (source, reserved)
+            assert result["decode_bytes"] == expected[0] * expected[1] * 3
+            assert max(result["width"], result["height"]) == MAX_DIM
+    finally:
+        image_processing._acquire_pixels = acquire
+
+
+if __name__ == "__main__":
+    test_draft_keeps_longest_side_and_reserves_decoded_pixels()
+    print("✅ test_image_decode OK")
@@ -0,0 +1,18 @@
+"""
+Punkt wejścia WSGI dla serwera produkcyjnego:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Przy preload_app (gunicorn.conf.py) moduł jest importowany raz, w procesie master,
+przed fork workerów - schemat bazy i dane demo inicjalizujemy tu jeden raz, a pamięć
+współdzielona (epoki cache notatek) powstaje przed fork. Stan per proces (pula
+przetwarzania zdjęć, metryki, limiter, statystyki SQL) moduły resetują same
+w os.register_at_fork.
+"""
+import startup_profile
+from api_server import app, init_demo_envelopes
+
+with startup_profile.phase("demo_data"):
+    init_demo_envelopes()
+
+application = app